@@ -2,9 +2,59 @@ from gooey import Gooey, GooeyParser, local_resource_path
 
 from web_autobuy import Autobuy
 
+from multi_autobuy import MultiAutobuy
+
 import gui_menu
 
-from web_analyzer import WebAnalyzer
+from web_analyzer import WebAnalyzer, Category, MEASURED_CATEGORIES
+
+from profile_store import ProfileStore
+
+from logger import log
+
+from session_recorder import SessionRecorder, get_recording_path
+
+from stop_conditions import StopConditions
+
+from stall_watchdog import DEFAULT_STALL_TIMEOUT
+
+from control_server import ControlServer
+
+from metrics_server import MetricsServer
+
+from midpoint_sweep import run_sweep, DEFAULT_SWEEP_RADIUS, DEFAULT_SWEEP_STEP
+
+from multiprocessing import freeze_support
+
+from argparse import ArgumentTypeError
+
+# Defaults of the detection parameters, changed values take priority over the stored profile
+DEFAULT_RING_COLOR = '#918b6a'
+DEFAULT_NODE_TOLERANCE = 20
+
+# Names accepted in the category options, plurals and "add-on" are accepted too
+CATEGORY_NAMES = {
+    "perk" : Category.PERK,
+    "addon" : Category.ADDON,
+    "item" : Category.ITEM,
+    "offering" : Category.OFFERING,
+}
+
+
+# Parses a comma separated list of category names, e.g. "perks, offerings"
+def parse_categories(text: str) -> list:
+    categories = []
+    for name in text.replace(" ", "").lower().split(","):
+        if not name:
+            continue
+        key = name.replace("-", "").rstrip("s")
+        if key not in CATEGORY_NAMES:
+            raise ArgumentTypeError(f"Unknown category '{name}', the categories are {', '.join(CATEGORY_NAMES)}")
+        if CATEGORY_NAMES[key] not in MEASURED_CATEGORIES:
+            raise ArgumentTypeError(f"The '{name}' category can't be recognized yet, only perks can")
+        if CATEGORY_NAMES[key] not in categories:
+            categories.append(CATEGORY_NAMES[key])
+    return categories
 
 @Gooey(
     program_name = 'Bloodweb AutoBuy 1.1.10',
@@ -58,6 +108,20 @@ def main():
                         action='store_true', 
                         help='Buy the nodes in a random order.'
                         )
+
+    options_group.add_argument('--preferred_categories',
+                        metavar='Preferred categories',
+                        default='',
+                        type=parse_categories,
+                        help='Buy nodes of these categories first, in the given order, e.g. "perk".\nOnly perks can be recognized so far'
+                        )
+
+    options_group.add_argument('--excluded_categories',
+                        metavar='Excluded categories',
+                        default='',
+                        type=parse_categories,
+                        help='Buy nodes of these categories only when nothing else is available, e.g. "perk".\nOnly perks can be recognized so far'
+                        )
     
     options_group.add_argument('--should_prestige',
                         action='store_false', 
@@ -94,6 +158,66 @@ def main():
                         help='Stop after this duration (minutes), Set to 0 to disable limit.'
                         )
 
+    options_group.add_argument('--node_limit',
+                        metavar='Node limit',
+                        default=0,
+                        widget='IntegerField',
+                        help='Stop after buying this many nodes. Set to 0 to disable limit.',
+                        gooey_options = {
+                            'min' : 0, 
+                            'max' : 100000, 
+                            'increment' : 1
+                            }
+                        )
+
+    options_group.add_argument('--level_limit',
+                        metavar='Level limit',
+                        default=0,
+                        widget='IntegerField',
+                        help='Stop after completing this many Bloodweb levels. Set to 0 to disable limit.',
+                        gooey_options = {
+                            'min' : 0, 
+                            'max' : 10000, 
+                            'increment' : 1
+                            }
+                        )
+
+    options_group.add_argument('--prestige_limit',
+                        metavar='Prestige limit',
+                        default=0,
+                        widget='IntegerField',
+                        help='Stop after prestiging this many times. Set to 0 to disable limit.',
+                        gooey_options = {
+                            'min' : 0, 
+                            'max' : 100, 
+                            'increment' : 1
+                            }
+                        )
+
+    options_group.add_argument('--bloodpoint_limit',
+                        metavar='Bloodpoint budget',
+                        default=0,
+                        widget='IntegerField',
+                        help='Stop after spending an estimated amount of bloodpoints, based on the rarities of the bought nodes. Set to 0 to disable limit.',
+                        gooey_options = {
+                            'min' : 0, 
+                            'max' : 100000000, 
+                            'increment' : 10000
+                            }
+                        )
+
+    options_group.add_argument('--stall_timeout',
+                        metavar='Stall recovery',
+                        default=DEFAULT_STALL_TIMEOUT,
+                        widget='DecimalField',
+                        help='When nothing on the Bloodweb changes for this many seconds, focus the game window, then look it up again, and finally pause and save a diagnostic snapshot. Set to 0 to disable.',
+                        gooey_options = {
+                            'min' : 0, 
+                            'max' : 3600, 
+                            'increment' : 5
+                            }
+                        )
+
     
     options_group.add_argument('-m', '--monitor_index',
                         default=0,
@@ -107,6 +231,12 @@ def main():
                             }
                         )
     
+    options_group.add_argument('--monitor_indices',
+                        metavar='Multiple clients',
+                        default='',
+                        help='Comma separated monitor indices, one for each game client, e.g. 1,2. Leave empty to run a single client.'
+                        )
+    
     advanced_group.add_argument('--first_timing_offset',
                         metavar='Fine-tune buying interval (First 5 nodes)',
                         default=0.0,
@@ -131,14 +261,44 @@ def main():
                             }
                         )
     
+    advanced_group.add_argument('--batch_buy',
+                        metavar='Batch buying',
+                        action='store_true', 
+                        help='Buy the first nodes of each level from a single scan, only verifying each node before clicking it',
+                        widget="BlockCheckbox",
+                        gooey_options={
+                            'checkbox_label' : "Enable batch buying"
+                            }
+                        )
+
+    advanced_group.add_argument('--auto_tune',
+                        metavar='Auto-tune buying interval',
+                        action='store_true', 
+                        help='Learn the shortest buying intervals that do not miss purchases. The fine-tune sliders set the starting point',
+                        widget="BlockCheckbox",
+                        gooey_options={
+                            'checkbox_label' : "Enable auto-tuning"
+                            }
+                        )
+
     advanced_group.add_argument('--ring_color',
-                        default='#918b6a',
+                        default=DEFAULT_RING_COLOR,
                         metavar='Purchasable node ring color',
                         help="""Customize the color that's used to detect whether a node is purchasable.\nSampled in the middle of a node's yellow ring. Default: [R: 145, G: 139, B: 106]""", 
                         widget='ColourChooser') 
 
+    advanced_group.add_argument('--calibrate_ring_color',
+                        metavar='Calibrate ring color',
+                        action='store_true', 
+                        help='Find the ring color and detection threshold from the Bloodweb on the screen at startup.\nThe Bloodweb needs to be open with some available nodes',
+                        widget="BlockCheckbox",
+                        gooey_options={
+                            'checkbox_label' : "Calibrate on start"
+                            }
+                        )
+
     advanced_group.add_argument('--node_color_threshold',
-                        default=20,
+                        default=DEFAULT_NODE_TOLERANCE,
                         metavar='Node color detection threshold',
                         help="""Customize the detection tolerance for nodes. Too high values can result in false positives.\nDefault: 20""",
                         widget='Slider',
@@ -149,6 +309,82 @@ def main():
                             }
                         )
 
+    advanced_group.add_argument('--adaptive_tolerance',
+                        metavar='Adaptive detection threshold',
+                        action='store_true', 
+                        help='Adjust the node color detection threshold during the session to the gap between available and unavailable nodes',
+                        widget="BlockCheckbox",
+                        gooey_options={
+                            'checkbox_label' : "Enable adaptive threshold"
+                            }
+                        )
+
+    advanced_group.add_argument('--detect_events',
+                        metavar='Detect event nodes',
+                        action='store_true', 
+                        help='Tell event nodes apart from uncommon nodes by the lit up area around their icon.\nExperimental, the colors used are estimates that have not been checked against the game',
+                        widget="BlockCheckbox",
+                        gooey_options={
+                            'checkbox_label' : "Enable event node detection"
+                            }
+                        )
+
+    advanced_group.add_argument('--min_confidence',
+                        default=0,
+                        metavar='Minimum detection confidence',
+                        help="""Nodes detected with a lower confidence are scanned again before buying.\n0% buys everything within the threshold. Default: 0%""",
+                        widget='Slider',
+                        gooey_options = {
+                            'min' : 0, 
+                            'max' : 100, 
+                            'increment' : 1
+                            }
+                        )
+
+    advanced_group.add_argument('--recalibrate',
+                        metavar='Recalibrate',
+                        action='store_true', 
+                        help='Ignore the stored profile for the game window and derive the calibration again',
+                        widget="BlockCheckbox",
+                        gooey_options={
+                            'checkbox_label' : "Refresh stored profile"
+                            }
+                        )
+
+    advanced_group.add_argument('--record_session',
+                        metavar='Record session',
+                        action='store_true', 
+                        help='Record the analyzed frames, detections and clicks to BloodwebAutoBuy/recordings in the home directory',
+                        widget="BlockCheckbox",
+                        gooey_options={
+                            'checkbox_label' : "Enable recording"
+                            }
+                        )
+
+    advanced_group.add_argument('--control_port',
+                        metavar='Control port',
+                        default=0,
+                        widget='IntegerField',
+                        help='Accept pause, resume, stop and status commands from other programs on this local TCP port. Set to 0 to disable.',
+                        gooey_options = {
+                            'min' : 0, 
+                            'max' : 65535, 
+                            'increment' : 1
+                            }
+                        )
+
+    advanced_group.add_argument('--metrics_port',
+                        metavar='Metrics port',
+                        default=0,
+                        widget='IntegerField',
+                        help='Serve session metrics for Prometheus at http://127.0.0.1:<port>/metrics. Set to 0 to disable.',
+                        gooey_options = {
+                            'min' : 0, 
+                            'max' : 65535, 
+                            'increment' : 1
+                            }
+                        )
+
     advanced_group.add_argument('-v', '--verbose',
                         metavar='Verbose output',
                         action='store_true', 
@@ -178,6 +414,41 @@ def main():
                             }
                         )
 
+    unsupported_resolution_group.add_argument('--unsupported_resolution_sweep',
+                        metavar='Search midpoint',
+                        default=False,
+                        action='store_true', 
+                        help='Score midpoints around the given one from a single capture and save the best ones as BAB_sweep_<x>_<y>.png on the desktop. Needs the Bloodweb open with some available nodes.',
+                        widget='BlockCheckbox',
+                        gooey_options={
+                            'checkbox_label' : "Search for the midpoint"
+                            }
+                        )
+
+    unsupported_resolution_group.add_argument('--sweep_radius',
+                        metavar='Search radius',
+                        default=DEFAULT_SWEEP_RADIUS,
+                        help='Distance from the given midpoint to search in pixels',
+                        widget='DecimalField',
+                        gooey_options = {
+                            'min' : 0.5, 
+                            'max' : 200, 
+                            'increment' : 1
+                            }
+                        )
+
+    unsupported_resolution_group.add_argument('--sweep_step',
+                        metavar='Search step',
+                        default=DEFAULT_SWEEP_STEP,
+                        help='Distance between the searched midpoints in pixels',
+                        widget='DecimalField',
+                        gooey_options = {
+                            'min' : 0.1, 
+                            'max' : 10, 
+                            'increment' : 0.1
+                            }
+                        )
+
     unsupported_resolution_group.add_argument('-x', '--unsupported_resolution_mid_x',
                         metavar='Midpoint X-coordinate',
                         default=0,
@@ -205,52 +476,106 @@ def main():
     
     args = parser.parse_args()
 
-    if args.unsupported_resolution_debug:
+    if args.unsupported_resolution_debug or args.unsupported_resolution_sweep:
         # Run the custom resolution debug image generator 
         analyzer = WebAnalyzer()
         analyzer.set_bring_to_front(not bool(args.activate_window))
         analyzer.set_override_monitor_index(int(args.monitor_index))
         
         if args.unsupported_resolution_enabled:
-            autobuy.web_analyzer.set_custom_midpoint(
+            analyzer.set_custom_midpoint(
                 float(args.unsupported_resolution_mid_x),
                 float(args.unsupported_resolution_mid_y))
         try:
             analyzer.initialize()
         except (WebAnalyzer.GameResolutionError, WebAnalyzer.WindowNotFoundError):
-            print("Failed to initialize", flush=True)
+            log("Failed to initialize")
             return
-        analyzer.save_debug_images()
+        if args.unsupported_resolution_sweep:
+            run_sweep(analyzer, float(args.sweep_radius), float(args.sweep_step))
+        if args.unsupported_resolution_debug:
+            analyzer.save_debug_images()
         return
 
 
+    # Run the main program
+    monitor_indices = [int(index) for index in args.monitor_indices.replace(" ", "").split(",") if index] if args.monitor_indices else []
+    # Shared by all instances so the profiles of the other clients are kept when saving
+    profile_store = ProfileStore()
+    if len(monitor_indices) > 1:
+        # One instance for each game client
+        instances = [create_autobuy(args, index, profile_store) for index in monitor_indices]
+        runner = MultiAutobuy(instances)
+    else:
+        # A single entry selects that monitor
+        monitor_index = monitor_indices[0] if monitor_indices else int(args.monitor_index)
+        instances = [create_autobuy(args, monitor_index, profile_store)]
+        runner = instances[0]
+
+    # Optional local servers for other programs, started before the instances so they can be resumed remotely
+    servers = []
+    for port, server_class, name in ((int(args.control_port), ControlServer, "control"),
+                                     (int(args.metrics_port), MetricsServer, "metrics")):
+        if port <= 0:
+            continue
+        server = server_class(instances, port)
+        try:
+            server.start()
+            servers.append(server)
+        except OSError as err:
+            log(f"Could not start the {name} server: {err}")
+    try:
+        runner.run()
+    finally:
+        for server in servers:
+            server.close()
+
+
+# Creates an Autobuy instance configured from the parsed arguments
+def create_autobuy(args, monitor_index: int, profile_store: ProfileStore) -> Autobuy:
     ordering = Autobuy.Ordering.CHEAP
     if args.shuffle:
         ordering = Autobuy.Ordering.SHUFFLE
     elif args.expensive:
         ordering = Autobuy.Ordering.EXPENSIVE
         
-    # Run the main program
     autobuy = Autobuy()
     autobuy.set_start_paused(bool(args.start_paused))
     autobuy.set_verbose(bool(args.verbose))
+    autobuy.set_batch_buy(bool(args.batch_buy))
+    autobuy.set_auto_tune(bool(args.auto_tune))
+    autobuy.set_min_confidence(float(args.min_confidence) / 100)
+    autobuy.set_calibrate_ring_color(bool(args.calibrate_ring_color))
     autobuy.set_time_limit(float(args.time_limit) * 60.0)
+    autobuy.set_stop_conditions(StopConditions(int(args.node_limit), int(args.level_limit),
+                                               int(args.prestige_limit), int(args.bloodpoint_limit)))
+    autobuy.set_stall_timeout(float(args.stall_timeout))
     autobuy.set_timing_offset_1(float(args.first_timing_offset) / 100)
     autobuy.set_timing_offset_2(float(args.second_timing_offset) / 100)
     # Workaround, this version of gooey doesn't support True default checkboxes
     autobuy.set_auto_prestige(not bool(args.should_prestige)) 
     autobuy.set_ordering(ordering)
+    autobuy.set_category_priorities(args.preferred_categories, args.excluded_categories)
     autobuy.web_analyzer.set_bring_to_front(not bool(args.activate_window))
-    autobuy.web_analyzer.set_override_monitor_index(int(args.monitor_index))
-    autobuy.web_analyzer.set_node_tolerance(int(args.node_color_threshold))
-    autobuy.web_analyzer.set_color_available(tuple(bytes.fromhex(args.ring_color[1:])))
+    autobuy.web_analyzer.set_override_monitor_index(monitor_index)
+    autobuy.web_analyzer.set_profile_store(profile_store)
+    autobuy.web_analyzer.set_recalibrate(bool(args.recalibrate))
+    autobuy.web_analyzer.set_adaptive_tolerance(bool(args.adaptive_tolerance))
+    autobuy.web_analyzer.set_event_detection(bool(args.detect_events))
+    if args.record_session:
+        autobuy.set_session_recorder(SessionRecorder(get_recording_path(f"_{monitor_index}" if monitor_index else "")))
+    if int(args.node_color_threshold) != DEFAULT_NODE_TOLERANCE:
+        autobuy.web_analyzer.set_node_tolerance(int(args.node_color_threshold))
+    if args.ring_color.lower() != DEFAULT_RING_COLOR:
+        autobuy.web_analyzer.set_color_available(tuple(bytes.fromhex(args.ring_color[1:])))
     
     if args.unsupported_resolution_enabled:
         autobuy.web_analyzer.set_custom_midpoint(
                             float(args.unsupported_resolution_mid_x), 
                             float(args.unsupported_resolution_mid_y))
-    
-    autobuy.run()
+    return autobuy
     
 if __name__ == "__main__":
+    # The midpoint sweep starts worker processes, which run this file again in the frozen executable
+    freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,527 @@
+import json
+import numpy as np
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+from timeit import timeit
+from PIL import Image
+from clock import VirtualClock
+from frame_source import FrameSource, crop_frame
+from input_backend import FakeInput
+from logger import muted_log
+from session_recorder import SessionRecorder, read_recording, RECORD_INFO, RECORD_FRAME, RECORD_GRAB
+from web_autobuy import Autobuy
+from window_source import StaticWindowSource, GAME_WINDOW_TITLE
+from web_analyzer import WebAnalyzer, RarityClassifier, Rarity, NODE_COUNT, RARITY_SAMPLE_COUNT, CATEGORY_SAMPLE_COUNTS, \
+    CATEGORY_WEIGHTS, CATEGORY_MIN_BRIGHTNESS, Category, RARITIES_BGR, RARITY_RING_BGR, RARITY_RING_OFFSETS
+
+# Hues of the rarities before event nodes were detected, event nodes were classified as uncommon
+LEGACY_RARITIES_HUE = [25, 45, 128, 284, 342]
+
+
+# Rarity classification by hue alone as it was done node by node before, kept for comparison
+def _legacy_classify(means: np.ndarray) -> np.ndarray:
+    r = means[:,2]
+    g = means[:,1]
+    b = means[:,0]
+    max_c = np.max([r,g,b],axis=0)
+    min_c = np.min([r,g,b],axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hue = np.array([(g-b)/(max_c-min_c),
+            2.0 + ((b-r) / (max_c-min_c)),
+            4.0 + ((r-g) / (max_c-min_c))])
+    indices = np.argmax([r,g,b],axis=0)
+    hue = np.choose(indices,hue)
+    hue *= 60
+    hue[hue < 0] += 360
+    return np.array([np.argmin([180 - abs(abs(a - h) - 180) for h in LEGACY_RARITIES_HUE]) for a in hue],int)
+
+
+# Rarity crop means as they were calculated before subsampling, kept for comparison
+def _legacy_crop_means(image: np.ndarray, positions: np.ndarray, width: int) -> np.ndarray:
+    node_images = np.zeros((len(positions),2*width,2*width,3),int)
+    for i in range(len(positions)):
+        node_images[i] = image[positions[i,1] - width:positions[i,1] + width, positions[i,0] - width:positions[i,0] + width,:]
+    return np.mean(node_images, axis=(1,2))
+
+
+# Buyable node detection as it was done before the compact dtypes, kept for comparison
+def _legacy_positions_approx_color(image, positions, color, tolerance, sampling_radius):
+    rim_imgs = np.zeros((len(positions),2 * sampling_radius, 3),int)
+    for i in range(len(positions)):
+        rim_imgs[i] = image[positions[i,1] - sampling_radius:positions[i,1] + sampling_radius,positions[i,0],:]
+    dists = np.linalg.norm(rim_imgs - color.astype(int), axis=(2))
+    return (np.min(dists,axis=1) < tolerance).nonzero()[0]
+
+
+# Analysis of one frame as it was done before, every node is treated as buyable to measure the worst case
+def _legacy_analyze(analyzer: WebAnalyzer, image: np.ndarray) -> np.ndarray:
+    bbox = analyzer._web_bbox
+    edge_positions = (analyzer._web_points - bbox[0]).astype(int)
+    _legacy_positions_approx_color(image, edge_positions, analyzer._color_node_available, 1000, 2)
+    node_positions = (analyzer._web_nodes - bbox[0]).astype(int)
+    means = _legacy_crop_means(image, node_positions, analyzer._rarity_sample_width)
+    return _legacy_classify(means).argsort()
+
+
+# Creates an analyzer for a random frame of the given resolution
+def _create_test_analyzer(resolution: tuple[int, int]) -> WebAnalyzer:
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (resolution[1], resolution[0], 3), np.uint8)
+    analyzer = WebAnalyzer()
+    analyzer.set_test_image(Image.fromarray(frame))
+    # Silence the initialization output
+    with muted_log():
+        analyzer.initialize()
+    return analyzer
+
+
+def _get_resolutions() -> list:
+    # Data files are looked up from the working directory, like in the analyzer
+    resolution_file = Path.cwd() / "data" / "resolutions.txt"
+    return list(WebAnalyzer()._parse_resolution_info(resolution_file).keys())
+
+
+# Prints the time taken per call in microseconds
+def _report(name: str, seconds: float) -> None:
+    print(f"  {name:<32}{seconds * 1e6:10.1f} us")
+
+
+# Colors of the rarity crops and ring regions of random regular rarities, made from the measured reference colors
+# Each node is made brighter or darker as a whole like gamma and HDR do, and every color gets some noise
+# Event nodes are left out, their reference colors are estimates and would only be checked against themselves
+def _get_test_colors(rng: np.random.Generator, count: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    rarities = rng.integers(0, Rarity.EVENT, count)
+    crops = np.array([RARITIES_BGR[Rarity(rarity)] for rarity in rarities], float)
+    rings = np.tile(np.array(RARITY_RING_BGR, float), (count, 1))
+    brightness = rng.uniform(0.8, 1.2, (count, 1))
+    crops = np.clip(crops * brightness + rng.normal(0, 6, crops.shape), 0, 255)
+    rings = np.clip(rings * brightness + rng.normal(0, 6, rings.shape), 0, 255)
+    return rarities, crops, rings
+
+
+def benchmark_rarity(repeat: int) -> None:
+    print("Rarity classification")
+    rng = np.random.default_rng(0)
+    _, means, ring_means = _get_test_colors(rng, NODE_COUNT)
+
+    classifier = RarityClassifier()
+    for count in (1, 6, NODE_COUNT):
+        legacy = timeit(lambda: _legacy_classify(means[:count]), number=repeat) / repeat
+        vectorized = timeit(lambda: classifier.classify(means[:count]), number=repeat) / repeat
+        events = timeit(lambda: classifier.classify(means[:count], ring_means[:count]), number=repeat) / repeat
+        _report(f"Hue loop, {count} nodes", legacy)
+        _report(f"Vectorized hue, {count} nodes", vectorized)
+        _report(f"With event rings, {count} nodes", events)
+
+    expected, means, _ = _get_test_colors(rng, 10000)
+    rarities = classifier.classify(means)[0]
+    print(f"  Agreement with hue loop: {np.mean(_legacy_classify(means) == rarities) * 100:.1f} %")
+    print(f"  Correct: {np.mean(rarities == expected) * 100:.1f} %")
+
+
+# Rarity crop sampling of all nodes at every supported resolution
+def benchmark_crops(repeat: int) -> None:
+    print("Rarity crop sampling, 30 nodes")
+    print(f"  {'Resolution':<12}{'Crop':>6}{'Loop (before)':>16}{'Full crop':>12}{'Strided':>12}")
+    repeat = max(repeat // 10, 1)
+    for resolution in _get_resolutions():
+        analyzer = _create_test_analyzer(resolution)
+        bbox = analyzer._web_bbox
+        image = analyzer.capture(analyzer._web_capture_bbox)
+        positions = analyzer._web_nodes - bbox[0]
+        width = analyzer._rarity_sample_width
+
+        loop = timeit(lambda: _legacy_crop_means(image, positions, width), number=repeat) / repeat
+        analyzer.set_rarity_sample_count(0)
+        full = timeit(lambda: analyzer._get_rarity_means(image, positions), number=repeat) / repeat
+        analyzer.set_rarity_sample_count(RARITY_SAMPLE_COUNT)
+        strided = timeit(lambda: analyzer._get_rarity_means(image, positions), number=repeat) / repeat
+        print(f"  {resolution[0]}x{resolution[1]:<7}{2 * width:>6}{loop * 1e6:>13.1f} us{full * 1e6:>9.1f} us{strided * 1e6:>9.1f} us")
+
+
+# Memory used by the intermediate arrays and time of analyzing one frame with all nodes buyable
+def benchmark_dtypes(repeat: int) -> None:
+    print("Frame analysis, all 30 nodes buyable")
+    print(f"  {'Resolution':<12}{'Memory before':>15}{'after':>10}{'Time before':>14}{'after':>11}")
+    repeat = max(repeat // 10, 1)
+    for resolution in _get_resolutions():
+        analyzer = _create_test_analyzer(resolution)
+        analyzer.set_node_tolerance(1000)
+        image = analyzer.capture(analyzer._web_capture_bbox)
+        width = analyzer._rarity_sample_width
+        strip_length = 2 * 2
+        samples = len(analyzer._rarity_sample_offsets)
+
+        # int64 strips, float64 distances and int64 crops before
+        memory_before = NODE_COUNT * (strip_length * 3 * 8 + strip_length * 8 + (2 * width) ** 2 * 3 * 8)
+        # int16 differences, int32 squared distances and uint8 subsampled crops after
+        memory_after = NODE_COUNT * (strip_length * 3 * (1 + 2 + 4) + samples ** 2 * 3)
+
+        before = timeit(lambda: _legacy_analyze(analyzer, image), number=repeat) / repeat
+        after = timeit(lambda: analyzer.analyze_image(image), number=repeat) / repeat
+        print(f"  {resolution[0]}x{resolution[1]:<7}{memory_before / 1024:>12.0f} kB{memory_after / 1024:>7.0f} kB"
+              f"{before * 1e3:>11.2f} ms{after * 1e3:>8.2f} ms")
+
+
+# Time of analyzing one frame with all nodes buyable, with and without detecting the icon categories
+# The frame has the stripes of a random category drawn at every node, the detected categories are checked against them
+# The stripes are drawn at the sample offsets themselves, so this only checks the scoring, not that the offsets match
+# the icon frames of the game. That is checked with a labelled recording, see _validate_categories
+def benchmark_categories(repeat: int, recording: Path = None, labels: Path = None) -> None:
+    print("Category detection, all 30 nodes buyable")
+    print(f"  {'Resolution':<12}{'Without':>10}{'With':>12}{'Detected':>11}")
+    repeat = max(repeat // 10, 1)
+    rng = np.random.default_rng(0)
+    # Category of each sample
+    owners = np.repeat(np.arange(len(CATEGORY_SAMPLE_COUNTS)), CATEGORY_SAMPLE_COUNTS)
+    for resolution in _get_resolutions():
+        analyzer = _create_test_analyzer(resolution)
+        analyzer.set_node_tolerance(1000)
+        image = analyzer.capture(analyzer._web_capture_bbox).copy()
+        expected = rng.integers(0, len(CATEGORY_SAMPLE_COUNTS), NODE_COUNT)
+        ys, xs = analyzer._category_index
+        stripes = owners == expected[:,None]
+        image[ys, xs] = 0
+        image[ys[stripes], xs[stripes]] = 255
+
+        without = timeit(lambda: analyzer.analyze_image(image), number=repeat) / repeat
+        analyzer.set_category_detection(True)
+        detected = timeit(lambda: analyzer.analyze_image(image), number=repeat) / repeat
+        scan = analyzer.scan_image(image)
+        correct = np.mean(scan.categories == expected[scan.nodes])
+        print(f"  {resolution[0]}x{resolution[1]:<7}{without * 1e3:>7.3f} ms{detected * 1e3:>9.3f} ms{correct * 100:>9.0f} %")
+    if recording is not None:
+        _validate_categories(recording, labels)
+
+
+# Detects the categories of the labelled nodes of a recording and compares them with the labels
+# Also prints the share of the stripe samples of each category found bright on the labelled nodes, a category whose
+# own samples are rarely bright has offsets that don't match its frame. Without labels the detections are only counted
+def _validate_categories(path: Path, labels_path: Path = None) -> None:
+    labels = _read_labels(labels_path)[1] if labels_path is not None else {}
+    print(f"Recorded frames, {path.name}" + (f", {len(labels)} labelled nodes" if labels else ", no labels"))
+    detected = np.zeros(len(Category), int)
+    # Labelled category, detected category
+    confusion = np.zeros((len(Category), len(Category)), int)
+    # Labelled category, bright samples of each category
+    bright = np.zeros((len(Category), len(CATEGORY_SAMPLE_COUNTS)))
+    frame = -1
+    for frame, analyzer, image in _read_frames(path):
+        analyzer.set_category_detection(True)
+        scan = analyzer.scan_image(image)
+        np.add.at(detected, scan.categories, 1)
+        nodes = [node for (labelled_frame, node) in labels if labelled_frame == frame]
+        if not nodes:
+            continue
+        expected = np.array([labels[frame, node] for node in nodes], int)
+        np.add.at(confusion, (expected, analyzer._get_categories(image, np.array(nodes))), 1)
+        samples = image[analyzer._category_index[0][nodes], analyzer._category_index[1][nodes]]
+        np.add.at(bright, expected, (samples.min(axis=2) >= CATEGORY_MIN_BRIGHTNESS) @ CATEGORY_WEIGHTS)
+    print(f"  {frame + 1} frames, detected: " + ", ".join(f"{detected[category]} {category.name.lower()}" for category in Category))
+    if not labels:
+        return
+    names = [Category(category).name.lower() for category in range(len(CATEGORY_SAMPLE_COUNTS))]
+    print(f"  {'Label':<12}{'Nodes':>7}{'Correct':>10}  {'Detected as':<30}Bright samples: {', '.join(names)}")
+    for category in Category:
+        total = confusion[category].sum()
+        if total == 0:
+            continue
+        wrong = ", ".join(f"{confusion[category, other]} {other.name.lower()}" for other in Category
+                          if other != category and confusion[category, other] > 0)
+        shares = ", ".join(f"{share * 100:.0f} %" for share in bright[category] / total)
+        print(f"  {category.name.lower():<12}{total:>7}{confusion[category, category] / total * 100:>8.0f} %  {wrong or '-':<30}{shares}")
+
+
+# Draws the rarity crop and the ring region of every node with the colors of a random rarity
+def _draw_rarities(analyzer: WebAnalyzer, image: np.ndarray, rng: np.random.Generator) -> None:
+    _, crops, rings = _get_test_colors(rng, NODE_COUNT)
+    width = analyzer._rarity_sample_width
+    for node, position in enumerate(analyzer._local_web_nodes):
+        image[position[1] - width:position[1] + width, position[0] - width:position[0] + width] = crops[node]
+        ring = position + analyzer._rarity_offsets[-len(RARITY_RING_OFFSETS):]
+        image[ring[:,1], ring[:,0]] = rings[node]
+
+
+# Reads the labels of a recording, a JSON list of the nodes checked by hand in the recorded frames:
+#   [{"frame": 12, "node": 3, "rarity": "event", "category": "addon"}, ...]
+# Frames are counted from 0 in the order they were recorded, nodes are numbered like in the scans
+# Either the rarity or the category may be left out
+# Returns {(frame, node): Rarity} and {(frame, node): Category}
+def _read_labels(path: Path) -> tuple[dict, dict]:
+    with open(path, "r") as f:
+        entries = json.load(f)
+    rarities = {(int(entry["frame"]), int(entry["node"])): Rarity[entry["rarity"].upper()]
+                for entry in entries if "rarity" in entry}
+    categories = {(int(entry["frame"]), int(entry["node"])): Category[entry["category"].upper()]
+                  for entry in entries if "category" in entry}
+    return rarities, categories
+
+
+# Yields the index, the analyzer and the image of each frame of a recording
+# The analyzer is set up from the recorded session info, like when replaying the session
+def _read_frames(path: Path):
+    analyzer = None
+    frame = 0
+    for kind, _, data in read_recording(path):
+        if kind == RECORD_INFO and analyzer is None:
+            analyzer = WebAnalyzer()
+            analyzer.set_recorded_session(data)
+            with muted_log():
+                analyzer.initialize()
+        elif kind == RECORD_FRAME and analyzer is not None:
+            yield frame, analyzer, data
+            frame += 1
+
+
+def _format_bgr(color: np.ndarray) -> str:
+    return "/".join(str(int(c)) for c in color)
+
+
+# Analyzes the recorded frames and compares the detected rarities with the labels
+# Also prints the mean colors measured for each labelled rarity, these are the values to fit RARITIES_BGR,
+# RARITY_RING_BGR and EVENT_RING_BGR to. Without labels only the detected rarities can be counted
+def _validate_recording(path: Path, labels_path: Path = None) -> None:
+    labels = _read_labels(labels_path)[0] if labels_path is not None else {}
+    print(f"Recorded frames, {path.name}" + (f", {len(labels)} labelled nodes" if labels else ", no labels"))
+    detected = np.zeros(len(Rarity), int)
+    # Labelled rarity, detected rarity, nodes not detected as buyable in the last column
+    confusion = np.zeros((len(Rarity), len(Rarity) + 1), int)
+    crop_colors = np.zeros((len(Rarity), 3))
+    ring_colors = np.zeros((len(Rarity), 3))
+    frame = -1
+    for frame, analyzer, image in _read_frames(path):
+        analyzer.set_event_detection(True)
+        scan = analyzer.scan_image(image)
+        if not scan.is_prestige():
+            np.add.at(detected, scan.rarities, 1)
+        nodes = [node for (labelled_frame, node) in labels if labelled_frame == frame]
+        if not nodes:
+            continue
+        expected = np.array([labels[frame, node] for node in nodes], int)
+        means, ring_means = analyzer._get_rarity_means(image, analyzer._local_web_nodes[nodes])
+        np.add.at(crop_colors, expected, means)
+        np.add.at(ring_colors, expected, ring_means)
+        found = dict(zip(scan.nodes.tolist(), scan.rarities.tolist())) if not scan.is_prestige() else {}
+        for node, rarity in zip(nodes, expected):
+            confusion[rarity, found.get(node, len(Rarity))] += 1
+    print(f"  {frame + 1} frames, detected: " + ", ".join(f"{detected[rarity]} {rarity.name.lower()}" for rarity in Rarity))
+    if not labels:
+        return
+    print(f"  {'Label':<12}{'Nodes':>7}{'Correct':>10}{'Missed':>8}  {'Detected as':<30}{'Crop BGR':>14}{'Ring BGR':>14}")
+    for rarity in Rarity:
+        total = confusion[rarity].sum()
+        if total == 0:
+            continue
+        found = confusion[rarity, :len(Rarity)].sum()
+        correct = confusion[rarity, rarity] / max(found, 1)
+        wrong = ", ".join(f"{confusion[rarity, other]} {other.name.lower()}" for other in Rarity
+                          if other != rarity and confusion[rarity, other] > 0)
+        print(f"  {rarity.name.lower():<12}{total:>7}{correct * 100:>8.0f} %{confusion[rarity, -1]:>8}  {wrong or '-':<30}"
+              f"{_format_bgr(crop_colors[rarity] / total):>14}{_format_bgr(ring_colors[rarity] / total):>14}")
+
+
+# Cost of the event node detection in the analysis of frames with random regular rarities drawn at every node
+# Only the time is measured, whether the event colors match the game is checked with a labelled recording,
+# see _validate_recording
+def benchmark_events(repeat: int, recording: Path = None, labels: Path = None) -> None:
+    print("Event node detection, all 30 nodes buyable")
+    print(f"  {'Resolution':<12}{'Without':>10}{'With':>12}")
+    repeat = max(repeat // 10, 1)
+    rng = np.random.default_rng(0)
+    for resolution in _get_resolutions():
+        analyzer = _create_test_analyzer(resolution)
+        analyzer.set_node_tolerance(1000)
+        image = analyzer.capture(analyzer._web_capture_bbox).copy()
+        _draw_rarities(analyzer, image, rng)
+        without = timeit(lambda: analyzer.analyze_image(image), number=repeat) / repeat
+        analyzer.set_event_detection(True)
+        detected = timeit(lambda: analyzer.analyze_image(image), number=repeat) / repeat
+        print(f"  {resolution[0]}x{resolution[1]:<7}{without * 1e3:>7.3f} ms{detected * 1e3:>9.3f} ms")
+    if recording is not None:
+        _validate_recording(recording, labels)
+
+
+# Scan rates the recording size per hour is estimated for, about the entity phase and the free phase of a level
+RECORDING_SCAN_RATES = (2, 10)
+
+
+# Size and encoding time of recorded frames of the 2560x1440 web capture for different amounts of change between scans
+# The frames are generated, with --recording the size per hour of a real recording is measured as well
+def benchmark_recording(repeat: int, recording: Path = None) -> None:
+    print("Recording size, 2560x1440")
+    rates = "".join(f"{f'MB/h at {rate}/s':>15}" for rate in RECORDING_SCAN_RATES)
+    print(f"  {'Frames':<28}{'Frame':>10}{'Encoding':>12}{rates}")
+    rng = np.random.default_rng(0)
+    analyzer = _create_test_analyzer((2560, 1440))
+    height, width = analyzer.capture(analyzer._web_capture_bbox).shape[:2]
+    # Smooth dark background with a rarity crop at every node, compresses about as well as the game picture
+    ys, xs = np.mgrid[0:height, 0:width]
+    background = (20 + 10 * np.sin(xs / 97.0) * np.cos(ys / 61.0)).astype(np.uint8)
+    web = np.repeat(background[:,:,None], 3, axis=2)
+    origin = np.array(analyzer._web_capture_bbox[:2])
+    _draw_rarities(analyzer, web, rng)
+
+    def ring_changes(index: int) -> np.ndarray:
+        frame = web.copy()
+        x, y = analyzer._web_points[index % NODE_COUNT] - origin
+        frame[y - 3:y + 3, x - 1:x + 2] = analyzer._color_node_available
+        return frame
+
+    def noise(index: int) -> np.ndarray:
+        return np.clip(web + rng.integers(-2, 3, web.shape), 0, 255).astype(np.uint8)
+
+    def random(index: int) -> np.ndarray:
+        return rng.integers(0, 256, web.shape, np.uint8)
+
+    count = max(min(repeat // 10, 200), 10)
+    for name, make_frame in (("Unchanged web", lambda index: web), ("One node ring per scan", ring_changes),
+                             ("Noise on every pixel", noise), ("Random pixels", random)):
+        frames = [make_frame(index) for index in range(count)]
+        recorder = SessionRecorder(Path("unused"))
+        start = perf_counter()
+        size = sum(len(recorder._encode_frame(frame)) for frame in frames) / count
+        encoding = (perf_counter() - start) / count
+        per_hour = "".join(f"{size * rate * 3600 / 1024 ** 2:>15.0f}" for rate in RECORDING_SCAN_RATES)
+        print(f"  {name:<28}{size / 1024:>7.0f} kB{encoding * 1e3:>9.1f} ms{per_hour}")
+    if recording is not None:
+        _measure_recording(recording)
+
+
+# Prints the size per hour of a recording and what its frames and grabs took
+def _measure_recording(path: Path) -> None:
+    frames, grabs, duration = 0, 0, 0.0
+    for kind, timestamp, _ in read_recording(path):
+        frames += kind == RECORD_FRAME
+        grabs += kind == RECORD_GRAB
+        duration = timestamp
+    size = path.stat().st_size / 1024 ** 2
+    hours = max(duration / 3600, 1e-9)
+    print(f"Recorded session, {path.name}")
+    print(f"  {duration:.0f} s, {size:.1f} MB, {size / hours:.0f} MB per hour, {frames / max(duration, 1e-9):.1f} frames/s, "
+          f"{size * 1024 / max(frames, 1):.0f} kB per frame, {grabs} grabs")
+
+
+# Buyable nodes of each simulated level and the time until the next level appears after the last one is bought
+SIMULATED_LEVEL_NODES = 8
+SIMULATED_LEVEL_GAP = 1.0
+# Length of each simulated session in virtual seconds
+SIMULATED_DURATION = 300.0
+# Times of capturing the whole web the buying benchmark is run with, smaller captures take a share by area
+SIMULATED_CAPTURE_TIMES = (0.0, 0.01, 0.03)
+
+
+# Bloodweb of a 2560x1440 game window that is bought by clicking, every level has the same number of buyable nodes
+# Captures take virtual time, so the buying speed doesn't depend on how fast the frames are drawn here
+class _SimulatedWeb(FrameSource):
+    def __init__(self, analyzer: WebAnalyzer, clock: VirtualClock, capture_time: float) -> None:
+        self._analyzer = analyzer
+        self._clock = clock
+        self._capture_time = capture_time
+        self._rng = np.random.default_rng(0)
+        self._frame = np.full((1440, 2560, 3), 20, np.uint8)
+        self._buyable = set()
+        self._level_time = 0.0
+        self.web_captures = 0
+
+    def grab(self, bbox: tuple[int, int, int, int]) -> np.ndarray:
+        web_bbox = self._analyzer._web_capture_bbox
+        area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+        web_area = (web_bbox[2] - web_bbox[0]) * (web_bbox[3] - web_bbox[1])
+        self.web_captures += area == web_area
+        self._clock.sleep(self._capture_time * area / web_area)
+        if not self._buyable and self._clock.now() >= self._level_time:
+            self._buyable = set(self._rng.choice(NODE_COUNT, SIMULATED_LEVEL_NODES, replace=False).tolist())
+        frame = self._frame.copy()
+        for node in self._buyable:
+            x, y = self._analyzer._web_points[node]
+            frame[y - 3:y + 3, x - 1:x + 2] = self._analyzer.get_color_available()
+        return crop_frame(frame, (0, 0), bbox)
+
+    def click(self, position: tuple) -> None:
+        for node in self._buyable:
+            node_position = self._analyzer.get_node_position(node)
+            if int(node_position[0]) == position[0] and int(node_position[1]) == position[1]:
+                self._buyable.discard(node)
+                if not self._buyable:
+                    self._level_time = self._clock.now() + SIMULATED_LEVEL_GAP
+                return
+
+
+# Buys from the simulated web on release, like the game does
+class _SimulatedInput(FakeInput):
+    def __init__(self, web: _SimulatedWeb, clock: VirtualClock) -> None:
+        super().__init__(clock.now)
+        self._web = web
+
+    def release(self) -> None:
+        super().release()
+        self._web.click(self._position)
+
+
+# Runs a simulated session, returns the nodes bought and the web captures taken
+def _simulate_buying(batch_buy: bool, capture_time: float) -> tuple[int, int]:
+    clock = VirtualClock()
+    autobuy = Autobuy()
+    web = _SimulatedWeb(autobuy.web_analyzer, clock, capture_time)
+    autobuy.set_clock(clock)
+    autobuy.set_input_backend(_SimulatedInput(web, clock))
+    autobuy.set_batch_buy(batch_buy)
+    autobuy.set_time_limit(SIMULATED_DURATION)
+    autobuy.web_analyzer.set_frame_source(web)
+    autobuy.web_analyzer.set_window_source(StaticWindowSource([(None, GAME_WINDOW_TITLE, (0, 0, 2560, 1440))]))
+    with muted_log():
+        if not autobuy.setup():
+            raise RuntimeError("Failed to set up the simulated web")
+        autobuy.run_loop()
+    return autobuy.get_nodes_bought(), web.web_captures
+
+
+# Nodes bought per second with and without batch buying, on a simulated web with virtual time
+# Batch buying saves web captures, so the gain depends on how long a capture takes
+def benchmark_buying(repeat: int) -> None:
+    print(f"Buying speed, {SIMULATED_LEVEL_NODES} nodes per level, {SIMULATED_DURATION:.0f} s sessions")
+    print(f"  {'Capture':<12}{'Normal':>12}{'Batch':>12}{'Gain':>8}{'Captures per node':>20}")
+    for capture_time in SIMULATED_CAPTURE_TIMES:
+        normal, normal_captures = _simulate_buying(False, capture_time)
+        batch, batch_captures = _simulate_buying(True, capture_time)
+        print(f"  {capture_time * 1e3:>5.0f} ms{normal / SIMULATED_DURATION:>12.2f}/s{batch / SIMULATED_DURATION:>10.2f}/s"
+              f"{(batch / max(normal, 1) - 1) * 100:>+7.1f}%"
+              f"{f'{normal_captures / max(normal, 1):.2f} -> {batch_captures / max(batch, 1):.2f}':>20}")
+
+
+BENCHMARKS = {
+    "rarity": benchmark_rarity,
+    "crops": benchmark_crops,
+    "dtypes": benchmark_dtypes,
+    "categories": benchmark_categories,
+    "events": benchmark_events,
+    "recording": benchmark_recording,
+    "buying": benchmark_buying,
+}
+
+
+def main():
+    parser = ArgumentParser("Bloodweb Analyzer benchmarks", description="Microbenchmarks of the analysis steps")
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"Benchmarks to run, all by default. Choices: {', '.join(BENCHMARKS.keys())}")
+    parser.add_argument("-n", "--repeat", type=int, default=1000)
+    parser.add_argument("--recording", type=Path,
+                        help="Session recording to also validate the event node and category detection on, "
+                             "or to measure the size of")
+    parser.add_argument("--labels", type=Path, help="Labels of the nodes in the recording, see _read_labels")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+    for name in args.benchmarks or BENCHMARKS.keys():
+        if name in ("events", "categories"):
+            BENCHMARKS[name](args.repeat, args.recording, args.labels)
+        elif name == "recording":
+            BENCHMARKS[name](args.repeat, args.recording)
+        else:
+            BENCHMARKS[name](args.repeat)
+
+
+if __name__ == "__main__":
+    main()
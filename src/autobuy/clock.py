@@ -0,0 +1,36 @@
+from time import perf_counter, sleep
+
+
+# Interface for measuring and waiting time in the buy loop
+# Replaying a session swaps in a virtual clock so waits take no real time
+class Clock:
+    # Returns the current time in seconds, only differences between calls are meaningful
+    def now(self) -> float:
+        raise NotImplementedError
+
+    def sleep(self, seconds: float) -> None:
+        raise NotImplementedError
+
+
+class SystemClock(Clock):
+    def now(self) -> float:
+        return perf_counter()
+
+    def sleep(self, seconds: float) -> None:
+        sleep(seconds)
+
+
+# Time only passes by sleeping or advancing it explicitly
+class VirtualClock(Clock):
+    def __init__(self, start: float = 0.0) -> None:
+        self._now = start
+
+    def now(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        self._now += max(seconds, 0.0)
+
+    # Moves the time forward to the given time, time never goes backwards
+    def advance_to(self, timestamp: float) -> None:
+        self._now = max(self._now, timestamp)
@@ -0,0 +1,116 @@
+import json
+import socketserver
+import threading
+from logger import log
+
+# Only connections from this machine are accepted
+CONTROL_HOST = "127.0.0.1"
+# Seconds between the status lines streamed by the watch command
+DEFAULT_WATCH_INTERVAL = 1.0
+MIN_WATCH_INTERVAL = 0.1
+
+
+# Handles one connection, see ControlServer for the protocol
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            words = line.decode(errors="replace").split()
+            if not words:
+                continue
+            try:
+                if not self.server.control.handle_command(words, self._send):
+                    return
+            except (ConnectionError, OSError):
+                return
+
+    def _send(self, message: dict) -> None:
+        self.wfile.write((json.dumps(message) + "\n").encode())
+        self.wfile.flush()
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# Local TCP endpoint for controlling and monitoring the running instances from other programs
+# One command per line, every reply is one line of JSON:
+#   pause [client], resume [client], stop [client]: {"ok": true}
+#   status: {"ok": true, "clients": [<Autobuy.get_status of each client>]}
+#   watch [interval]: the status line every interval seconds until the connection is closed or the program stops
+#   quit: closes the connection
+# Clients are numbered from 1 like in the log, commands without a client apply to all of them
+# Pausing and stopping go through the same methods as the hotkeys
+class ControlServer:
+    def __init__(self, instances: list, port: int) -> None:
+        self._instances = instances
+        self._port = port
+        self._server = None
+        self._thread = None
+        self._closed = threading.Event()
+
+    def start(self) -> None:
+        self._server = _ThreadingServer((CONTROL_HOST, self._port), _ControlHandler)
+        self._server.control = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="control server", daemon=True)
+        self._thread.start()
+        log(f"Control server listening on {CONTROL_HOST}:{self._server.server_address[1]}")
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        self._closed.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+
+    def get_status(self) -> dict:
+        return {"ok": True, "clients": [instance.get_status() for instance in self._instances]}
+
+    # Runs a command split into words, replies through send
+    # Returns False when the connection should be closed
+    def handle_command(self, words: list, send) -> bool:
+        command, args = words[0].lower(), words[1:]
+        if command == "quit":
+            return False
+        if command == "status":
+            send(self.get_status())
+            return True
+        if command == "watch":
+            try:
+                interval = max(float(args[0]), MIN_WATCH_INTERVAL) if args else DEFAULT_WATCH_INTERVAL
+            except ValueError:
+                send({"ok": False, "error": f"Invalid interval: {args[0]}"})
+                return True
+            self._watch(interval, send)
+            return False
+        if command not in ("pause", "resume", "stop"):
+            send({"ok": False, "error": f"Unknown command: {command}"})
+            return True
+
+        instances = self._instances
+        if args:
+            try:
+                index = int(args[0]) - 1
+                if index < 0:
+                    raise IndexError
+                instances = [self._instances[index]]
+            except (ValueError, IndexError):
+                send({"ok": False, "error": f"Invalid client: {args[0]}"})
+                return True
+        for instance in instances:
+            if command == "stop":
+                instance.stop()
+            else:
+                instance.set_paused(command == "pause")
+        send({"ok": True})
+        return True
+
+    def _watch(self, interval: float, send) -> None:
+        while True:
+            send(self.get_status())
+            if all(instance.is_stopped() for instance in self._instances):
+                return
+            if self._closed.wait(interval):
+                return
@@ -0,0 +1,29 @@
+import heapq
+import threading
+
+
+# Hands the single mouse cursor to one instance at a time
+# When several instances are waiting, the one whose purchase became due first gets it
+class CursorScheduler:
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        # Heap of (ready_time, ticket) of the waiting instances
+        self._waiting = []
+        self._ticket = 0
+        self._in_use = False
+
+    def acquire(self, ready_time: float) -> None:
+        with self._condition:
+            ticket = self._ticket
+            self._ticket += 1
+            entry = (ready_time, ticket)
+            heapq.heappush(self._waiting, entry)
+            while self._in_use or self._waiting[0] != entry:
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            self._in_use = True
+
+    def release(self) -> None:
+        with self._condition:
+            self._in_use = False
+            self._condition.notify_all()
@@ -0,0 +1,139 @@
+import threading
+import numpy as np
+from pathlib import Path
+from queue import Queue
+from PIL import Image
+
+# Magnifier insets show the area around each sample point scaled up
+MAGNIFIER_SCALE = 3
+MAGNIFIER_OUTLINE_WIDTH = 2
+
+# Color of the pixel marking a sample point, and of the marking and outline of buyable nodes
+SAMPLE_POINT_COLOR = (255, 0, 0)
+BUYABLE_COLOR = (0, 255, 0)
+# Color of the magnifier outlines
+GROUP_COLORS = {
+    "edges" : (128, 128, 128),
+    "prestige_small" : (0, 255, 0),
+    "prestige_large" : (0, 255, 255),
+}
+# Nodes are drawn as translucent circles
+NODE_FILL_COLOR = (255, 0, 0)
+NODE_FILL_ALPHA = 90
+
+# Fast PNG compression, previews are written often when calibrating
+PNG_COMPRESS_LEVEL = 1
+# Images waiting to be written at most, saving blocks until the writer catches up
+MAX_QUEUED_IMAGES = 4
+
+
+# Returns a boolean mask of a filled circle, or of a ring of the given width
+def _circle_mask(size: int, width: float = None) -> np.ndarray:
+    radius = size / 2
+    yy, xx = np.ogrid[:size, :size]
+    dist = np.sqrt((yy + 0.5 - radius) ** 2 + (xx + 0.5 - radius) ** 2)
+    if width is None:
+        return dist <= radius
+    return (dist <= radius) & (dist > radius - width)
+
+
+# Draws the masked values centered at each of the positions of shape (n, 2)
+# values is one color per position of shape (n, 3) or one image per position of shape (n, h, w, 3)
+# alpha is the opacity out of 255
+# Each position is a slice of the image, which is much faster than indexing all pixels of all positions at once
+def _stamp(image: np.ndarray, centers: np.ndarray, mask: np.ndarray, values: np.ndarray, alpha: int = 255) -> None:
+    height, width = mask.shape
+    for i in range(len(centers)):
+        top, left = centers[i,1] - height // 2, centers[i,0] - width // 2
+        # Parts outside of the image are cut off
+        y0, x0 = max(top, 0), max(left, 0)
+        y1, x1 = min(top + height, image.shape[0]), min(left + width, image.shape[1])
+        if y1 <= y0 or x1 <= x0:
+            continue
+        visible = mask[y0 - top:y1 - top, x0 - left:x1 - left, None]
+        region = image[y0:y1, x0:x1]
+        value = values[i] if values.ndim == 2 else values[i, y0 - top:y1 - top, x0 - left:x1 - left]
+        if alpha < 255:
+            # Rounded like the blending of PIL
+            value = (region * np.uint16(255 - alpha) + np.asarray(value, np.uint16) * alpha + 127) // 255
+        np.copyto(region, value, casting="unsafe", where=visible)
+
+
+# Draws the sample points of the analyzer on top of a capture
+# The magnifier insets of a group are cropped, scaled and outlined for all of its points at once
+class DebugOverlay:
+    # origin: Position of the capture in game window space
+    # points: Sample points in game window space by group, see WebAnalyzer.debug_draw_points
+    # crop_size: Size of the area around a sample point shown in the magnifier
+    def __init__(self, origin: np.ndarray, points: dict, node_size: int, crop_size: int) -> None:
+        self._origin = np.asarray(origin, int)
+        self._points = points
+        self._node_size = node_size
+        self._crop_radius = max(crop_size // 2, 1)
+        zoom_size = 2 * self._crop_radius * MAGNIFIER_SCALE
+        self._node_mask = _circle_mask(node_size)
+        self._zoom_mask = _circle_mask(zoom_size)
+        self._outline_mask = _circle_mask(zoom_size, MAGNIFIER_OUTLINE_WIDTH)
+
+    # Returns an RGB image of the BGR capture with the groups drawn in order
+    # Edges of the buyable nodes are highlighted
+    def render(self, image: np.ndarray, groups: list, buyable = ()) -> Image.Image:
+        # Drawn in BGR, reordering the channels of a large array in numpy is slow compared to decoding it in PIL
+        out = np.array(image, np.uint8)
+        for group in groups:
+            positions = (self._points[group] - self._origin).astype(int)
+            if group == "nodes":
+                _stamp(out, positions, self._node_mask, np.array([NODE_FILL_COLOR[::-1]] * len(positions)), NODE_FILL_ALPHA)
+                continue
+            is_buyable = np.zeros(len(positions), bool)
+            if group == "edges":
+                is_buyable[[node for node in buyable if 0 <= node < len(positions)]] = True
+            pixel_colors = np.where(is_buyable[:,None], BUYABLE_COLOR[::-1], SAMPLE_POINT_COLOR[::-1])
+            outline_colors = np.where(is_buyable[:,None], BUYABLE_COLOR[::-1], GROUP_COLORS[group][::-1])
+            self._draw_magnifiers(out, positions, pixel_colors, outline_colors)
+        return Image.frombuffer("RGB", (out.shape[1], out.shape[0]), out, "raw", "BGR", 0, 1)
+
+    def _draw_magnifiers(self, image: np.ndarray, positions: np.ndarray, pixel_colors: np.ndarray, outline_colors: np.ndarray) -> None:
+        height, width = image.shape[:2]
+        inside = (positions[:,0] >= 0) & (positions[:,0] < width) & (positions[:,1] >= 0) & (positions[:,1] < height)
+        image[positions[inside,1], positions[inside,0]] = pixel_colors[inside]
+
+        # Crop the areas around all points, clamped to the image, scale them up and outline them
+        offsets = np.arange(-self._crop_radius, self._crop_radius)
+        ys = np.clip(positions[:,1,None] + offsets, 0, height - 1)
+        xs = np.clip(positions[:,0,None] + offsets, 0, width - 1)
+        crops = image[ys[:,:,None], xs[:,None,:]]
+        zoomed = crops.repeat(MAGNIFIER_SCALE, axis=1).repeat(MAGNIFIER_SCALE, axis=2)
+        zoomed[:, self._outline_mask] = outline_colors[:,None,:]
+
+        _stamp(image, positions, self._zoom_mask, zoomed)
+
+
+# Saves images on a background thread
+# Errors are collected and returned by close
+class ImageWriter:
+    def __init__(self) -> None:
+        self._queue = Queue(MAX_QUEUED_IMAGES)
+        self._errors = []
+        self._thread = threading.Thread(target=self._write_loop, name="image writer", daemon=True)
+        self._thread.start()
+
+    def save(self, image: Image.Image, path: Path) -> None:
+        self._queue.put((image, Path(path)))
+
+    # Waits for the queued images to be written, returns a list of (path, error) of the failed ones
+    def close(self) -> list:
+        self._queue.put(None)
+        self._thread.join()
+        return self._errors
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            image, path = item
+            try:
+                image.save(path, compress_level=PNG_COMPRESS_LEVEL)
+            except Exception as err:
+                self._errors.append((path, err))
@@ -0,0 +1,104 @@
+import numpy as np
+import threading
+from PIL import Image
+
+
+# Interface for capturing frames of the screen
+# All coordinates are absolute screen coordinates, frames are returned in BGR format
+class FrameSource:
+    # Returns the pixels inside bbox (left, top, right, bottom)
+    def grab(self, bbox: tuple[int, int, int, int]) -> np.ndarray:
+        raise NotImplementedError
+
+    # Called before each full scan of the web, sources that serve a sequence of frames advance here
+    def next_frame(self) -> None:
+        pass
+
+    # Returns the monitors in the format of mss, index 0 covers all monitors
+    def get_monitors(self) -> list:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+# Returns the pixels inside bbox of a frame placed at origin in screen coordinates
+# Areas outside of the frame are black, like in a screen capture of an empty area
+def crop_frame(frame: np.ndarray, origin: tuple[int, int], bbox: tuple[int, int, int, int]) -> np.ndarray:
+    left, top = bbox[0] - origin[0], bbox[1] - origin[1]
+    right, bottom = bbox[2] - origin[0], bbox[3] - origin[1]
+    out = np.zeros((bottom - top, right - left, 3), np.uint8)
+    src_left, src_top = max(left, 0), max(top, 0)
+    src_right, src_bottom = min(right, frame.shape[1]), min(bottom, frame.shape[0])
+    if src_right > src_left and src_bottom > src_top:
+        out[src_top - top:src_bottom - top, src_left - left:src_right - left] = frame[src_top:src_bottom, src_left:src_right]
+    return out
+
+
+class ScreenFrameSource(FrameSource):
+    def __init__(self) -> None:
+        # mss instances should not be shared between threads, each thread gets its own
+        self._local = threading.local()
+        self._instances = []
+
+    def _get_sct(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            import mss
+            sct = mss.mss()
+            self._local.sct = sct
+            self._instances.append(sct)
+        return sct
+
+    def grab(self, bbox: tuple[int, int, int, int]) -> np.ndarray:
+        img = np.array(self._get_sct().grab(bbox)) # Capture
+        return img[:,:,:3] # Discard alpha
+
+    def get_monitors(self) -> list:
+        return self._get_sct().monitors
+
+    def close(self) -> None:
+        for sct in self._instances:
+            sct.close()
+        self._instances = []
+
+
+# Serves frames from images instead of the screen
+# The images are placed at origin in screen coordinates, arrays are taken to be in BGR format already
+# Each full scan advances to the next image, the last image is kept once the end is reached unless looping
+class FileFrameSource(FrameSource):
+    def __init__(self, images: list, origin: tuple[int, int] = (0, 0), loop: bool = False) -> None:
+        self._frames = [self._to_bgr(image) for image in images]
+        self._origin = origin
+        self._loop = loop
+        self._index = -1
+
+    @staticmethod
+    def _to_bgr(image) -> np.ndarray:
+        if isinstance(image, np.ndarray):
+            return image
+        if not isinstance(image, Image.Image):
+            image = Image.open(image)
+        # Contiguous so the crops of every grab are fast
+        return np.ascontiguousarray(np.asarray(image.convert("RGB"))[:,:,::-1]) # RGB to BGR
+
+    def get_size(self) -> tuple[int, int]:
+        frame = self._frames[0]
+        return (frame.shape[1], frame.shape[0])
+
+    # True when the last frame has been served and the source doesn't loop
+    def is_finished(self) -> bool:
+        return not self._loop and self._index >= len(self._frames) - 1
+
+    def next_frame(self) -> None:
+        self._index += 1
+        if self._index >= len(self._frames):
+            self._index = 0 if self._loop else len(self._frames) - 1
+
+    def grab(self, bbox: tuple[int, int, int, int]) -> np.ndarray:
+        return crop_frame(self._frames[max(self._index, 0)], self._origin, bbox)
+
+    def get_monitors(self) -> list:
+        width, height = self.get_size()
+        monitor = {"left": self._origin[0], "top": self._origin[1], "width": width, "height": height}
+        return [monitor, monitor]
@@ -7,7 +7,7 @@ Fine-tuning the buying timings might help if the nodes are being clicked too soo
 
 unsupported_resolution_group_desc = """If your monitor resolution is unsupported, you can calibrate the sample points yourself:
 Supply the X and Y pixel coordinates of the Bloodweb center point, relative to the game window's top left corner. Using decimal values is supported if the center is between pixels.
-Use the 'Save test images' setting with the Bloodweb open to preview the alignment."""
+Use the 'Save test images' setting with the Bloodweb open to preview the alignment, or 'Search for the midpoint' to find the best midpoint near the supplied one."""
 
 
 help_items = [
@@ -0,0 +1,86 @@
+import threading
+from time import perf_counter
+
+
+# Interface for simulating mouse input
+# Keeps track of where the program last moved the mouse, shared by every user of the backend,
+# so the user moving the mouse can be told apart from the program moving it
+class InputBackend:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.last_position = (0, 0)
+
+    def move(self, x: int, y: int) -> None:
+        with self._lock:
+            self._move(x, y)
+            self.last_position = (x, y)
+
+    # Returns True if the mouse is further than threshold pixels from where the program left it
+    def user_moved(self, threshold: int = 3) -> bool:
+        with self._lock:
+            pos = self.get_position()
+            return max(abs(self.last_position[0] - pos[0]), abs(self.last_position[1] - pos[1])) > threshold
+
+    # Accepts the current mouse position as the one the program left it at
+    def sync_position(self) -> None:
+        with self._lock:
+            self.last_position = self.get_position()
+
+    def _move(self, x: int, y: int) -> None:
+        raise NotImplementedError
+
+    def press(self) -> None:
+        raise NotImplementedError
+
+    def release(self) -> None:
+        raise NotImplementedError
+
+    def get_position(self) -> tuple:
+        raise NotImplementedError
+
+
+class MouseInput(InputBackend):
+    def __init__(self) -> None:
+        super().__init__()
+        # Imported here so the rest of the program can run without hooking the mouse
+        import mouse
+        self._mouse = mouse
+
+    def _move(self, x: int, y: int) -> None:
+        self._mouse.move(x, y)
+
+    def press(self) -> None:
+        self._mouse.press()
+
+    def release(self) -> None:
+        self._mouse.release()
+
+    def get_position(self) -> tuple:
+        return self._mouse.get_position()
+
+
+# Records the input instead of moving the mouse
+# events is a list of (timestamp, event, position) where event is "move", "press" or "release"
+class FakeInput(InputBackend):
+    def __init__(self, clock = perf_counter) -> None:
+        super().__init__()
+        self._clock = clock
+        self._position = (0, 0)
+        self.events = []
+
+    def _move(self, x: int, y: int) -> None:
+        self._position = (x, y)
+        self.events.append((self._clock(), "move", self._position))
+
+    def press(self) -> None:
+        self.events.append((self._clock(), "press", self._position))
+
+    def release(self) -> None:
+        self.events.append((self._clock(), "release", self._position))
+
+    def get_position(self) -> tuple:
+        return self._position
+
+    # Returns the positions where a click was released, in order
+    def get_clicks(self) -> list:
+        return [event[2] for event in self.events if event[1] == "release"]
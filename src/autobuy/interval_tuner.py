@@ -0,0 +1,84 @@
+# Phases of a Bloodweb level, each one has its own buying interval
+# Before the Entity starts blocking nodes
+PHASE_FREE = 0
+# After the Entity starts blocking nodes
+PHASE_ENTITY = 1
+
+# Intervals the buying timings were originally hand tuned to
+DEFAULT_INTERVALS = (0.0166666667, 0.43)
+# Limits for the learned intervals
+MIN_INTERVALS = (0.0, 0.1)
+MAX_INTERVALS = (0.5, 1.5)
+
+
+# Learns the shortest buying interval that doesn't cause missed purchases
+# A purchase failed if the clicked node is still buyable on the next scan
+class IntervalTuner:
+    # Amount of successful purchases in a row needed before trying a shorter interval
+    _success_streak_required = 8
+    # Step used when shortening the interval
+    _decrease_step = 0.005
+    # Step used when lengthening the interval after a failed purchase
+    _increase_step = 0.02
+    # Failed purchases at the same interval needed before the interval is kept above it
+    # A single failure can be a game hitch or a misread node, it only lengthens the interval for now
+    _failures_until_unsafe = 2
+
+    def __init__(self, intervals: tuple = DEFAULT_INTERVALS) -> None:
+        self._intervals = [max(MIN_INTERVALS[i], min(intervals[i], MAX_INTERVALS[i])) for i in range(2)]
+        # Longest interval that has repeatedly caused failed purchases, the interval is kept above this
+        # Lowered by a step after each success streak that was held back by it, so the bound is probed again
+        self._unsafe = [None, None]
+        # Failed purchases of this session by phase and interval in ms
+        self._failures_at = [{}, {}]
+        self._success_streak = [0, 0]
+        self._failures = [0, 0]
+        self._purchases = [0, 0]
+
+    def get_interval(self, phase: int) -> float:
+        return self._intervals[phase]
+
+    # Records the outcome of a purchase made with the given interval
+    def record(self, phase: int, interval: float, success: bool) -> None:
+        self._purchases[phase] += 1
+        if not success:
+            self._failures[phase] += 1
+            self._success_streak[phase] = 0
+            key = round(interval * 1000)
+            self._failures_at[phase][key] = self._failures_at[phase].get(key, 0) + 1
+            if self._failures_at[phase][key] >= self._failures_until_unsafe:
+                unsafe = self._unsafe[phase]
+                self._unsafe[phase] = interval if unsafe is None else max(unsafe, interval)
+            self._intervals[phase] = min(max(self._intervals[phase], interval + self._increase_step), MAX_INTERVALS[phase])
+            return
+
+        self._success_streak[phase] += 1
+        if self._success_streak[phase] < self._success_streak_required:
+            return
+        self._success_streak[phase] = 0
+        lowest = MIN_INTERVALS[phase]
+        unsafe = self._unsafe[phase]
+        if unsafe is not None:
+            lowest = max(lowest, unsafe + self._decrease_step)
+            if self._intervals[phase] - self._decrease_step < lowest:
+                # Held at the bound, it may have been set by failures that don't happen anymore
+                unsafe -= self._decrease_step
+                self._unsafe[phase] = unsafe if unsafe >= MIN_INTERVALS[phase] else None
+        self._intervals[phase] = max(self._intervals[phase] - self._decrease_step, lowest)
+
+    def get_report(self) -> str:
+        names = ("First 5 nodes", "After 5 nodes")
+        lines = []
+        for phase in (PHASE_FREE, PHASE_ENTITY):
+            lines.append(f"  {names[phase]}: {self._intervals[phase] * 1000:.0f} ms"
+                         f" ({self._failures[phase]} missed of {self._purchases[phase]} purchases)")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {"intervals": list(self._intervals), "unsafe": list(self._unsafe)}
+
+    def from_dict(self, data: dict) -> None:
+        intervals = data.get("intervals", self._intervals)
+        self._intervals = [max(MIN_INTERVALS[i], min(float(intervals[i]), MAX_INTERVALS[i])) for i in range(2)]
+        self._unsafe = list(data.get("unsafe", self._unsafe))
+
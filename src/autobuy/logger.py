@@ -0,0 +1,112 @@
+import atexit
+import sys
+import threading
+from contextlib import contextmanager
+from queue import SimpleQueue
+
+
+# Most messages written to the output with a single flush
+BATCH_SIZE = 64
+# How long flush waits for the queued messages to be written, in seconds
+FLUSH_TIMEOUT = 1.0
+
+
+# Writes log messages on a background thread
+# Logging only queues the message, so the buy loop doesn't wait for the console or the Gooey log window
+# Messages queued at the same time are written together and flushed once
+class BufferedLogger:
+    def __init__(self, stream = None) -> None:
+        # None writes to the sys.stdout of the moment, Gooey replaces it
+        self._stream = stream
+        self._queue = SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Messages logged while disabled are dropped
+        self._enabled = True
+
+    def set_enabled(self, enabled: bool) -> None:
+        self._enabled = enabled
+
+    def is_enabled(self) -> bool:
+        return self._enabled
+
+    def log(self, msg) -> None:
+        if not self._enabled:
+            return
+        self._start()
+        self._queue.put(str(msg))
+
+    # Blocks until everything logged so far has been written, at most for the timeout
+    def flush(self, timeout: float = FLUSH_TIMEOUT) -> None:
+        if self._thread is None:
+            return
+        written = threading.Event()
+        self._queue.put(written)
+        written.wait(timeout)
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_loop, name="logger", daemon=True)
+                self._thread.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get())
+            self._write(batch)
+
+    def _write(self, batch: list) -> None:
+        lines = []
+        for item in batch:
+            # Flush markers are set once the messages queued before them are out
+            if isinstance(item, threading.Event):
+                self._write_lines(lines)
+                lines = []
+                item.set()
+            else:
+                lines.append(item)
+        self._write_lines(lines)
+
+    def _write_lines(self, lines: list) -> None:
+        if not lines:
+            return
+        stream = self._stream or sys.stdout
+        try:
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+        except (OSError, ValueError):
+            # The output was closed, nothing to report to
+            pass
+
+
+_logger = BufferedLogger()
+atexit.register(_logger.flush)
+
+
+# Logs with flushing enabled to make Gooey log window work
+def log(msg) -> None:
+    _logger.log(msg)
+
+
+def flush_log() -> None:
+    _logger.flush()
+
+
+def set_log_enabled(enabled: bool) -> None:
+    _logger.set_enabled(enabled)
+
+
+# Drops the messages logged inside the block, e.g. the initialization output in the benchmarks
+# Redirecting sys.stdout doesn't work for this, the messages are written later by the logger thread
+@contextmanager
+def muted_log():
+    enabled = _logger.is_enabled()
+    _logger.set_enabled(False)
+    try:
+        yield
+    finally:
+        _logger.set_enabled(enabled)
@@ -0,0 +1,111 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from logger import log
+from session_metrics import Histogram
+from web_analyzer import Rarity
+
+# Only connections from this machine are accepted
+METRICS_HOST = "127.0.0.1"
+METRICS_PATH = "/metrics"
+METRIC_PREFIX = "bloodwebautobuy_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labels: dict) -> str:
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+# Appends the lines of a histogram in the Prometheus text format, buckets are cumulative there
+def _add_histogram(lines: list, name: str, labels: dict, histogram: Histogram) -> None:
+    counts = list(histogram.counts)
+    total = 0
+    for bound, count in zip(histogram.buckets, counts):
+        total += count
+        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {total}")
+    total += counts[-1]
+    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {total}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_format_labels(labels)} {total}")
+
+
+# Returns the metrics of the instances in the Prometheus text format, each instance is labeled with its client number
+def render_metrics(instances: list) -> str:
+    clients = [(str(i + 1), instance) for i, instance in enumerate(instances)]
+    lines = []
+
+    def add(name: str, kind: str, help: str, samples) -> None:
+        lines.append(f"# HELP {METRIC_PREFIX}{name} {help}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+        for labels, value in samples:
+            if kind == "histogram":
+                _add_histogram(lines, METRIC_PREFIX + name, labels, value)
+            else:
+                lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+
+    add("nodes_bought_total", "counter", "Nodes bought by rarity",
+        [({"client": client, "rarity": rarity.name.lower()}, instance.get_metrics().nodes_by_rarity[rarity])
+         for client, instance in clients for rarity in Rarity])
+    add("bloodpoints_spent_total", "counter", "Estimated bloodpoints spent",
+        [({"client": client}, instance.get_metrics().bloodpoints_spent) for client, instance in clients])
+    add("levels_completed_total", "counter", "Completed Bloodweb levels",
+        [({"client": client}, instance.get_metrics().levels_completed) for client, instance in clients])
+    add("prestiges_total", "counter", "Prestiges",
+        [({"client": client}, instance.get_metrics().get_prestige_count()) for client, instance in clients])
+    add("empty_scans_total", "counter", "Scans that found nothing to buy",
+        [({"client": client}, instance.get_metrics().empty_scans) for client, instance in clients])
+    add("pauses_total", "counter", "Times the program was paused",
+        [({"client": client}, instance.get_metrics().pauses) for client, instance in clients])
+    add("paused", "gauge", "1 while paused",
+        [({"client": client}, int(instance.is_paused())) for client, instance in clients])
+    add("capture_seconds", "histogram", "Time to capture the web",
+        [({"client": client}, instance.get_metrics().capture_time) for client, instance in clients])
+    add("analysis_seconds", "histogram", "Time to analyze a capture of the web",
+        [({"client": client}, instance.get_metrics().analysis_time) for client, instance in clients])
+    add("click_hold_seconds", "histogram", "Time the mouse button was held for each click",
+        [({"client": client}, instance.get_metrics().click_hold_time) for client, instance in clients])
+    add("prestige_seconds", "histogram", "Time from pressing the prestige node until the new web appeared",
+        [({"client": client}, instance.get_metrics().prestige_time) for client, instance in clients])
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = render_metrics(self.server.instances).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Scrapes are not logged
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+# Serves the session metrics of the instances for Prometheus on http://127.0.0.1:<port>/metrics
+# Scrapes only read the counters, the buy loops never wait for them
+class MetricsServer:
+    def __init__(self, instances: list, port: int) -> None:
+        self._instances = instances
+        self._port = port
+        self._server = None
+        self._thread = None
+
+    def start(self) -> None:
+        self._server = ThreadingHTTPServer((METRICS_HOST, self._port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.instances = self._instances
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics server", daemon=True)
+        self._thread.start()
+        log(f"Metrics available at http://{METRICS_HOST}:{self._server.server_address[1]}{METRICS_PATH}")
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
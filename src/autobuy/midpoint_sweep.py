@@ -0,0 +1,192 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image, ImageDraw
+from debug_overlay import DebugOverlay, ImageWriter
+from frame_source import crop_frame
+from logger import log
+from web_analyzer import WebAnalyzer, NODE_COUNT, NODE_SIZE, NODE_EDGE_OFFSET, EDGE_SAMPLE_RADIUS
+
+# Candidates are placed on a grid around the guessed midpoint, distances in pixels
+DEFAULT_SWEEP_RADIUS = 10
+DEFAULT_SWEEP_STEP = 0.5
+# Smaller grids are scored in this process, starting worker processes takes longer than scoring them
+PARALLEL_MIN_CANDIDATES = 20000
+# Candidates scored at once, limits the memory used for the sampled pixels
+CHUNK_SIZE = 4096
+# Candidates within these distances in pixels are averaged to find the middle of equally good areas
+# The larger one is about the width of a ring, the smaller one splits the ties left in narrow areas
+STABILITY_RADII = (4.0, 1.0)
+# Rows of the printed table and the number of candidates on the contact sheet
+TABLE_ROWS = 10
+CONTACT_SHEET_CANDIDATES = 6
+CONTACT_SHEET_COLUMNS = 3
+CONTACT_SHEET_THUMBNAIL_WIDTH = 480
+
+
+class SweepCandidate:
+    midpoint : np.ndarray
+    # Amount of node edges that matched the buyable ring color
+    matches : int
+    # Mean closeness of all node edges to the ring color, 1 is an exact match on every edge
+    score : float
+    # Nodes whose edge matched
+    buyable : np.ndarray
+
+    def __init__(self, midpoint, matches, score, buyable) -> None:
+        self.midpoint = midpoint
+        self.matches = matches
+        self.score = score
+        self.buyable = buyable
+
+
+# Returns the edge color distances of shape (candidates, 30) for each candidate midpoint of shape (candidates, 2)
+# image is a part of the game window capture placed at origin, local_edges are the edge points relative to the midpoint
+def _get_edge_distances(image, origin, local_edges, candidates, color) -> np.ndarray:
+    points = np.round(local_edges[None,:,:] + candidates[:,None,:]).astype(np.int32) - origin
+    ys = np.clip(points[:,:,1,None] + np.arange(-EDGE_SAMPLE_RADIUS, EDGE_SAMPLE_RADIUS), 0, image.shape[0] - 1)
+    xs = np.clip(points[:,:,0,None], 0, image.shape[1] - 1)
+    diffs = image[ys, xs].astype(np.int16) - color
+    sq_dists = np.square(diffs, dtype=np.int32).sum(axis=3, dtype=np.int32)
+    return np.sqrt(sq_dists.min(axis=2))
+
+
+# Worker processes receive the capture once when they start
+_worker_args = None
+
+def _init_worker(*args) -> None:
+    global _worker_args
+    _worker_args = args
+
+def _score_in_worker(candidates: np.ndarray) -> np.ndarray:
+    image, origin, local_edges, color = _worker_args
+    return _get_edge_distances(image, origin, local_edges, candidates, color)
+
+
+# Finds the web midpoint of an unsupported resolution from a single capture
+# Every candidate midpoint on a grid around the guess moves the sample points of the reference layout,
+# the candidates are ranked by how many node edge samples land on the ring of a buyable node
+# The Bloodweb needs to be open with some buyable nodes
+class MidpointSweep:
+    def __init__(self, analyzer: WebAnalyzer, radius: float = DEFAULT_SWEEP_RADIUS, step: float = DEFAULT_SWEEP_STEP,
+                 workers: int = None) -> None:
+        self._analyzer = analyzer
+        self._radius = radius
+        self._step = step
+        self._workers = workers or os.cpu_count() or 1
+
+    def _get_offsets(self) -> np.ndarray:
+        return np.arange(-self._radius, self._radius + self._step / 2, self._step)
+
+    def _get_candidates(self, guess: np.ndarray) -> np.ndarray:
+        offsets = self._get_offsets()
+        xx, yy = np.meshgrid(guess[0] + offsets, guess[1] + offsets)
+        return np.stack([xx.ravel(), yy.ravel()], axis=1)
+
+    # Mean of the values of the neighboring candidates on the grid
+    # A ring is several pixels wide, so many neighboring midpoints match equally well and the middle of them is the most likely one
+    def _get_neighborhood_mean(self, values: np.ndarray, distance: float) -> np.ndarray:
+        size = len(self._get_offsets())
+        radius = int(round(distance / self._step))
+        window = 2 * radius + 1
+        padded = np.pad(values.reshape(size, size).astype(float), radius, mode="edge")
+        # Box sums from a summed-area table
+        table = np.pad(padded.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+        sums = table[window:, window:] - table[:-window, window:] - table[window:, :-window] + table[:-window, :-window]
+        return (sums / window ** 2).ravel()
+
+    # Returns the candidates ranked best first
+    def run(self, guess: np.ndarray) -> list:
+        analyzer = self._analyzer
+        window_size = analyzer.get_window_size()
+        self._capture = analyzer.capture((0, 0, window_size[0], window_size[1]))
+        self._local_nodes = analyzer.get_local_node_points()
+        self._edge_offset = np.round(NODE_EDGE_OFFSET * analyzer.get_scaling())
+        local_edges = self._local_nodes + self._edge_offset
+        color = analyzer.get_color_available()
+        tolerance = analyzer.get_node_tolerance()
+        candidates = self._get_candidates(np.asarray(guess, float))
+
+        # Only the area the edge samples of the candidates can land on is needed
+        low = np.floor(local_edges.min(axis=0) + candidates.min(axis=0)).astype(int) - EDGE_SAMPLE_RADIUS
+        high = np.ceil(local_edges.max(axis=0) + candidates.max(axis=0)).astype(int) + EDGE_SAMPLE_RADIUS + 1
+        origin = np.maximum(low, 0)
+        image = np.ascontiguousarray(self._capture[origin[1]:high[1], origin[0]:high[0]])
+
+        chunks = [candidates[i:i + CHUNK_SIZE] for i in range(0, len(candidates), CHUNK_SIZE)]
+        if self._workers > 1 and len(candidates) >= PARALLEL_MIN_CANDIDATES:
+            with ProcessPoolExecutor(self._workers, initializer=_init_worker,
+                                     initargs=(image, origin, local_edges, color)) as executor:
+                distances = np.concatenate(list(executor.map(_score_in_worker, chunks)))
+        else:
+            distances = np.concatenate([_get_edge_distances(image, origin, local_edges, chunk, color) for chunk in chunks])
+
+        matched = distances < tolerance
+        matches = matched.sum(axis=1)
+        scores = np.clip(1.0 - distances / tolerance, 0.0, 1.0).mean(axis=1)
+        # Most matching edges first, then the middle of equally matching areas, closer colors break the remaining ties
+        stability = [-self._get_neighborhood_mean(matches, distance) for distance in reversed(STABILITY_RADII)]
+        order = np.lexsort((-scores, *stability, -matches))
+        return [SweepCandidate(candidates[i], int(matches[i]), float(scores[i]), matched[i].nonzero()[0]) for i in order]
+
+    def log_table(self, ranked: list, rows: int = TABLE_ROWS) -> None:
+        log(f"{'Rank':<6}{'Midpoint':<20}{'Edges':>8}{'Score':>8}")
+        for rank, candidate in enumerate(ranked[:rows], 1):
+            midpoint = f"{candidate.midpoint[0]:.1f}, {candidate.midpoint[1]:.1f}"
+            log(f"{rank:<6}{midpoint:<20}{candidate.matches:>5}/{NODE_COUNT}{candidate.score:>8.2f}")
+
+    # Draws the sample points of the best candidates side by side
+    def create_contact_sheet(self, ranked: list, count: int = CONTACT_SHEET_CANDIDATES) -> Image.Image:
+        scaling = self._analyzer.get_scaling()
+        node_size = int(NODE_SIZE * scaling)
+        padding = node_size // 2
+        thumbnails = []
+        for rank, candidate in enumerate(ranked[:count], 1):
+            nodes = np.round(self._local_nodes + candidate.midpoint).astype(np.int32)
+            bbox = (*(nodes.min(axis=0) - padding), *(nodes.max(axis=0) + padding + 1))
+            groups = {"nodes": nodes, "edges": nodes + self._edge_offset.astype(np.int32)}
+            overlay = DebugOverlay(np.array(bbox[:2]), groups, node_size, int((bbox[2] - bbox[0]) / 50))
+            image = overlay.render(crop_frame(self._capture, (0, 0), bbox), ["nodes", "edges"], candidate.buyable)
+            height = int(image.height * CONTACT_SHEET_THUMBNAIL_WIDTH / image.width)
+            image = image.resize((CONTACT_SHEET_THUMBNAIL_WIDTH, height), Image.Resampling.BILINEAR)
+            label = f"{rank}: {candidate.midpoint[0]:.1f}, {candidate.midpoint[1]:.1f}  {candidate.matches}/{NODE_COUNT}"
+            draw = ImageDraw.Draw(image)
+            draw.rectangle((0, 0, CONTACT_SHEET_THUMBNAIL_WIDTH, 16), fill=(0, 0, 0))
+            draw.text((4, 2), label, fill=(255, 255, 255))
+            thumbnails.append(image)
+
+        columns = min(CONTACT_SHEET_COLUMNS, len(thumbnails))
+        rows = -(-len(thumbnails) // columns)
+        cell_height = max(image.height for image in thumbnails)
+        sheet = Image.new("RGB", (columns * CONTACT_SHEET_THUMBNAIL_WIDTH, rows * cell_height))
+        for i, image in enumerate(thumbnails):
+            sheet.paste(image, ((i % columns) * CONTACT_SHEET_THUMBNAIL_WIDTH, (i // columns) * cell_height))
+        return sheet
+
+
+# Runs the sweep around the midpoint of the analyzer, prints the ranking and saves a contact sheet of the best candidates
+def run_sweep(analyzer: WebAnalyzer, radius: float = DEFAULT_SWEEP_RADIUS, step: float = DEFAULT_SWEEP_STEP,
+              output_dir: Path = None) -> SweepCandidate:
+    log("\n---- Starting midpoint sweep ----")
+    guess = analyzer.get_midpoint()
+    sweep = MidpointSweep(analyzer, radius, step)
+    ranked = sweep.run(guess)
+    log(f"Scored {len(ranked)} midpoints within {radius} px of {guess[0]:.1f}, {guess[1]:.1f}")
+    sweep.log_table(ranked)
+    best = ranked[0]
+    if best.matches == 0:
+        log("No node edges matched, open the Bloodweb with some available nodes or widen the sweep")
+        return None
+
+    if output_dir is None:
+        output_dir = Path.home() / "Desktop"
+    sheet_path = output_dir / f"BAB_sweep_{best.midpoint[0]:.1f}_{best.midpoint[1]:.1f}.png"
+    writer = ImageWriter()
+    writer.save(sweep.create_contact_sheet(ranked), sheet_path)
+    if writer.close():
+        log(f"Could not save the contact sheet to '{output_dir}'")
+    else:
+        log(f"Contact sheet saved to {sheet_path}")
+    log(f"Best midpoint: X {best.midpoint[0]:.1f}, Y {best.midpoint[1]:.1f}")
+    return best
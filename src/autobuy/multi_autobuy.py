@@ -0,0 +1,95 @@
+import threading
+from time import time
+import keyboard
+from colored import stylize
+from web_autobuy import PAUSE_COLOR, RUNNING_COLOR
+from logger import log, flush_log
+from input_backend import InputBackend, MouseInput
+from cursor_scheduler import CursorScheduler
+
+
+# Runs several Autobuy instances in parallel, one for each game client
+# Every instance scans its own capture area in its own thread, the mouse is shared through a CursorScheduler
+class MultiAutobuy:
+    def __init__(self, instances: list, input_backend: InputBackend = None) -> None:
+        self._instances = instances
+        self._input = input_backend
+        self._register_hotkeys = True
+
+    def set_register_hotkeys(self, register_hotkeys: bool) -> None:
+        self._register_hotkeys = register_hotkeys
+
+    def stop(self) -> None:
+        for instance in self._instances:
+            instance.stop()
+
+    # Pauses all instances if any is running, otherwise resumes all
+    def _toggle_pause(self) -> None:
+        paused = not all(instance.is_paused() for instance in self._instances)
+        for instance in self._instances:
+            instance.set_paused(paused)
+
+    def _stop_if_paused(self) -> None:
+        if not any(instance.is_paused() for instance in self._instances):
+            self.stop()
+
+    # Sets up the instances, returns the ones that were initialized
+    # Several instances share the mouse, each of them is told apart in the log by its number
+    def _setup(self) -> list:
+        if self._input is None:
+            self._input = MouseInput()
+        cursor = CursorScheduler() if len(self._instances) > 1 else None
+        for i, instance in enumerate(self._instances):
+            instance.set_input_backend(self._input)
+            if cursor is not None:
+                instance.set_cursor_scheduler(cursor)
+                instance.set_log_prefix(f"[{i + 1}] ")
+
+        running = [instance for instance in self._instances if instance.setup()]
+        if not running:
+            log("Failed to initialize")
+            return running
+        self._instances = running
+
+        log(f"\n---- Running Autobuy on {len(running)} clients ----" if len(running) > 1 else "\n---- Running Autobuy ----")
+        if all(instance.is_paused() for instance in running):
+            log(stylize("F3: Begin, F2: Stop", PAUSE_COLOR))
+        else:
+            log(stylize("F2: Stop, F3: Pause/Resume", RUNNING_COLOR))
+        return running
+
+    def _add_hotkeys(self) -> None:
+        if self._register_hotkeys:
+            keyboard.add_hotkey('f3', lambda: self._toggle_pause())
+            keyboard.add_hotkey('f2', lambda: self.stop())
+            keyboard.add_hotkey('esc', lambda: self._stop_if_paused())
+
+    def _log_summary(self, start_time: float) -> None:
+        if len(self._instances) < 2:
+            return
+        hours = max(time() - start_time, 1) / 3600
+        total = sum(instance.get_nodes_bought() for instance in self._instances)
+        log(f"Bought {total} nodes on {len(self._instances)} clients, {total / hours:.0f} nodes/hour")
+
+    def run(self) -> None:
+        running = self._setup()
+        if not running:
+            return
+        self._add_hotkeys()
+
+        start_time = time()
+        threads = [threading.Thread(target=instance.run_loop, daemon=True) for instance in running]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                # Joined with a timeout so the main thread stays responsive to interrupts
+                while thread.is_alive():
+                    thread.join(0.5)
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+        self._log_summary(start_time)
+        flush_log()
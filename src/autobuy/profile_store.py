@@ -0,0 +1,72 @@
+import json
+import threading
+from pathlib import Path
+
+# File the run profiles are stored in
+PROFILES_FILE = Path.home() / "BloodwebAutoBuy" / "profiles.json"
+
+
+# Profiles are stored separately for each monitor and game window size
+# The calibration is in game window space, so moving the window on the same monitor keeps its profile
+def get_profile_key(monitor: int, size) -> str:
+    return f"{int(size[0])}x{int(size[1])}@monitor{int(monitor)}"
+
+
+# Stores the calibration of previous runs so the next launch doesn't need to derive it again
+# A profile is a dict with the keys:
+#   midpoint:       Web center position in game window space
+#   scaling:        Sample point scaling factor
+#   sample_points:  Transformed sample points in game window space
+#   ring_color:     Purchasable node ring color, RGB
+#   node_tolerance: Node color detection tolerance
+#   timings:        Learned buying intervals, see IntervalTuner.to_dict
+#   window_offset:  Game window position relative to the top left corner of its monitor when last stored
+# One store is shared by all instances of a run, each game client changes the profile of its own key
+# Saving merges the changed keys into the file as it is on disk, so profiles saved by others aren't overwritten
+class ProfileStore:
+    def __init__(self, path: Path = PROFILES_FILE) -> None:
+        self._path = Path(path)
+        self._profiles = None
+        # Keys changed since the last save, None for removed keys
+        self._changes = {}
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            with open(self._path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self) -> dict:
+        if self._profiles is None:
+            self._profiles = self._read()
+        return self._profiles
+
+    def get(self, key: str) -> dict:
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, key: str, profile: dict) -> None:
+        with self._lock:
+            self._load()[key] = profile
+            self._changes[key] = profile
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._load().pop(key, None)
+            self._changes[key] = None
+
+    def save(self) -> None:
+        with self._lock:
+            profiles = self._read()
+            for key, profile in self._changes.items():
+                if profile is None:
+                    profiles.pop(key, None)
+                else:
+                    profiles[key] = profile
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._path, "w") as f:
+                json.dump(profiles, f, indent=2)
+            self._profiles = profiles
+            self._changes = {}
@@ -0,0 +1,284 @@
+import random
+import sys
+import numpy as np
+from argparse import ArgumentParser
+from time import perf_counter
+from clock import VirtualClock
+from frame_source import FrameSource, crop_frame
+from input_backend import FakeInput
+from logger import log, flush_log
+from session_recorder import read_recording, RECORD_INFO, RECORD_FRAME, RECORD_SCAN, RECORD_EVENT, RECORD_GRAB
+from web_autobuy import Autobuy
+
+# Seed of the random generators, shuffled ordering is only comparable between replays, not with the recording
+REPLAY_SEED = 0
+# Divergences printed at most
+DEFAULT_MAX_DIVERGENCES = 20
+
+
+# Answers the cheap checks with the grabs recorded after the current frame, in the order they were recorded
+# Areas that weren't grabbed in the recorded session, e.g. a check of a different node, are cropped from the frame
+class ReplayFrameSource(FrameSource):
+    def __init__(self) -> None:
+        self._frame = None
+        self._origin = (0, 0)
+        self._grabs = []
+        self.cropped_grabs = 0
+
+    def push(self, frame: np.ndarray, origin: tuple[int, int], grabs: list) -> None:
+        self._frame = frame
+        self._origin = origin
+        self._grabs = list(grabs)
+
+    def grab(self, bbox: tuple[int, int, int, int]) -> np.ndarray:
+        bbox = tuple(int(c) for c in bbox)
+        for index, (grab_bbox, image) in enumerate(self._grabs):
+            if grab_bbox == bbox:
+                del self._grabs[index]
+                return image
+        self.cropped_grabs += 1
+        return crop_frame(self._frame, self._origin, bbox)
+
+
+# Takes the place of the SessionRecorder during a replay and keeps what the replayed session did
+class _ReplayLog:
+    def __init__(self, clock: VirtualClock) -> None:
+        self._clock = clock
+        self.scans = []
+        self.events = []
+
+    def start(self, info: dict) -> None:
+        pass
+
+    def record_frame(self, image: np.ndarray) -> None:
+        pass
+
+    def record_grab(self, bbox: tuple[int, int, int, int], image: np.ndarray) -> None:
+        pass
+
+    def record_scan(self, nodes: np.ndarray, confidences: np.ndarray) -> None:
+        self.scans.append(np.asarray(nodes).tolist())
+
+    def record_event(self, event: str, **details) -> None:
+        self.events.append((self._clock.now(), {"event": event, **details}))
+
+    def close(self) -> None:
+        pass
+
+
+# One recorded frame with the scan result and the events and grabs that followed it
+class _Step:
+    def __init__(self, timestamp: float, frame: np.ndarray) -> None:
+        self.timestamp = timestamp
+        self.frame = frame
+        self.scan = None
+        self.events = []
+        self.grabs = []
+
+
+# Feeds a recorded session through the analyzer and the buying logic again and compares the decisions
+# Time is virtual, each frame is analyzed at the time it was recorded and waits take no real time
+class SessionReplay:
+    def __init__(self, path) -> None:
+        self._path = path
+        # Called with the Autobuy instance before it's set up, used to try out different options
+        self._configure = None
+        self._verbose = False
+
+    def set_configure(self, configure) -> None:
+        self._configure = configure
+
+    def set_verbose(self, verbose: bool) -> None:
+        self._verbose = verbose
+
+    def run(self) -> dict:
+        random.seed(REPLAY_SEED)
+        np.random.seed(REPLAY_SEED)
+        self._clock = VirtualClock()
+        self._frames = ReplayFrameSource()
+        self._replay_log = _ReplayLog(self._clock)
+        self._autobuy = None
+        self._report = {
+            "frames": 0, "skipped_frames": 0, "detection_matches": 0, "order_matches": 0, "click_matches": 0,
+            "divergences": [], "analysis_times": [], "click_offsets": [], "lagging_frames": 0, "duration": 0.0,
+        }
+        start = perf_counter()
+        step = None
+        for kind, timestamp, data in read_recording(self._path):
+            self._report["duration"] = timestamp
+            if kind == RECORD_INFO:
+                if self._autobuy is None:
+                    self._setup(data)
+            elif kind == RECORD_FRAME:
+                self._run_step(step)
+                step = _Step(timestamp, data)
+            elif kind == RECORD_SCAN:
+                if step is None or step.scan is not None:
+                    # The recorder dropped the frame of this scan
+                    self._run_step(step)
+                    step = _Step(timestamp, None)
+                step.scan = data["nodes"]
+            elif kind == RECORD_EVENT and step is not None:
+                step.events.append((timestamp, data))
+            elif kind == RECORD_GRAB and step is not None:
+                step.grabs.append(data)
+        self._run_step(step)
+        self._report["wall_time"] = perf_counter() - start
+        self._report["cropped_grabs"] = self._frames.cropped_grabs
+        return self._report
+
+    def _setup(self, info: dict) -> None:
+        self._origin = tuple(info["capture_bbox"][:2])
+        self._autobuy = Autobuy()
+        self._autobuy.set_clock(self._clock)
+        self._autobuy.set_input_backend(FakeInput(self._clock.now))
+        self._autobuy.set_verbose(self._verbose)
+        if "options" in info:
+            self._autobuy.set_options(info["options"])
+        self._autobuy.web_analyzer.set_frame_source(self._frames)
+        self._autobuy.web_analyzer.set_recorded_session(info)
+        self._autobuy.set_session_recorder(self._replay_log)
+        if self._configure is not None:
+            self._configure(self._autobuy)
+        if not self._autobuy.setup():
+            raise ValueError("Failed to set up the recorded session")
+        self._autobuy.start_session()
+
+    def _run_step(self, step: _Step) -> None:
+        if step is None:
+            return
+        if step.frame is None:
+            self._report["skipped_frames"] += 1
+            return
+        report = self._report
+        report["frames"] += 1
+        autobuy = self._autobuy
+
+        self._clock.advance_to(step.timestamp)
+        if self._clock.now() > step.timestamp:
+            # The replayed decisions of the previous frames took longer than the recorded ones
+            report["lagging_frames"] += 1
+        self._frames.push(step.frame, self._origin, step.grabs)
+        # The recorded session was running when this frame was captured
+        if autobuy.is_paused():
+            autobuy.set_paused(False)
+        scan_count = len(self._replay_log.scans)
+        event_count = len(self._replay_log.events)
+        analyzer = autobuy.web_analyzer
+        start = perf_counter()
+        if autobuy.prepare_scan():
+            scan = analyzer.analyze_capture(step.frame)
+            autobuy.handle_scan(scan, 0.0, analyzer.last_analysis_time)
+        report["analysis_times"].append(perf_counter() - start)
+
+        scan = self._replay_log.scans[-1] if len(self._replay_log.scans) > scan_count else []
+        recorded_clicks = [(t, data["pos"]) for t, data in step.events if data["event"] == "click"]
+        replayed_clicks = [(t, data["pos"]) for t, data in self._replay_log.events[event_count:] if data["event"] == "click"]
+        self._compare(step, scan, recorded_clicks, replayed_clicks)
+
+        # Follow the window changes of the recorded session
+        for _, data in step.events:
+            if data["event"] == "window":
+                self._origin = tuple(data["info"]["capture_bbox"][:2])
+                autobuy.follow_window(data["info"])
+
+    def _compare(self, step: _Step, scan: list, recorded_clicks: list, replayed_clicks: list) -> None:
+        report = self._report
+        frame = report["frames"]
+        if step.scan is not None:
+            if sorted(step.scan) != sorted(scan):
+                self._add_divergence(frame, step.timestamp, "detection", step.scan, scan)
+            else:
+                report["detection_matches"] += 1
+                if step.scan != scan:
+                    self._add_divergence(frame, step.timestamp, "order", step.scan, scan)
+                else:
+                    report["order_matches"] += 1
+
+        recorded = [self._get_clicked_node(pos) for _, pos in recorded_clicks]
+        replayed = [self._get_clicked_node(pos) for _, pos in replayed_clicks]
+        if recorded != replayed:
+            self._add_divergence(frame, step.timestamp, "clicks", recorded, replayed)
+            return
+        report["click_matches"] += 1
+        for (recorded_time, _), (replayed_time, _) in zip(recorded_clicks, replayed_clicks):
+            report["click_offsets"].append(replayed_time - recorded_time)
+
+    def _add_divergence(self, frame: int, timestamp: float, kind: str, recorded, replayed) -> None:
+        self._report["divergences"].append((frame, timestamp, kind, recorded, replayed))
+
+    # Returns the node at the clicked position, or the position if no node is there
+    def _get_clicked_node(self, pos: list):
+        analyzer = self._autobuy.web_analyzer
+        for node in range(-1, 30):
+            node_pos = analyzer.get_node_position(node)
+            if int(node_pos[0]) == pos[0] and int(node_pos[1]) == pos[1]:
+                return node
+        return tuple(pos)
+
+
+def print_report(report: dict, max_divergences: int = DEFAULT_MAX_DIVERGENCES) -> None:
+    frames = max(report["frames"], 1)
+    speed = report["duration"] / max(report["wall_time"], 1e-9)
+    log(f"\n---- Replayed {report['frames']} frames of a {report['duration']:.1f} s session "
+        f"in {report['wall_time']:.2f} s, {speed:.0f}x real time ----")
+    if report["skipped_frames"] > 0:
+        log(f"Skipped {report['skipped_frames']} frames dropped by the recorder")
+    log(f"Detections matching:  {report['detection_matches']}/{frames}")
+    log(f"Orderings matching:   {report['order_matches']}/{frames}")
+    log(f"Clicks matching:      {report['click_matches']}/{frames}")
+
+    divergences = report["divergences"]
+    if divergences:
+        log(f"Divergences: {len(divergences)}")
+        for frame, timestamp, kind, recorded, replayed in divergences[:max_divergences]:
+            log(f"  Frame {frame} at {timestamp:.2f} s, {kind}: recorded {recorded}, replayed {replayed}")
+        if len(divergences) > max_divergences:
+            log(f"  ... {len(divergences) - max_divergences} more")
+
+    times = np.array(report["analysis_times"]) * 1e3
+    if len(times) > 0:
+        log(f"Decision time per frame: mean {times.mean():.2f} ms, 95th percentile {np.percentile(times, 95):.2f} ms")
+    offsets = np.array(report["click_offsets"])
+    if len(offsets) > 0:
+        log(f"Click time offset to the recording: mean {offsets.mean() * 1e3:+.1f} ms, "
+            f"largest {offsets[np.abs(offsets).argmax()] * 1e3:+.1f} ms")
+    if report["lagging_frames"] > 0:
+        log(f"Replay was behind the recording on {report['lagging_frames']} frames")
+    if report["cropped_grabs"] > 0:
+        log(f"{report['cropped_grabs']} checks were not in the recording and were answered from the frame")
+
+
+def main():
+    parser = ArgumentParser("Bloodweb AutoBuy replay", description="Replays a recorded session and compares the decisions")
+    parser.add_argument("recording", help="Session recording file")
+    parser.add_argument("--node_tolerance", type=int, help="Node color detection threshold instead of the recorded one")
+    parser.add_argument("--ring_color", help="Ring color as #rrggbb instead of the recorded one")
+    parser.add_argument("--min_confidence", type=float, help="Minimum detection confidence in percent instead of the recorded one")
+    parser.add_argument("--ordering", choices=[ordering.name.lower() for ordering in Autobuy.Ordering],
+                        help="Node ordering instead of the recorded one")
+    parser.add_argument("--max_divergences", type=int, default=DEFAULT_MAX_DIVERGENCES, help="Divergences printed at most")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    def configure(autobuy: Autobuy) -> None:
+        if args.node_tolerance is not None:
+            autobuy.web_analyzer.set_node_tolerance(args.node_tolerance)
+        if args.ring_color is not None:
+            autobuy.web_analyzer.set_color_available(tuple(bytes.fromhex(args.ring_color.lstrip("#"))))
+        if args.min_confidence is not None:
+            autobuy.set_min_confidence(args.min_confidence / 100)
+        if args.ordering is not None:
+            autobuy.set_ordering(Autobuy.Ordering[args.ordering.upper()])
+
+    replay = SessionReplay(args.recording)
+    replay.set_configure(configure)
+    replay.set_verbose(args.verbose)
+    report = replay.run()
+    print_report(report, args.max_divergences)
+    flush_log()
+    sys.exit(1 if report["divergences"] else 0)
+
+
+if __name__ == "__main__":
+    main()
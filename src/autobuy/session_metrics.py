@@ -0,0 +1,106 @@
+import numpy as np
+from bisect import bisect_left
+from web_analyzer import Rarity
+
+# Time the fixed prestige sequence used to take: a 2.0 s hold, a 5.0 s wait, a 0.1 s click and a repeated 0.5 s click,
+# with the 0.05 s mouse settle delay before each of the three clicks
+LEGACY_PRESTIGE_TIME = 2.0 + 5.0 + 0.1 + 0.5 + 3 * 0.05
+
+# Bloodpoint cost of a node by rarity, used to estimate the bloodpoints spent
+NODE_COSTS = {
+    Rarity.COMMON : 3000,
+    Rarity.UNCOMMON : 4000,
+    Rarity.RARE : 5000,
+    Rarity.VERY_RARE : 6000,
+    Rarity.ULTRA_RARE : 7000,
+    Rarity.EVENT : 8000,
+}
+
+
+# Upper bounds of the histogram buckets in seconds
+SCAN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+CLICK_HOLD_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0)
+PRESTIGE_BUCKETS = (2.0, 3.0, 4.0, 5.0, 6.0, 8.0, 10.0, 15.0)
+
+
+# Counts of observed values by bucket, in the format of a Prometheus histogram
+# Only the thread running the buy loop writes, readers may see a value counted in the sum before its bucket
+class Histogram:
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        # Count of values in each bucket, not cumulative, the last one counts values above all bounds
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# Collects statistics of a session, reported when the program stops
+# Written only by the thread running the buy loop, so no locks are needed, the metrics server reads them from its own thread
+class SessionMetrics:
+    def __init__(self) -> None:
+        # Nodes bought by rarity
+        self.nodes_by_rarity = [0] * len(Rarity)
+        self.nodes_bought = 0
+        self.bloodpoints_spent = 0
+        # Completed levels, prestige levels included
+        self.levels_completed = 0
+        # Seconds from pressing the prestige node until the new web was detected
+        self.prestige_times = []
+        # Seconds saved by each prestige compared to the fixed prestige sequence
+        self.prestige_time_saved = []
+        # Scans that found nothing to buy
+        self.empty_scans = 0
+        self.pauses = 0
+        self.capture_time = Histogram(SCAN_BUCKETS)
+        self.analysis_time = Histogram(SCAN_BUCKETS)
+        self.click_hold_time = Histogram(CLICK_HOLD_BUCKETS)
+        self.prestige_time = Histogram(PRESTIGE_BUCKETS)
+
+    def record_node(self, rarity: Rarity) -> None:
+        self.nodes_by_rarity[rarity] += 1
+        self.nodes_bought += 1
+        self.bloodpoints_spent += NODE_COSTS[rarity]
+
+    def record_level(self) -> None:
+        self.levels_completed += 1
+
+    def record_prestige(self, duration: float) -> float:
+        self.levels_completed += 1
+        # The fixed sequence also had to wait for the new web when the animation took longer than its waits
+        saved = max(LEGACY_PRESTIGE_TIME - duration, 0.0)
+        self.prestige_times.append(duration)
+        self.prestige_time_saved.append(saved)
+        self.prestige_time.observe(duration)
+        return saved
+
+    def record_scan(self, capture_time: float, analysis_time: float, empty: bool) -> None:
+        self.capture_time.observe(capture_time)
+        self.analysis_time.observe(analysis_time)
+        if empty:
+            self.empty_scans += 1
+
+    def record_click(self, hold_time: float) -> None:
+        self.click_hold_time.observe(hold_time)
+
+    def record_pause(self) -> None:
+        self.pauses += 1
+
+    def get_prestige_count(self) -> int:
+        return len(self.prestige_times)
+
+    def get_report(self) -> str:
+        rarities = ", ".join(f"{count} {rarity.name.lower().replace('_', ' ')}"
+                             for rarity, count in zip(Rarity, self.nodes_by_rarity) if count > 0)
+        lines = [f"  Nodes bought: {self.nodes_bought}" + (f" ({rarities})" if rarities else ""),
+                 f"  Estimated bloodpoints spent: {self.bloodpoints_spent:,}",
+                 f"  Levels completed: {self.levels_completed}"]
+        if self.prestige_times:
+            times = np.array(self.prestige_times)
+            lines.append(f"  Prestiges: {len(times)}, {times.mean():.1f} s each on average,"
+                         f" {sum(self.prestige_time_saved):.1f} s saved in total")
+        return "\n".join(lines)
@@ -0,0 +1,215 @@
+import json
+import struct
+import threading
+import zlib
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+from queue import SimpleQueue
+from time import perf_counter
+from frame_source import FileFrameSource
+from logger import log
+
+# Directory the session recordings are written to
+RECORDINGS_DIR = Path.home() / "BloodwebAutoBuy" / "recordings"
+RECORDING_SUFFIX = ".babrec"
+
+# A recording starts with the magic bytes, followed by records of a header and a payload
+# Header: kind (uint8), timestamp in seconds since the start (float64), payload length (uint32)
+RECORDING_MAGIC = b"BABREC1\n"
+RECORD_HEADER = struct.Struct("<BdI")
+
+# Record kinds
+# Session info, JSON: window position and size, capture bbox and the calibration, see WebAnalyzer.get_calibration
+RECORD_INFO = 0
+# Capture of the web bounding box, see _encode_frame
+RECORD_FRAME = 1
+# Result of analyzing the previous frame, JSON: nodes and confidences
+RECORD_SCAN = 2
+# Action or state change, JSON: event name and its details, e.g. click position
+RECORD_EVENT = 3
+# Small capture of a cheap check, a single node edge or the prestige node, see _encode_grab
+RECORD_GRAB = 4
+
+# Frame payload header: keyframe flag (uint8), height and width (uint16)
+FRAME_HEADER = struct.Struct("<BHH")
+# Every nth frame is stored whole, the rest as the difference to the previous frame
+KEYFRAME_INTERVAL = 100
+# Fast compression, the XOR of two similar frames is mostly zeros
+COMPRESSION_LEVEL = 1
+# Grab payload header: capture bbox in screen coordinates (int32 left, top, right, bottom)
+GRAB_HEADER = struct.Struct("<iiii")
+
+# Frames and grabs are no longer recorded once the file reaches this size, scans and events still are
+MAX_RECORDING_SIZE = 2 * 1024 ** 3
+
+# Frames waiting to be written at most, further frames are dropped until the writer catches up
+MAX_QUEUED_FRAMES = 8
+
+
+# Returns a path for a new recording, named after the current time
+def get_recording_path(suffix: str = "") -> Path:
+    return RECORDINGS_DIR / f"session_{datetime.now():%Y%m%d_%H%M%S}{suffix}{RECORDING_SUFFIX}"
+
+
+# Writes the frames, scan results and events of a session to a file
+# Recording only queues the data, encoding and writing happen on a background thread
+class SessionRecorder:
+    def __init__(self, path: Path, clock = perf_counter, max_size: int = MAX_RECORDING_SIZE) -> None:
+        self.path = Path(path)
+        self._clock = clock
+        self._max_size = max_size
+        self._start_time = clock()
+        self._queue = SimpleQueue()
+        self._queued_frames = 0
+        self._frames_lock = threading.Lock()
+        self._dropped_frames = 0
+        self._thread = None
+        # Writer state
+        self._file = None
+        self._previous_frame = None
+        self._frames_since_key = 0
+        self._size = 0
+        self._size_limited = False
+
+    def start(self, info: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "wb")
+        self._file.write(RECORDING_MAGIC)
+        self._size = len(RECORDING_MAGIC)
+        self._thread = threading.Thread(target=self._write_loop, name="recorder", daemon=True)
+        self._thread.start()
+        self._put(RECORD_INFO, info)
+
+    def record_frame(self, image: np.ndarray) -> None:
+        with self._frames_lock:
+            if self._queued_frames >= MAX_QUEUED_FRAMES:
+                self._dropped_frames += 1
+                return
+            self._queued_frames += 1
+        self._queue.put((RECORD_FRAME, self._get_time(), image))
+
+    # Records the capture of a cheap check, bbox in screen coordinates
+    def record_grab(self, bbox: tuple[int, int, int, int], image: np.ndarray) -> None:
+        self._queue.put((RECORD_GRAB, self._get_time(), (bbox, image)))
+
+    def record_scan(self, nodes: np.ndarray, confidences: np.ndarray) -> None:
+        self._put(RECORD_SCAN, {"nodes": np.asarray(nodes).tolist(), "confidences": np.round(confidences, 3).tolist()})
+
+    def record_event(self, event: str, **details) -> None:
+        self._put(RECORD_EVENT, {"event": event, **details})
+
+    # Writes the queued records and closes the file
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        size = self._size / 1024 ** 2
+        hours = self._get_time() / 3600
+        log(f"Session recorded to {self.path}, {size:.1f} MB, {size / max(hours, 1e-9):.0f} MB per hour")
+        if self._dropped_frames > 0:
+            log(f"  {self._dropped_frames} frames were dropped while the recorder was busy")
+        if self._size_limited:
+            log(f"  Frames were no longer recorded after the size limit of {self._max_size / 1024 ** 2:.0f} MB")
+
+    def _get_time(self) -> float:
+        return self._clock() - self._start_time
+
+    def _put(self, kind: int, data: dict) -> None:
+        self._queue.put((kind, self._get_time(), data))
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._file.flush()
+                return
+            kind, timestamp, data = item
+            if kind == RECORD_FRAME:
+                with self._frames_lock:
+                    self._queued_frames -= 1
+            if kind in (RECORD_FRAME, RECORD_GRAB) and self._size_limited:
+                continue
+            if kind == RECORD_FRAME:
+                payload = self._encode_frame(data)
+            elif kind == RECORD_GRAB:
+                payload = self._encode_grab(*data)
+            else:
+                payload = json.dumps(data).encode()
+            if kind in (RECORD_FRAME, RECORD_GRAB) and self._size + RECORD_HEADER.size + len(payload) > self._max_size:
+                self._size_limited = True
+                log(f"Recording reached {self._max_size / 1024 ** 2:.0f} MB, frames are no longer recorded")
+                continue
+            self._file.write(RECORD_HEADER.pack(kind, timestamp, len(payload)))
+            self._file.write(payload)
+            self._size += RECORD_HEADER.size + len(payload)
+
+    # Keyframes are compressed as is, other frames as the XOR with the previous frame
+    def _encode_frame(self, image: np.ndarray) -> bytes:
+        image = np.ascontiguousarray(image, np.uint8)
+        keyframe = (self._previous_frame is None or self._previous_frame.shape != image.shape
+                    or self._frames_since_key >= KEYFRAME_INTERVAL)
+        if keyframe:
+            data = image
+            self._frames_since_key = 0
+        else:
+            data = np.bitwise_xor(image, self._previous_frame)
+            self._frames_since_key += 1
+        self._previous_frame = image
+        header = FRAME_HEADER.pack(keyframe, image.shape[0], image.shape[1])
+        return header + zlib.compress(data.tobytes(), COMPRESSION_LEVEL)
+
+    # Grabs are small, so they are compressed as is, the size follows from the bbox
+    @staticmethod
+    def _encode_grab(bbox: tuple[int, int, int, int], image: np.ndarray) -> bytes:
+        image = np.ascontiguousarray(image, np.uint8)
+        return GRAB_HEADER.pack(*(int(c) for c in bbox)) + zlib.compress(image.tobytes(), COMPRESSION_LEVEL)
+
+
+# Reads the records of a recording in order
+# Yields (kind, timestamp, data), frames are decoded into BGR arrays, grabs into (bbox, BGR array) and the rest into dicts
+def read_recording(path: Path):
+    with open(path, "rb") as file:
+        if file.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"Not a session recording: {path}")
+        previous_frame = None
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # End of file, or a recording cut short
+                return
+            kind, timestamp, length = RECORD_HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+            if kind == RECORD_FRAME:
+                keyframe, height, width = FRAME_HEADER.unpack_from(payload)
+                data = np.frombuffer(zlib.decompress(payload[FRAME_HEADER.size:]), np.uint8).reshape(height, width, 3)
+                frame = data if keyframe else np.bitwise_xor(data, previous_frame)
+                previous_frame = frame
+                yield kind, timestamp, frame
+            elif kind == RECORD_GRAB:
+                bbox = GRAB_HEADER.unpack_from(payload)
+                data = np.frombuffer(zlib.decompress(payload[GRAB_HEADER.size:]), np.uint8)
+                yield kind, timestamp, (bbox, data.reshape(bbox[3] - bbox[1], bbox[2] - bbox[0], 3))
+            else:
+                yield kind, timestamp, json.loads(payload)
+
+
+# Returns the session info and a frame source serving the recorded frames in order
+# The frames are placed at the recorded capture position, so grabs of single nodes are served from the current frame
+def load_frame_source(path: Path) -> tuple[dict, FileFrameSource]:
+    info = None
+    frames = []
+    for kind, _, data in read_recording(path):
+        if kind == RECORD_INFO and info is None:
+            info = data
+        elif kind == RECORD_FRAME:
+            frames.append(data)
+    if info is None or not frames:
+        raise ValueError(f"Recording has no frames: {path}")
+    bbox = info["capture_bbox"]
+    return info, FileFrameSource(frames, origin=(bbox[0], bbox[1]))
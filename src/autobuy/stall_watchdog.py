@@ -0,0 +1,65 @@
+from enum import Enum
+from pathlib import Path
+import numpy as np
+
+# Directory the diagnostic snapshots of stalled sessions are written to
+DIAGNOSTICS_DIR = Path.home() / "BloodwebAutoBuy" / "diagnostics"
+
+# Default time without progress before recovering when started from the menu, in seconds
+DEFAULT_STALL_TIMEOUT = 60.0
+# Time given to each recovery step to get the buying going again before the next one, in seconds
+# Shorter when the stall timeout itself is shorter
+RECOVERY_STEP_TIME = 10.0
+
+
+class StallAction(Enum):
+    # Bring the game window back to the foreground, e.g. after a popup or alt-tab
+    REFOCUS = 0
+    # Look up the game window again and rebuild the sample points if its geometry changed
+    RESOLVE_WINDOW = 1
+    # Give up, pause and save a diagnostic snapshot
+    PAUSE = 2
+
+
+# Notices when the buy loop stops making progress, e.g. a popup covers the web, the game lost focus or detection broke
+# Progress is any change in the detected nodes, a successful purchase always removes the bought node
+# Without progress for the timeout, the recovery actions are taken one at a time until progress is seen again
+class StallWatchdog:
+    def __init__(self, timeout: float = 0.0) -> None:
+        # 0 disables the watchdog
+        self.timeout = timeout
+        self.reset(0.0)
+
+    def is_enabled(self) -> bool:
+        return self.timeout > 0
+
+    # Starts waiting for progress from now on, also after pausing
+    def reset(self, now: float) -> None:
+        self._nodes = None
+        self._last_progress = now
+        self._next_action = 0
+        self._action_time = now
+
+    # Seconds since the detected nodes last changed
+    def get_stalled_time(self, now: float) -> float:
+        return now - self._last_progress
+
+    # Updates the watchdog from the detected nodes of a scan
+    # Returns the recovery action to take, None while progress is being made or the previous action is given time
+    def update(self, nodes: np.ndarray, now: float) -> StallAction:
+        if self._nodes is None or not np.array_equal(np.sort(nodes), self._nodes):
+            self._nodes = np.sort(nodes)
+            self._last_progress = now
+            self._next_action = 0
+            return None
+        if not self.is_enabled() or self._next_action >= len(StallAction):
+            return None
+        if self._next_action == 0:
+            if now - self._last_progress < self.timeout:
+                return None
+        elif now - self._action_time < min(RECOVERY_STEP_TIME, self.timeout):
+            return None
+        action = StallAction(self._next_action)
+        self._next_action += 1
+        self._action_time = now
+        return action
@@ -0,0 +1,26 @@
+from session_metrics import SessionMetrics
+
+
+# Goals that end the session once reached, 0 disables a goal
+# Checked against the session metrics whenever they change, so the session ends right at the purchase that reached the goal
+class StopConditions:
+    def __init__(self, nodes: int = 0, levels: int = 0, prestiges: int = 0, bloodpoints: int = 0) -> None:
+        self.nodes = nodes
+        self.levels = levels
+        self.prestiges = prestiges
+        self.bloodpoints = bloodpoints
+
+    def is_enabled(self) -> bool:
+        return self.nodes > 0 or self.levels > 0 or self.prestiges > 0 or self.bloodpoints > 0
+
+    # Returns a description of the first goal reached, None if none are
+    def get_reached(self, metrics: SessionMetrics) -> str:
+        if 0 < self.nodes <= metrics.nodes_bought:
+            return f"bought {metrics.nodes_bought} nodes"
+        if 0 < self.bloodpoints <= metrics.bloodpoints_spent:
+            return f"spent an estimated {metrics.bloodpoints_spent:,} bloodpoints"
+        if 0 < self.levels <= metrics.levels_completed:
+            return f"completed {metrics.levels_completed} levels"
+        if 0 < self.prestiges <= metrics.get_prestige_count():
+            return f"prestiges done: {metrics.get_prestige_count()}"
+        return None
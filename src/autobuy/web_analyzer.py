@@ -1,24 +1,19 @@
+import json
 import numpy as np
-import mss, mss.tools
-import win32gui
-from time import sleep
 from enum import IntEnum
-from PIL import Image, ImageDraw
+from PIL import Image
 from pathlib import Path
 import sys
 from os import getcwd
+from time import sleep, perf_counter
 from argparse import ArgumentParser
-
-
-class GameWindow:
-    handle : int
-    position : np.ndarray[int]
-    size : np.ndarray[int]
-    
-    def __init__(self, handle, position, size) -> None:
-        self.handle = handle
-        self.position = position
-        self.size = size
+from profile_store import ProfileStore, get_profile_key
+from frame_source import FrameSource, ScreenFrameSource, FileFrameSource
+from debug_overlay import DebugOverlay, ImageWriter
+from logger import log
+from session_recorder import SessionRecorder
+from window_source import GameWindow, WindowSource, Win32WindowSource, StaticWindowSource, GAME_WINDOW_TITLE, \
+    window_from_monitor, get_monitor_index, discover_window, focus_window
 
 # Reference resolution is used in sample point coordinates
 # The points are scaled from this resolution to whatever the game window size is
@@ -29,11 +24,14 @@ REF_ASPECT_CUTOFF = 16/9
 # Width of the square of pixels that is used to determine the node rarity
 # Scaled by resolution
 RARITY_CROP_SIZE = 30
+# Pixels sampled along each axis of the rarity crop, the crop is subsampled with an even stride
+# Keeps the cost of rarity sampling the same regardless of resolution, 0 samples every pixel
+RARITY_SAMPLE_COUNT = 16
 
 # Offset to the node edge where the color is sampled to determine if the node can be bought
 NODE_EDGE_OFFSET = np.array([-46,20], float)
-# Not implemented, offset to the white perk icon stripe
-#PERK_SAMPLE_OFFSET = np.array([24,-38], int)
+# Offset to the white perk icon stripe
+PERK_SAMPLE_OFFSET = np.array([24,-38], int)
 
 # Diameter of node rings
 NODE_SIZE = 106
@@ -44,8 +42,25 @@ NODE_COUNT = 30
 SAMPLE_COUNT_SMALL_PRESTIGE = 4
 SAMPLE_COUNT_LARGE_PRESTIGE = 3
 
-COLOR_PRESTIGE_SMALL = np.array([[1, 0, 210], [248, 248, 251], [0, 0, 205], [53, 47, 40]], int)
-COLOR_PRESTIGE_LARGE = np.array([[6, 6, 201], [250, 250, 250], [55, 55, 50]], int)
+COLOR_PRESTIGE_SMALL = np.array([[1, 0, 210], [248, 248, 251], [0, 0, 205], [53, 47, 40]], np.int16)
+COLOR_PRESTIGE_LARGE = np.array([[6, 6, 201], [250, 250, 250], [55, 55, 50]], np.int16)
+
+# Half of the length of the vertical pixel strip sampled at each node edge
+EDGE_SAMPLE_RADIUS = 2
+
+# Prestige icon detection thresholds relative to the node color tolerance
+PRESTIGE_SMALL_TOLERANCE_SCALE = 1.2
+PRESTIGE_LARGE_TOLERANCE_SCALE = 2.5
+PRESTIGE_LARGE_MIN_TOLERANCE = 20
+
+# Ring color calibration, frames sampled and the delay between them in seconds
+CALIBRATION_FRAME_COUNT = 5
+CALIBRATION_FRAME_INTERVAL = 0.1
+# Color groups formed from the edge samples: available rings, unavailable rings and background
+CALIBRATION_CLUSTER_COUNT = 3
+# Limits of the calibrated node tolerance
+CALIBRATION_MIN_TOLERANCE = 10
+CALIBRATION_MAX_TOLERANCE = 60
 
 
 class Rarity(IntEnum):
@@ -55,13 +70,43 @@ class Rarity(IntEnum):
             return self.value < other.value
         return NotImplemented
 
-# Unused, hue is used instead
+class Category(IntEnum):
+    PERK, ADDON, ITEM, OFFERING = range(4)
+    # No icon frame matched, e.g. an icon covered by the cursor or an unknown icon
+    UNKNOWN = 4
+
+# Offsets from the node center to the bright stripes of the icon frame of each category
+# Only valid for 2560x1440, scaled during runtime like the other offsets, all within the node edge offset
+# Only the perk stripe was measured from the game. The others are estimated from the shape of their frame outline and
+# not verified against captures, nodes of these categories may be detected as UNKNOWN
+CATEGORY_SAMPLE_OFFSETS = {
+    Category.PERK : [PERK_SAMPLE_OFFSET, [-24,-38]],
+    Category.ADDON : [[-36,30], [36,30]],
+    Category.ITEM : [[-33,-33], [33,-33]],
+    Category.OFFERING : [[0,-44], [0,44]],
+}
+# Categories whose stripes were measured, only these can be preferred or excluded
+MEASURED_CATEGORIES = [Category.PERK]
+# A sample is part of a stripe when even its darkest channel is at least this bright, stripes are white
+CATEGORY_MIN_BRIGHTNESS = 180
+# Share of the samples of a category that need to be on a stripe for the node to be detected as that category
+CATEGORY_MIN_MATCH = 0.5
+
+# The samples of all categories, sampled with a single index
+CATEGORY_OFFSETS = np.concatenate([np.array(offsets, float) for offsets in CATEGORY_SAMPLE_OFFSETS.values()])
+# Weight of each sample in the score of each category, the score is the share of the category's samples on a stripe
+CATEGORY_SAMPLE_COUNTS = np.array([len(offsets) for offsets in CATEGORY_SAMPLE_OFFSETS.values()])
+CATEGORY_WEIGHTS = np.repeat(np.eye(len(CATEGORY_SAMPLE_COUNTS)) / CATEGORY_SAMPLE_COUNTS[:,None], CATEGORY_SAMPLE_COUNTS, axis=0)
+
+# Mean color of the rarity crop of each rarity, not used for the classification, hue is used instead
 RARITIES_BGR = {
     Rarity.COMMON     : [39, 52,70],
     Rarity.UNCOMMON   : [43,157,194],
     Rarity.RARE       : [17, 66, 10],
     Rarity.VERY_RARE  : [98, 36, 81],
     Rarity.ULTRA_RARE : [52, 11, 150],
+    # Estimated, not measured from labelled captures
+    Rarity.EVENT      : [35,171,230],
     #[205, 157, 35]
 }
 
@@ -72,30 +117,196 @@ RARITIES_HUE = np.array([
     128,
     284,
     342,
-    # 42 Event is too similiar to uncommon yellow for the current detection method
+    # 42 Event is too similiar to uncommon yellow, these are told apart by the ring region instead
 ], int)
 
+# Mean color of the ring region, between the rarity crop and the node ring
+# Estimated, not measured from labelled captures: regular nodes are assumed dark there, event nodes lit up yellow
+RARITY_RING_BGR = [20, 20, 20]
+EVENT_RING_BGR = [60, 200, 250]
+# An uncommon node only counts as an event node when its ring region is this many times closer to EVENT_RING_BGR
+# than to RARITY_RING_BGR, anything in between stays uncommon
+EVENT_RING_MIN_RATIO = 2.0
+
+# Offsets from the node center to the pixels sampled for the ring region, only valid for 2560x1440
+# On the left and right side of the node, clear of the rarity crop and of the category stripes
+RARITY_RING_RADIUS = 38
+RARITY_RING_ANGLES = np.radians([0, 25, 155, 180, 205, 335])
+RARITY_RING_OFFSETS = RARITY_RING_RADIUS * np.stack([np.cos(RARITY_RING_ANGLES), np.sin(RARITY_RING_ANGLES)], axis=1)
+
+
+# Classifies node rarities by the hue of the mean color of their rarity crop, all nodes at once
+# The hue of the rarity crop gives the regular rarities, with the ring region means uncommon nodes with a lit up ring
+# region are event nodes
+class RarityClassifier:
+    _hues : np.ndarray
+    # Colors with a saturation at or below this have no reliable hue and are classified as common
+    _min_saturation : float
+    _ring_color : np.ndarray
+    _event_ring_color : np.ndarray
+    
+    def __init__(self, hues: np.ndarray = RARITIES_HUE, min_saturation: float = 0.0,
+                 ring_color: list = RARITY_RING_BGR, event_ring_color: list = EVENT_RING_BGR) -> None:
+        self._hues = np.asarray(hues, float)
+        self._min_saturation = min_saturation
+        self._ring_color = np.array(ring_color, float)
+        self._event_ring_color = np.array(event_ring_color, float)
+    
+    # Classifies mean BGR colors of the rarity crops and the ring regions, both of shape (n, 3)
+    # Event nodes are only told apart from uncommon nodes when the ring region means are given
+    # Returns rarities and confidences in range 0-1
+    def classify(self, means: np.ndarray, ring_means: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        hue, saturation = _hue_saturation(means[:,0], means[:,1], means[:,2])
+        # Angular distance to each rarity hue, ties go to the first rarity like argmin
+        dists = 180 - np.abs(np.abs(hue[:,None] - self._hues[None,:]) - 180)
+        order = np.argsort(dists, axis=1, kind="stable")
+        nearest = np.take_along_axis(dists, order[:,:2], axis=1)
+        confidences = (nearest[:,1] - nearest[:,0]) / np.maximum(nearest[:,1] + nearest[:,0], 1e-6)
+        # Colors without a hue can't be told apart
+        gray = saturation <= self._min_saturation
+        confidences[gray] = 0
+        rarities = order[:,0].astype(np.uint8)
+        rarities[gray] = Rarity.COMMON
+        if ring_means is None:
+            return rarities, confidences
+
+        ring_distance = np.linalg.norm(ring_means - self._ring_color, axis=1)
+        event_distance = np.linalg.norm(ring_means - self._event_ring_color, axis=1)
+        events = (rarities == Rarity.UNCOMMON) & (event_distance * EVENT_RING_MIN_RATIO < ring_distance)
+        rarities[events] = Rarity.EVENT
+        return rarities, confidences
+
+
+# Returns hue in degrees and HSV saturation for colors given as separate channels
+# Gray colors get a hue of 0 instead of dividing by zero
+def _hue_saturation(b: np.ndarray, g: np.ndarray, r: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    max_c = np.maximum(np.maximum(r, g), b)
+    min_c = np.minimum(np.minimum(r, g), b)
+    chroma = max_c - min_c
+    safe_chroma = np.where(chroma > 0, chroma, 1)
+    hue = np.where(max_c == r, (g - b) / safe_chroma,
+          np.where(max_c == g, 2.0 + (b - r) / safe_chroma,
+                               4.0 + (r - g) / safe_chroma))
+    hue = np.where(chroma > 0, hue * 60, 0)
+    hue[hue < 0] += 360
+    saturation = chroma / np.where(max_c > 0, max_c, 1)
+    return hue, saturation
+
 
 
 
 PRESTIGE_ONLY = np.array([-1],int)
 
+
+# Result of analyzing one frame of the web
+# Confidences are distance based, 1 is an exact color match and 0 is at the detection tolerance
+class WebScan:
+    # Buyable nodes sorted by rarity, most common first, PRESTIGE_ONLY if only the prestige node is buyable
+    nodes : np.ndarray
+    # Confidence of each entry in nodes being buyable
+    confidences : np.ndarray
+    # Rarity of each entry in nodes and the confidence of the rarity classification
+    rarities : np.ndarray
+    rarity_confidences : np.ndarray
+    # Color distance to the buyable ring color at the edge of each of the 30 nodes
+    edge_distances : np.ndarray
+    # Category of each entry in nodes, empty when categories are not detected
+    categories : np.ndarray
+
+    def __init__(self, nodes, confidences, rarities, rarity_confidences, edge_distances, categories = None) -> None:
+        self.nodes = nodes
+        self.confidences = confidences
+        self.rarities = rarities
+        self.rarity_confidences = rarity_confidences
+        self.edge_distances = edge_distances
+        self.categories = categories if categories is not None else np.zeros(0, np.uint8)
+
+    def is_prestige(self) -> bool:
+        return len(self.nodes) == 1 and self.nodes[0] == -1
+
+    # Returns the nodes that were detected with at least the given confidence
+    def get_confident_nodes(self, min_confidence: float) -> np.ndarray:
+        return self.nodes[self.confidences >= min_confidence]
+
+
+# Adjusts the node color tolerance from the distances observed during a session
+# Buyable and unbuyable node edges form two separate groups of distances, the tolerance is placed in the gap between them
+class ToleranceTracker:
+    # Scans between tolerance updates
+    _update_interval = 20
+    # Samples needed in both groups before adjusting
+    _min_samples = 30
+    # Limits relative to the initial tolerance
+    _min_scale = 0.5
+    _max_scale = 2.0
+
+    def __init__(self, tolerance: float) -> None:
+        self._initial_tolerance = tolerance
+        # Histogram of edge distances in 1 unit bins, the largest possible BGR distance is 442
+        self._histogram = np.zeros(443, np.float32)
+        self._scans = 0
+
+    def get_initial_tolerance(self) -> float:
+        return self._initial_tolerance
+
+    # Adds the edge distances of a scan, returns the tolerance to use from now on
+    def add(self, distances: np.ndarray, tolerance: float) -> float:
+        np.add.at(self._histogram, np.minimum(distances.astype(np.int32), len(self._histogram) - 1), 1)
+        self._scans += 1
+        if self._scans % self._update_interval != 0:
+            return tolerance
+        return self._estimate(tolerance)
+
+    def _estimate(self, tolerance: float) -> float:
+        split = int(np.ceil(tolerance))
+        accepted = self._histogram[:split]
+        rejected = self._histogram[split:]
+        if accepted.sum() < self._min_samples or rejected.sum() < self._min_samples:
+            return tolerance
+        # Upper end of the buyable group and lower end of the unbuyable group
+        accepted_high = np.searchsorted(np.cumsum(accepted), accepted.sum() * 0.95)
+        rejected_low = split + np.searchsorted(np.cumsum(rejected), rejected.sum() * 0.05)
+        # Older samples count less so the tolerance can follow changes in the picture
+        self._histogram *= 0.5
+        if rejected_low <= accepted_high:
+            return tolerance
+        estimate = (accepted_high + rejected_low) / 2
+        return float(np.clip(estimate, self._initial_tolerance * self._min_scale, self._initial_tolerance * self._max_scale))
+
+
+# Groups the colors of shape (n, 3) around the given starting centers with k-means
+# Returns the centers and the index of the center of each color
+def _cluster_colors(colors: np.ndarray, centers: np.ndarray, iterations: int = 10) -> tuple:
+    colors = colors.astype(np.float32)
+    centers = centers.astype(np.float32)
+    for _ in range(iterations):
+        sq_dists = np.square(colors[:,None,:] - centers[None,:,:]).sum(axis=2)
+        labels = sq_dists.argmin(axis=1)
+        for i in range(len(centers)):
+            members = colors[labels == i]
+            if len(members) > 0:
+                centers[i] = members.mean(axis=0)
+    return centers, labels
+
+
 class WebAnalyzer:
     # Default node edge color
-    _color_node_available = np.array([ 106, 139, 145 ], int)
+    _color_node_available = np.array([ 106, 139, 145 ], np.int16)
     _color_tolerance = 20
     
-    _sct : mss.base.MSSBase
+    _frame_source : FrameSource
     
     _bring_to_front = True
     
     _game_window: GameWindow
+    # Used to look up the game window, the win32 implementation is created on first use
+    _window_source: WindowSource = None
     
     _override_monitor_index = 0
     _custom_midpoint = None
     
     # Sampling points in game window space
-    _sample_points: np.ndarray[np.ndarray[int]]
+    _sample_points: np.ndarray[np.ndarray[int]] = None
     # Views into _sample_points:
     ## Coordinates of node edges
     _web_points = None
@@ -109,6 +320,20 @@ class WebAnalyzer:
     # Bounding box of _sample_points, in game window space
     # (startpos, endpos)
     _web_bbox: tuple = None
+    # _web_bbox as a python int tuple for capturing
+    _web_capture_bbox: tuple = None
+    
+    # Precomputed for each resolution, relative to _web_bbox:
+    ## Index arrays (ys, xs) of the pixel strips sampled at the node edges
+    _edge_strip_index: tuple = None
+    ## Node centers
+    _local_web_nodes: np.ndarray = None
+    ## Index arrays of the prestige samples
+    _small_prestige_index: tuple = None
+    _large_prestige_index: tuple = None
+    # Area of only the prestige samples and the index arrays relative to it, for checking the prestige node alone
+    _prestige_capture_bbox: tuple = None
+    _prestige_only_index: tuple = None
 
     # Scaling factor, determined by <game window width> / <ref window width>
     # Used to scale sample points
@@ -117,7 +342,53 @@ class WebAnalyzer:
     # Center position for current resolution, in game window space
     _center_pos : np.ndarray[int]
     
-    _test_image : Image.Image = None
+    
+    _rarity_sample_count = RARITY_SAMPLE_COUNT
+    # Offsets of the sampled pixels from the node center along each axis, depends on resolution
+    _rarity_sample_offsets : np.ndarray = None
+    # Category sample offsets from the node center scaled to the resolution, see CATEGORY_SAMPLE_OFFSETS
+    _category_offsets : np.ndarray = None
+    # Index arrays (ys, xs) of the category samples of each node, relative to _web_bbox
+    _category_index : tuple = None
+    # Icon categories are only detected when they are used for ordering the nodes
+    _detect_categories = False
+    # Event nodes are told apart from uncommon nodes by their ring region, off by default as the colors are estimates
+    _detect_events = False
+    
+    # Offsets (x, y) of all rarity samples from the node center, the subsampled crop followed by the ring region
+    _rarity_offsets : np.ndarray = None
+    # Shared by all instances, only depends on the rarity hues and ring colors
+    _rarity_classifier : RarityClassifier = None
+    
+    # Reference sample points and web center points per resolution, read from the data files
+    _layout_points : np.ndarray = None
+    _center_points : dict = None
+    # Resolution the custom midpoint was applied to
+    _custom_midpoint_resolution : tuple = None
+    
+    # Stores the calibration between runs, disabled if None
+    _profile_store : ProfileStore = None
+    # Ignore the stored profile and derive everything again
+    _recalibrate = False
+    # Profile of the current game window, written to the profile store on save_profile
+    profile : dict = None
+    _profile_key : str = None
+    # Set when the user has changed the detection parameters, these take priority over the profile
+    _color_overridden = False
+    _tolerance_overridden = False
+    
+    # Records the analyzed frames and their results when set
+    _recorder : SessionRecorder = None
+    # Info of a recorded session to set up from instead of the game window, see get_recording_info
+    _recorded_session : dict = None
+    
+    # Durations of the capture and the analysis of the latest scan_web in seconds, always measured in real time
+    last_capture_time = 0.0
+    last_analysis_time = 0.0
+    
+    # Adjusts _color_tolerance during the session when enabled
+    _adaptive_tolerance = False
+    _tolerance_tracker : ToleranceTracker = None
     
     class GameResolutionError(Exception):
         resolution: str = ""
@@ -125,39 +396,273 @@ class WebAnalyzer:
         pass
     
     def __del__(self):
-        self._sct.close()
+        self._frame_source.close()
         
     def __init__(self) -> None:
-        self._sct = mss.mss()
+        self._frame_source = ScreenFrameSource()
+        if WebAnalyzer._rarity_classifier is None:
+            WebAnalyzer._rarity_classifier = RarityClassifier()
     
     # Manual initialization is needed for monitor override
     def initialize(self):
-        print("\n---- Initializing ----")
+        log("\n---- Initializing ----")
+        
+        if self._recorded_session is not None:
+            self.load_recording_info(self._recorded_session)
+            log("Loaded recorded session")
+            return
         
         self._update_game_window_info()
+        if self._custom_midpoint is not None:
+            self._custom_midpoint_resolution = self.get_window_size()
         
-        try:
-            wd = sys._MEIPASS
-        except AttributeError:
-            wd = getcwd()
+        if self._profile_store is not None:
+            self._profile_key = self._get_profile_key()
+            if not self._recalibrate and self._load_profile(self._profile_store.get(self._profile_key)):
+                log("Loaded stored profile")
+                return
         
-        points_file = Path(wd) / "data" / "2560x1440.csv"
+        points_file = self._get_points_file()
         try:
             self._import_points(points_file, tuple(self._game_window.size))
         except WebAnalyzer.GameResolutionError as err:
-            print(f"Unsupported resolution: {err.resolution}, You can manually calibrate the web midpoint in the advanced settings", flush=True)
+            log(f"Unsupported resolution: {err.resolution}, You can manually calibrate the web midpoint in the advanced settings")
             raise err
         except IOError as err:
-            print(f"Failed to import sample points in file {points_file}", flush=True)
+            log(f"Failed to import sample points in file {points_file}")
             raise err
                     
         self._calculate_bounds()
         
+        if self._profile_store is not None:
+            # Learned timings are kept when recalibrating
+            previous = self._profile_store.get(self._profile_key) or {}
+            self.profile = {"timings": previous["timings"]} if "timings" in previous else {}
+            self._update_profile()
+            self.save_profile()
+        
+    def _get_points_file(self) -> Path:
+        try:
+            wd = sys._MEIPASS
+        except AttributeError:
+            wd = getcwd()
+        return Path(wd) / "data" / "2560x1440.csv"
+
+    # Cheap check for changes in the game window geometry, returns True if the window was moved or resized
+    # A moved window only updates the window position, a resized window rebuilds the sample points from the cached layout
+    def refresh_window_geometry(self) -> bool:
+        if self._game_window is None or self._game_window.handle is None:
+            return False
+        rect = self._window_source.get_window_rect(self._game_window.handle)
+        if rect is None:
+            return False
+        position = np.array([rect[0], rect[1]], int)
+        size = np.array([rect[2] - rect[0], rect[3] - rect[1]], int)
+        if np.array_equal(size, self._game_window.size):
+            if np.array_equal(position, self._game_window.position):
+                return False
+            self._game_window.position = position
+            log("Game window moved")
+        else:
+            self._import_points(self._get_points_file(), (size[0].item(), size[1].item()))
+            self._calculate_bounds()
+            self._game_window.position = position
+            self._game_window.size = size
+            log(f"Game window resized to {size[0]}x{size[1]}")
+        if self._profile_store is not None and self.profile is not None:
+            self._profile_key = self._get_profile_key()
+        return True
+
+    # Key of the profile of the current game window, see get_profile_key
+    def _get_profile_key(self) -> str:
+        return get_profile_key(self._get_monitor()[0], self._game_window.size)
+
+    # Returns the index of the monitor of the game window and the window position relative to that monitor
+    def _get_monitor(self) -> tuple[int, list]:
+        monitors = self._frame_source.get_monitors()
+        index = self._override_monitor_index
+        if index <= 0:
+            index = get_monitor_index(monitors, self._game_window)
+        index = min(index, len(monitors) - 1)
+        offset = self._game_window.position - [monitors[index]["left"], monitors[index]["top"]]
+        return index, offset.tolist()
+
+    # Brings the game window back to the foreground, returns False if it can't be focused
+    # Not done when bringing the window to the foreground is disabled or the window was set by monitor index
+    def focus_game_window(self) -> bool:
+        if not self._bring_to_front or self._game_window is None or self._game_window.handle is None:
+            return False
+        return focus_window(self._window_source, self._game_window.handle)
+
+    # Returns whether the game window is in the foreground, None if unknown
+    def is_game_window_focused(self) -> bool:
+        if self._game_window is None or self._game_window.handle is None:
+            return None
+        return self._window_source.is_foreground(self._game_window.handle)
+
+    # Looks the game window up again by its title, e.g. after the game was restarted and the old window handle is gone
+    # Returns True if the window or its geometry changed, see refresh_window_geometry
+    def resolve_game_window(self) -> bool:
+        if self._game_window is None or self._game_window.handle is None:
+            return False
+        window = self._window_source.find_window(GAME_WINDOW_TITLE)
+        if window is None:
+            return False
+        changed = window.handle != self._game_window.handle
+        if changed:
+            log("Game window handle changed")
+            self._game_window.handle = window.handle
+        return self.refresh_window_geometry() or changed
+
+    # Applies a stored profile, returns False if the profile can't be used
+    def _load_profile(self, profile: dict) -> bool:
+        if not profile or "sample_points" not in profile:
+            return False
+        center_pos = np.array(profile["midpoint"], float)
+        # A different custom midpoint invalidates the stored geometry
+        if self._custom_midpoint is not None and not np.array_equal(self._custom_midpoint, center_pos):
+            return False
+        self._sample_points = np.array(profile["sample_points"], np.int32)
+        self._center_pos = center_pos
+        self._scaling = float(profile["scaling"])
+        self._create_views()
+        self._calculate_bounds()
+        if "ring_color" in profile and not self._color_overridden:
+            rgb = profile["ring_color"]
+            self._color_node_available = np.array([rgb[2],rgb[1],rgb[0]], np.int16)
+        if "node_tolerance" in profile and not self._tolerance_overridden:
+            self._color_tolerance = profile["node_tolerance"]
+        self.profile = profile
+        return True
+
+    # Copies the current calibration and the window offset into the profile
+    def _update_profile(self) -> None:
+        self.profile.update(self.get_calibration())
+        self.profile["window_offset"] = self._get_monitor()[1]
+
+    # Returns the current calibration in the profile format, see ProfileStore
+    # The tolerance is the one the session started with, otherwise the adapted tolerance would be the starting point
+    # of the next session and could drift further from the configured one with every session
+    def get_calibration(self) -> dict:
+        tolerance = self._color_tolerance
+        if self._tolerance_tracker is not None:
+            tolerance = self._tolerance_tracker.get_initial_tolerance()
+        return {
+            "midpoint": self._center_pos.tolist(),
+            "scaling": self._scaling,
+            "sample_points": self._sample_points.tolist(),
+            "ring_color": self._color_node_available[::-1].tolist(),
+            "node_tolerance": int(tolerance),
+        }
+
+    # Sets up the window and the calibration from recorded session info, see get_recording_info
+    def load_recording_info(self, info: dict) -> None:
+        self._game_window = GameWindow(None, np.array(info["window_position"], int), np.array(info["window_size"], int))
+        if not self._load_profile(dict(info["calibration"])):
+            raise ValueError("Recorded session has no calibration")
+        self._detect_events = info.get("detect_events", False)
+
+    # Returns what is needed to analyze recorded frames later, see SessionRecorder
+    def get_recording_info(self) -> dict:
+        position = self._game_window.position
+        bbox = self._web_capture_bbox
+        return {
+            "window_position": position.tolist(),
+            "window_size": self._game_window.size.tolist(),
+            "capture_bbox": [int(position[0] + bbox[0]), int(position[1] + bbox[1]),
+                             int(position[0] + bbox[2]), int(position[1] + bbox[3])],
+            "calibration": self.get_calibration(),
+            "detect_events": self._detect_events,
+        }
+
+    # Writes the current profile to the profile store
+    def save_profile(self) -> None:
+        if self._profile_store is None or self.profile is None:
+            return
+        self._update_profile()
+        self._profile_store.put(self._profile_key, self.profile)
+        try:
+            self._profile_store.save()
+        except OSError:
+            log("Could not save the profile")
+
     def set_color_available(self, rgb : tuple) -> None:
         self._color_node_available = np.array([rgb[2],rgb[1],rgb[0]], np.int16)
+        self._color_overridden = True
 
     def set_node_tolerance(self, node_tolerance: int) -> None:
         self._color_tolerance = node_tolerance
+        self._tolerance_overridden = True
+
+    def set_adaptive_tolerance(self, adaptive_tolerance: bool) -> None:
+        self._adaptive_tolerance = adaptive_tolerance
+        self._tolerance_tracker = None
+
+    # Finds the color of available node rings and a fitting tolerance from the current web
+    # The edge samples of all nodes are collected over a few frames and grouped by color,
+    # the group closest to the current ring color is taken as the available rings
+    # Needs a web with some available nodes on the screen, returns False if none could be told apart
+    def calibrate_ring_color(self, frame_count: int = CALIBRATION_FRAME_COUNT,
+                             frame_interval: float = CALIBRATION_FRAME_INTERVAL, sleep_fn = sleep) -> bool:
+        samples = []
+        for i in range(frame_count):
+            if i > 0:
+                sleep_fn(frame_interval)
+            self._frame_source.next_frame()
+            strips = self.capture(self._web_capture_bbox)[self._edge_strip_index].astype(np.int16)
+            # The pixel most like the current ring color represents the ring in each strip
+            sq_dists = np.square(strips - self._color_node_available, dtype=np.int32).sum(axis=2)
+            samples.append(strips[np.arange(len(strips)), sq_dists.argmin(axis=1)])
+        colors = np.concatenate(samples).astype(np.float32)
+
+        # Start from the current ring color and the colors furthest away from the already chosen starting points
+        centers = [self._color_node_available.astype(np.float32)]
+        while len(centers) < CALIBRATION_CLUSTER_COUNT:
+            sq_dists = np.min([np.square(colors - c).sum(axis=1) for c in centers], axis=0)
+            centers.append(colors[sq_dists.argmax()])
+        centers, labels = _cluster_colors(colors, np.array(centers))
+
+        # Groups left without colors keep their starting point and are skipped
+        sq_dists = np.square(centers - self._color_node_available).sum(axis=1)
+        sq_dists[np.bincount(labels, minlength=len(centers)) == 0] = np.inf
+        ring = np.argmin(sq_dists)
+        members = labels == ring
+        # A single node could be a highlight, require the group in at least two nodes
+        if np.count_nonzero(members) < 2 * frame_count or members.all():
+            log("Ring color calibration failed, no available nodes could be told apart")
+            return False
+
+        # Place the tolerance between the spread of the ring colors and the closest other color
+        dists = np.sqrt(np.square(colors - centers[ring]).sum(axis=1))
+        inside = np.percentile(dists[members], 95)
+        outside = np.percentile(dists[~members], 5)
+        tolerance = (inside + outside) / 2 if outside > inside else inside * 1.5
+        tolerance = int(np.clip(round(tolerance), CALIBRATION_MIN_TOLERANCE, CALIBRATION_MAX_TOLERANCE))
+
+        self._color_node_available = np.round(centers[ring]).astype(np.int16)
+        self._color_tolerance = tolerance
+        self._tolerance_tracker = None
+        rgb = self._color_node_available[::-1].tolist()
+        log(f"Calibrated ring color [R: {rgb[0]}, G: {rgb[1]}, B: {rgb[2]}], threshold {tolerance}")
+        self.save_profile()
+        return True
+
+    def set_category_detection(self, detect_categories: bool) -> None:
+        self._detect_categories = detect_categories
+
+    def set_event_detection(self, detect_events: bool) -> None:
+        self._detect_events = detect_events
+
+    def set_rarity_sample_count(self, sample_count: int) -> None:
+        self._rarity_sample_count = sample_count
+        if self._sample_points is not None:
+            self._create_views()
+
+    def set_profile_store(self, profile_store: ProfileStore) -> None:
+        self._profile_store = profile_store
+
+    def set_recalibrate(self, recalibrate: bool) -> None:
+        self._recalibrate = recalibrate
 
     def set_override_monitor_index(self, index: int) -> None:
         self._override_monitor_index = index
@@ -168,8 +673,23 @@ class WebAnalyzer:
     def set_bring_to_front(self, bring_to_front : bool):
         self._bring_to_front = bring_to_front
     
+    # Analyzes the image instead of the screen
     def set_test_image(self, image: Image.Image):
-        self._test_image = image
+        self.set_frame_source(FileFrameSource([image]))
+        self._window_source = StaticWindowSource([(None, GAME_WINDOW_TITLE, (0, 0, image.width, image.height))])
+
+    def set_frame_source(self, frame_source: FrameSource):
+        self._frame_source.close()
+        self._frame_source = frame_source
+
+    def set_window_source(self, window_source: WindowSource):
+        self._window_source = window_source
+
+    def set_session_recorder(self, recorder: SessionRecorder):
+        self._recorder = recorder
+
+    def set_recorded_session(self, info: dict):
+        self._recorded_session = info
 
 
               
@@ -177,14 +697,36 @@ class WebAnalyzer:
     # bbox is start and end positions. Game window position offset is added here
     # Returns in BGR format 
     def capture(self, bbox: tuple[int, int, int, int]) -> np.ndarray:
-        absolute_bbox = (self._game_window.position[0].item() + bbox[0],
-                         self._game_window.position[1].item() + bbox[1],
-                        self._game_window.position[0].item() + bbox[2],
-                        self._game_window.position[1].item() + bbox[3])
-        img = np.array(self._sct.grab(absolute_bbox)) # Capture
-        img = img[:,:,:3] # Discard alpha
-        return img
+        return self._frame_source.grab(self._get_screen_bbox(bbox))
+
+    # Captures the area of a cheap check, recorded so a replay can answer the check from the same pixels
+    def _capture_check(self, bbox: tuple[int, int, int, int]) -> np.ndarray:
+        absolute_bbox = self._get_screen_bbox(bbox)
+        image = self._frame_source.grab(absolute_bbox)
+        if self._recorder is not None:
+            self._recorder.record_grab(absolute_bbox, image)
+        return image
+
+    def _get_screen_bbox(self, bbox: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+        return (self._game_window.position[0].item() + bbox[0],
+                self._game_window.position[1].item() + bbox[1],
+                self._game_window.position[0].item() + bbox[2],
+                self._game_window.position[1].item() + bbox[3])
+
+    # Cheap check for a single node, only the edge strip of the node is captured
+    def is_node_buyable(self, node: int, min_confidence: float = 0.0) -> bool:
+        radius = EDGE_SAMPLE_RADIUS
+        pos = self._web_points[node]
+        capture_bbox = (pos[0].item(), pos[1].item() - radius, pos[0].item() + 1, pos[1].item() + radius)
+        image = self._capture_check(capture_bbox)
+        strip = image[np.arange(2 * radius)[None,:], np.zeros((1, 1), np.int32)]
+        distance = self._get_strip_distances(strip, self._color_node_available)[0]
+        return self._get_confidence(distance, self._color_tolerance) >= min_confidence and distance < self._color_tolerance
 
+    # Cheap check for the prestige node, only the area of the prestige samples is captured
+    def is_prestige_buyable(self) -> bool:
+        image = self._capture_check(self._prestige_capture_bbox)
+        return self._get_prestige_confidence(image, *self._prestige_only_index) > 0
 
     # Returns the node position in absolute coordinates
     def get_node_position(self, node: int) -> tuple:
@@ -192,108 +734,116 @@ class WebAnalyzer:
             return self._center_pos + self._game_window.position
         return self._web_nodes[node] + self._game_window.position
     
-    # Checks a horizontal line of around each of the positions
-    # Returns the indices that had pixels close to the given color
-    def _get_positions_approx_color(self, image, positions, color, tolerance, sampling_radius):
-        start1 = positions[:,1] - sampling_radius
-        end1 = positions[:,1] + sampling_radius
-        
-        # Extract lines around each of the positions
-        rim_imgs = np.zeros((len(start1),2 * sampling_radius, 3),int)
-        for i in range(len(start1)):
-            s1 = start1[i]
-            e1 = end1[i]
-            rim_imgs[i] = image[s1:e1,positions[i,0],:]
-            
-        diffs = rim_imgs - color
-        dists = np.linalg.norm(diffs, axis=(2))
-        min_dists = np.min(np.abs(dists),axis=1)
-        
-        return (min_dists < tolerance).nonzero()[0]
+    # Returns the smallest color distance in each of the pixel strips of shape (n, length, 3)
+    @staticmethod
+    def _get_strip_distances(strips, color) -> np.ndarray:
+        diffs = strips.astype(np.int16) - color
+        sq_dists = np.square(diffs, dtype=np.int32).sum(axis=2, dtype=np.int32)
+        return np.sqrt(np.min(sq_dists, axis=1))
+
+    # Maps a distance to a confidence, 1 at an exact match and 0 at the tolerance
+    @staticmethod
+    def _get_confidence(distance, tolerance):
+        return np.clip(1.0 - distance / max(tolerance, 1e-6), 0.0, 1.0)
     
     # Takes a screen capture, samples the node positions, sorts by rarity, most common first
     # 0-29 are normal nodes, -1 is prestige node
     # Returns None if no nodes detected
     def find_buyable_nodes(self) -> np.ndarray:
-        bbox = self._web_bbox
-           
-        # Convert to python int tuple for MSS
-        capture_bbox = (bbox[0][0].item(), bbox[0][1].item(), bbox[1][0].item(), bbox[1][1].item())
-        
-        if not self._test_image:
-            image = self.capture(capture_bbox)
-        else:
-            cropped = self._test_image.crop(capture_bbox)
-            image = np.asarray(cropped)[:,:,::-1] # RGB to BGR
-        
-        edge_positions = self._web_points - bbox[0]
-        # Get indices of the positions that are close to the color of a buyable node
-        buyable = self._get_positions_approx_color(image, edge_positions, self._color_node_available, self._color_tolerance, 2)
-        # Extract node images
-        node_positions = self._web_nodes[buyable] - bbox[0]
-        
-        start1 = node_positions[:,1] - self._rarity_sample_width
-        end1 = node_positions[:,1] + self._rarity_sample_width
+        return self.scan_web().nodes
 
-        start2 = node_positions[:,0] - self._rarity_sample_width
-        end2 = node_positions[:,0] + self._rarity_sample_width
-        
-        node_images = np.zeros((len(start1),2*self._rarity_sample_width,2*self._rarity_sample_width,3),int)
-        for i in range(len(start1)):
-            s1 = start1[i]
-            e1 = end1[i]
-            s2 = start2[i]
-            e2 = end2[i]
-            
-            node_images[i] = image[s1:e1,s2:e2,:]
-            
-        # Calculate mean colors
-        means = np.mean(node_images,
-                        axis=(1,2))
-        
-        # Calculate hues
-        r = means[:,2]
-        g = means[:,1]
-        b = means[:,0]
-        max_c = np.max([r,g,b],axis=0)
-        min_c = np.min([r,g,b],axis=0)
-                
-        hue = np.array([(g-b)/(max_c-min_c),
-            2.0 + ((b-r) / (max_c-min_c)),
-            4.0 + ((r-g) / (max_c-min_c))])
-        indices = np.argmax([r,g,b],axis=0)
-        hue = np.choose(indices,hue)
-        hue *= 60
-        hue[hue < 0] += 360
-        
-        rarities = np.array([self._find_closest_rarity(a) for a in hue],int)
+    # Like find_buyable_nodes, but returns the confidences along with the nodes
+    def scan_web(self) -> WebScan:
+        return self.analyze_capture(self.capture_web())
+
+    # scan_web in two steps, so capturing and analyzing can run as separate tasks
+    # Captures the web bounding box for analyze_capture
+    def capture_web(self) -> np.ndarray:
+        start = perf_counter()
+        self._frame_source.next_frame()
+        image = self.capture(self._web_capture_bbox)
+        self.last_capture_time = perf_counter() - start
+        return image
+
+    def analyze_capture(self, image: np.ndarray) -> WebScan:
+        start = perf_counter()
+        scan = self.scan_image(image)
+        self.last_analysis_time = perf_counter() - start
+        if self._recorder is not None:
+            self._recorder.record_frame(image)
+            self._recorder.record_scan(scan.nodes, scan.confidences)
+        return scan
+
+    # Analyzes a capture of the web bounding box, see find_buyable_nodes
+    def analyze_image(self, image: np.ndarray) -> np.ndarray:
+        return self.scan_image(image).nodes
+
+    def scan_image(self, image: np.ndarray) -> WebScan:
+        # Get the color distances at the node edges, close to the color of a buyable node means the node can be bought
+        distances = self._get_strip_distances(image[self._edge_strip_index], self._color_node_available)
+        tolerance = self._color_tolerance
+        if self._adaptive_tolerance:
+            # Created on the first scan so it starts from the tolerance of the loaded profile
+            if self._tolerance_tracker is None:
+                self._tolerance_tracker = ToleranceTracker(self._color_tolerance)
+            self._color_tolerance = self._tolerance_tracker.add(distances, self._color_tolerance)
+        buyable = (distances < tolerance).nonzero()[0]
         # Sort by rarity and return            
         if len(buyable) > 0: 
-            p = rarities.argsort()
-            #rarities = np.array([*Rarity],object)[rarities[p]]
-            return buyable[p]
+            means, ring_means = self._get_rarity_means(image, self._local_web_nodes[buyable])
+            rarities, rarity_confidences = self._rarity_classifier.classify(means, ring_means if self._detect_events else None)
+            p = rarities.argsort(kind="stable")
+            confidences = self._get_confidence(distances[buyable[p]], tolerance)
+            categories = self._get_categories(image, buyable[p]) if self._detect_categories else None
+            return WebScan(buyable[p], confidences, rarities[p], rarity_confidences[p], distances, categories)
         
+        empty = np.zeros(0, np.float64)
+        # Check for small prestige node
+        confidence = self._get_prestige_confidence(image)
+        if confidence > 0:
+            return WebScan(PRESTIGE_ONLY, np.array([confidence]), np.zeros(0, np.uint8), empty, distances)
+        return WebScan(np.zeros(0, int), empty, np.zeros(0, np.uint8), empty, distances)
+
+    # Returns the confidence of the prestige node being buyable, 0 if it isn't detected
+    # The sample indices default to the ones relative to the web bounding box
+    def _get_prestige_confidence(self, image: np.ndarray, small_index: tuple = None, large_index: tuple = None) -> float:
+        if small_index is None:
+            small_index, large_index = self._small_prestige_index, self._large_prestige_index
         # Check for small prestige node
-        sample_positions = self._small_prestige_points - bbox[0]
-        samples = image[sample_positions[:,1],sample_positions[:,0]]
-        diffs = np.subtract(samples, COLOR_PRESTIGE_SMALL)
-        dists = np.linalg.norm(diffs, axis=1)
-        if np.max(dists, axis=0) < self._color_tolerance * 1.2:
-            return PRESTIGE_ONLY
+        samples = image[small_index]
+        diffs = samples.astype(np.int16) - COLOR_PRESTIGE_SMALL
+        sq_dists = np.square(diffs, dtype=np.int32).sum(axis=1, dtype=np.int32)
+        tolerance = self._color_tolerance * PRESTIGE_SMALL_TOLERANCE_SCALE
+        if np.max(sq_dists, axis=0) < tolerance ** 2:
+            return float(self._get_confidence(np.sqrt(np.max(sq_dists)), tolerance))
 
         # Check for large prestige node
-        sample_positions = self._large_prestige_points - bbox[0]
-        samples = image[sample_positions[:,1],sample_positions[:,0]]
-        diffs = np.subtract(samples, COLOR_PRESTIGE_LARGE)
-        dists = np.linalg.norm(diffs, axis=0)
-        if np.max(dists, axis=0) < self._color_tolerance + max(self._color_tolerance * 1.5, 20):
-            return PRESTIGE_ONLY
+        samples = image[large_index]
+        diffs = samples.astype(np.int16) - COLOR_PRESTIGE_LARGE
+        sq_dists = np.square(diffs, dtype=np.int32).sum(axis=0, dtype=np.int32)
+        tolerance = max(self._color_tolerance * PRESTIGE_LARGE_TOLERANCE_SCALE, self._color_tolerance + PRESTIGE_LARGE_MIN_TOLERANCE)
+        if np.max(sq_dists, axis=0) < tolerance ** 2:
+            return float(self._get_confidence(np.sqrt(np.max(sq_dists)), tolerance))
+        return 0.0
         
-        return []
-        
-    # Find minimum angle difference in hue    
-    def _find_closest_rarity(self, hue):
-        return np.argmin([180 - abs(abs(hue - b) - 180) for b in RARITIES_HUE])
+    # Returns the icon category of each of the nodes from the samples on the icon frame stripes
+    def _get_categories(self, image: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        samples = image[self._category_index[0][nodes], self._category_index[1][nodes]]
+        on_stripe = samples.min(axis=2) >= CATEGORY_MIN_BRIGHTNESS
+        scores = on_stripe @ CATEGORY_WEIGHTS
+        categories = scores.argmax(axis=1).astype(np.uint8)
+        categories[scores.max(axis=1) < CATEGORY_MIN_MATCH] = Category.UNKNOWN
+        return categories
+
+    # Returns the mean BGR colors of the rarity crop and of the ring region around each of the positions
+    # All samples are gathered with a single flat index, the rows of a capture are contiguous so the image isn't copied
+    def _get_rarity_means(self, image: np.ndarray, positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        points = positions[:,None,:] + self._rarity_offsets
+        samples = image.reshape(-1, 3)[points[:,:,1] * image.shape[1] + points[:,:,0]]
+        crop_count = len(self._rarity_sample_offsets) ** 2
+        # Integer sums of both regions at once, much faster than averaging uint8 pixels as floats
+        sums = np.add.reduceat(samples, [0, crop_count], axis=1, dtype=np.uint32)
+        return sums[:,0] / crop_count, sums[:,1] / len(RARITY_RING_OFFSETS)
         
 
     # Reads the resolution file and stores the center points found
@@ -311,117 +861,69 @@ class WebAnalyzer:
         return center_points
 
     # Draws and saves an image file for debugging the currently loaded sample points
-    def debug_draw_points(self, groups_to_show: list) -> Image.Image:
-        # Add padding for drawing
-        bbox = (self._web_bbox[0] - int(NODE_SIZE * 0.5 * self._scaling),
-                self._web_bbox[1] + int(NODE_SIZE * 0.5 * self._scaling))
-        draw_origin = bbox[0]
-        bbox_size = bbox[1] - bbox[0]
-
-        # Size of the area that is cropped from the original capture
-        zoom_crop_size: int = int(bbox_size[0] / 50)
-        zoom_crop_radius: int = int(zoom_crop_size / 2)
-        
-        # Size the cropped area is upscaled to and displayed in
-        zoom_paste_size: int = zoom_crop_size * 3
-        zoom_paste_radius: int = int(zoom_crop_size * 3 * 0.5)
-        
-        node_size = int(NODE_SIZE * self._scaling)
-        node_radius = int(NODE_SIZE * self._scaling * 0.5)
-        # Create a circle mask
-        mask = Image.new('1', (zoom_paste_size,zoom_paste_size),0)
-        mask_draw = ImageDraw.Draw(mask)
-        mask_draw.ellipse((0,0,zoom_paste_size,zoom_paste_size),1)
-        
-        
-        # Color for the single pixel representing the sample point
-        sample_pos_color = (255,0,0)
-
-        
-        # Convert to python int tuple for MSS
-        capture_bbox = (bbox[0][0].item(),
-                        bbox[0][1].item(),
-                        bbox[1][0].item(),
-                        bbox[1][1].item())
-        
-        if not self._test_image:
-            image = self.capture(capture_bbox)
-            # BGR to RGB
-            image = image[:,:,::-1]
-        else:
-            cropped = self._test_image.crop(capture_bbox)
-            image = np.asarray(cropped)
+    # Bounding box of the debug images in game window space, the web with room for drawing around the outermost nodes
+    def _get_debug_bbox(self) -> tuple:
+        padding = int(NODE_SIZE * 0.5 * self._scaling)
+        return (self._web_bbox[0][0].item() - padding, self._web_bbox[0][1].item() - padding,
+                self._web_bbox[1][0].item() + padding, self._web_bbox[1][1].item() + padding)
 
-        im = Image.fromarray(image)
-        
-        pts_groups = {
+    def _create_debug_overlay(self) -> DebugOverlay:
+        bbox = self._get_debug_bbox()
+        points = {
             "edges" : self._web_points,
             "nodes" : self._web_nodes,
             "prestige_small" : self._small_prestige_points,
             "prestige_large" : self._large_prestige_points,
         }
-        
-        # Color of the mask outline
-        group_colors = {
-            "edges" : (128,128,128),
-            "nodes": (255,0,0,90),
-            "prestige_small" : (0,255,0),
-            "prestige_large" : (0,255,255),
-        }
-        
-        if groups_to_show.count("edges") > 0:
-            buyable = self.find_buyable_nodes()
-
-        draw = ImageDraw.Draw(im, "RGBA")
-        for pt_group in groups_to_show:
-            pts = pts_groups[pt_group]
-            for i in range(pts.shape[0]):
-                pos = pts[i] - draw_origin #+ [39,1]
-                if pt_group == "nodes":
-                    node_draw_pos = (pos[0] - node_radius, pos[1] - node_radius)
-                    draw.ellipse((node_draw_pos, (node_draw_pos[0] + node_size, node_draw_pos[1] + node_size)), fill=group_colors[pt_group])
-                else:
-                    # Draw sample point
-                    pixel_col = sample_pos_color
-                    outline_col = group_colors[pt_group]
-                    
-                    if pt_group == "edges" and i in buyable:
-                        pixel_col = (0,255,0)
-                        outline_col = (0,255,0)
-                        
-                    im.putpixel(pos, pixel_col)
-                    
-                    # Crop out the area around the sample point
-                    crop_bbox = (pos[0] - zoom_crop_radius, pos[1] - zoom_crop_radius, pos[0] + zoom_crop_radius, pos[1] + zoom_crop_radius)
-                    zoomed = im.resize((zoom_paste_size, zoom_paste_size), Image.Resampling.NEAREST, crop_bbox)
-                    
-                    # Paste onto the original capture and draw an outline
-                    paste_pos = (pos[0] - zoom_paste_radius, pos[1] - zoom_paste_radius)
-                    im.paste(zoomed, paste_pos, mask)
-                    draw.ellipse((paste_pos, (paste_pos[0] + zoom_paste_size, paste_pos[1] + zoom_paste_size)), outline=outline_col, width=2)
+        # Magnified area is relative to the size of the web
+        return DebugOverlay(np.array(bbox[:2]), points, int(NODE_SIZE * self._scaling), int((bbox[2] - bbox[0]) / 50))
+
+    # Captures the debug area and analyzes the web from the same capture
+    # Returns the capture and the scan result
+    def capture_debug_frame(self) -> tuple[np.ndarray, WebScan]:
+        bbox = self._get_debug_bbox()
+        self._frame_source.next_frame()
+        image = self.capture(bbox)
+        # The web is inside the debug area, analyzed without copying
+        web = self._web_capture_bbox
+        scan = self.scan_image(image[web[1] - bbox[1]:web[3] - bbox[1], web[0] - bbox[0]:web[2] - bbox[0]])
+        return image, scan
 
-        return im
+    # Draws the sample point groups on top of a capture, the edges of buyable nodes are highlighted
+    # A frame from capture_debug_frame can be given to draw several images of the same capture
+    def debug_draw_points(self, groups_to_show: list, frame: tuple = None) -> Image.Image:
+        image, scan = frame if frame is not None else self.capture_debug_frame()
+        return self._create_debug_overlay().render(image, groups_to_show, scan.nodes)
 
 
 
+    # Reads the reference sample points and the web center points for different resolutions
+    # Cached so the sample points can be rebuilt when the game window is resized
+    def _load_layout(self, filename: str) -> None:
+        if self._layout_points is not None:
+            return
+        layout_points = np.loadtxt(filename, dtype=int, delimiter=",", comments="#")
+        try:
+            wd = sys._MEIPASS
+        except AttributeError:
+            wd = getcwd()
+        resolution_file =  Path(wd) / "data" / "resolutions.txt"   
+        try:
+            self._center_points = self._parse_resolution_info(resolution_file)
+        except Exception as err:
+            log(f"Failed to read resolution file {resolution_file}")
+            raise err
+        self._layout_points = layout_points
+
     # Imports points from a file, transforming them to the correct scaling according to the _center_points table
     def _import_points(self, filename: str, resolution: tuple[int,int] = None) -> np.ndarray:
-        self._sample_points = np.loadtxt(filename, dtype=int, delimiter=",", comments="#")
+        self._load_layout(filename)
+        self._sample_points = self._layout_points
+        center_points = self._center_points
         # Transform points if needed
         if True:#resolution != REF_RESOLUTION:
-            # Read web center points for different resolutions from a file
-            try:
-                wd = sys._MEIPASS
-            except AttributeError:
-                wd = getcwd()
-            resolution_file =  Path(wd) / "data" / "resolutions.txt"   
-            try:
-                center_points = self._parse_resolution_info(resolution_file)
-            except Exception as err:
-                print(f"Failed to read resolution file {resolution_file}", flush=True)
-                raise err
-            
-            has_custom_midpoint = self._custom_midpoint is not None
+            # The custom midpoint is only valid for the resolution it was given for
+            has_custom_midpoint = self._custom_midpoint is not None and self._custom_midpoint_resolution == resolution
             ref_center = center_points[REF_RESOLUTION]
             if not resolution in center_points and not has_custom_midpoint:
                 err = WebAnalyzer.GameResolutionError("Unsupported resolution")
@@ -433,7 +935,7 @@ class WebAnalyzer:
             # Center pos is stored for prestiging
             if has_custom_midpoint:
                 self._center_pos = self._custom_midpoint
-                print(f"Using custom midpoint {self._custom_midpoint}", flush=True)
+                log(f"Using custom midpoint {self._custom_midpoint}")
             else:
                 self._center_pos = center_points[resolution]
             
@@ -449,13 +951,27 @@ class WebAnalyzer:
                 
             local_pts *= self._scaling
             # Add the web offset back
-            self._sample_points = np.round(local_pts + self._center_pos).astype(int)
+            self._sample_points = np.round(local_pts + self._center_pos).astype(np.int32)
+
+        self._create_views()
 
+    def _create_views(self):
         # Precalculate scaling dependent values  
         self._rarity_sample_width = int(RARITY_CROP_SIZE * self._scaling)
+        crop_size = 2 * self._rarity_sample_width
+        stride = 1
+        if self._rarity_sample_count > 0:
+            stride = max(-(-crop_size // self._rarity_sample_count), 1)
+        # Centered in the crop so the subsample covers it evenly
+        first = -self._rarity_sample_width + (crop_size - 1 - (crop_size - 1) // stride * stride) // 2
+        self._rarity_sample_offsets = np.arange(first, self._rarity_sample_width, stride, dtype=np.int32)
+        self._category_offsets = np.round(CATEGORY_OFFSETS * self._scaling).astype(np.int32)
+        ys, xs = np.meshgrid(self._rarity_sample_offsets, self._rarity_sample_offsets, indexing="ij")
+        self._rarity_offsets = np.concatenate([np.stack([xs.ravel(), ys.ravel()], axis=1),
+                                               np.round(RARITY_RING_OFFSETS * self._scaling).astype(np.int32)])
         # Create array views for iterating
         self._web_nodes = self._sample_points[:NODE_COUNT]
-        self._web_points = self._sample_points[:NODE_COUNT] + np.round(NODE_EDGE_OFFSET * self._scaling).astype(int)
+        self._web_points = self._sample_points[:NODE_COUNT] + np.round(NODE_EDGE_OFFSET * self._scaling).astype(np.int32)
         self._small_prestige_points = self._sample_points[NODE_COUNT:
             NODE_COUNT + SAMPLE_COUNT_SMALL_PRESTIGE]
         self._large_prestige_points = self._sample_points[NODE_COUNT + SAMPLE_COUNT_SMALL_PRESTIGE:
@@ -467,80 +983,120 @@ class WebAnalyzer:
         min, max = np.min(self._sample_points, axis=0), np.max(self._sample_points, axis=0)
         min -= padding
         max += padding
-        self._web_bbox = (min.astype(int), max.astype(int) + 1)
+        self._web_bbox = (min, max + 1)
+        self._web_capture_bbox = (min[0].item(), min[1].item(), max[0].item() + 1, max[1].item() + 1)
+        
+        # Precompute the sampling positions relative to the captured area, so each scan only indexes the capture
+        edge_points = self._web_points - min
+        ys = edge_points[:,1,None] + np.arange(-EDGE_SAMPLE_RADIUS, EDGE_SAMPLE_RADIUS, dtype=np.int32)
+        self._edge_strip_index = (ys, edge_points[:,0,None])
+        self._local_web_nodes = self._web_nodes - min
+        category_points = self._local_web_nodes[:,None,:] + self._category_offsets
+        self._category_index = (category_points[:,:,1], category_points[:,:,0])
+        small_prestige = self._small_prestige_points - min
+        self._small_prestige_index = (small_prestige[:,1], small_prestige[:,0])
+        large_prestige = self._large_prestige_points - min
+        self._large_prestige_index = (large_prestige[:,1], large_prestige[:,0])
+        
+        prestige_points = np.concatenate([self._small_prestige_points, self._large_prestige_points])
+        prestige_min, prestige_max = prestige_points.min(axis=0), prestige_points.max(axis=0) + 1
+        self._prestige_capture_bbox = (prestige_min[0].item(), prestige_min[1].item(), prestige_max[0].item(), prestige_max[1].item())
+        small_prestige = self._small_prestige_points - prestige_min
+        large_prestige = self._large_prestige_points - prestige_min
+        self._prestige_only_index = ((small_prestige[:,1], small_prestige[:,0]), (large_prestige[:,1], large_prestige[:,0]))
+
+
+    def get_window_size(self) -> tuple[int, int]:
+        return (self._game_window.size[0].item(), self._game_window.size[1].item())
+
+    # Web midpoint in game window space
+    def get_midpoint(self) -> np.ndarray:
+        return np.array(self._center_pos, float)
 
+    def get_scaling(self) -> float:
+        return self._scaling
+
+    # Node centers scaled to the game window, relative to the web midpoint and not rounded
+    def get_local_node_points(self) -> np.ndarray:
+        local_pts = (self._layout_points[:NODE_COUNT] - self._center_points[REF_RESOLUTION]).astype(float)
+        return local_pts * self._scaling
+
+    # Ring color of available nodes in BGR
+    def get_color_available(self) -> np.ndarray:
+        return self._color_node_available.copy()
+
+    def get_node_tolerance(self) -> float:
+        return self._color_tolerance
 
     def get_mouse_idle_pos(self) -> np.ndarray[int]:
         return self._game_window.position + self._web_bbox[0]
     
     def _update_game_window_info(self):
-        if self._test_image:
-            self._game_window = GameWindow(None,
-                    np.array([0, 0], int),
-                    np.array([self._test_image.width, self._test_image.height], int))
-            return
-        
         self._game_window = None
         # If set, override the window with the given monitor index
         if self._override_monitor_index > 0:
-            index = min(self._override_monitor_index, len(self._sct.monitors) - 1)
-            monitor = self._sct.monitors[index]
-            self._game_window = GameWindow(None,
-                                           np.array([monitor["left"], monitor["top"]], int),
-                                           np.array([monitor["width"], monitor["height"]], int))
+            self._game_window = window_from_monitor(self._frame_source.get_monitors(), self._override_monitor_index)
             return
 
-        
-        win32gui.EnumWindows(self._enum_windows_callback, None)
-        sleep(0.5)
+        if self._window_source is None:
+            self._window_source = Win32WindowSource()
+        self._game_window = discover_window(self._window_source)
         if not self._game_window:
-            print("Failed to find game window, if the game is actually running, set the monitor index manually", flush=True)
+            log("Failed to find game window, if the game is actually running, set the monitor index manually")
             raise WebAnalyzer.WindowNotFoundError
+        log("Game window found automatically")
+        if self._bring_to_front and self._game_window.handle is not None:
+            focus_window(self._window_source, self._game_window.handle)
     
-    # Used by pywin32 to return window handles
-    # If DBD window is found it's info is stored in _game_window and the window is brought to the foreground
-    def _enum_windows_callback(self, hwnd, *_):
-        rect = win32gui.GetWindowRect(hwnd)
-        x = rect[0]
-        y = rect[1]
-        w = rect[2] - x
-        h = rect[3] - y
-        name = win32gui.GetWindowText(hwnd).strip()
-        if name != "DeadByDaylight":
-            return
-        self._game_window = GameWindow(hwnd, np.array([x,y], int), np.array([w,h], int))
-        print("Game window found automatically", flush=True)
-        if not self._bring_to_front:
-            return
-        try:
-            win32gui.SetForegroundWindow(hwnd)
-            pass
-        except Exception as err:
-            #SetForegroundWindow seems to fail randomly
-            pass
-    
-    def save_debug_images(self):
-        print("\n---- Starting custom resolution tester ----")
+    def save_debug_images(self, output_dir: Path = None):
+        log("\n---- Starting custom resolution tester ----")
         x = self._center_pos[0]
         y = self._center_pos[1]
         
         edges_filename = f"BAB_{'{:.1f}'.format(x)}_{'{:.1f}'.format(y)}_edges.png"
         nodes_filename = f"BAB_{'{:.1f}'.format(x)}_{'{:.1f}'.format(y)}_nodes.png"
         
-        desktop = Path.home() / "Desktop"
-        edges_image_path = desktop / edges_filename
-        nodes_image_path = desktop / nodes_filename
-        print("Creating preview images for custom midpoint...", flush=True)
-        edge_im = self.debug_draw_points(["edges"])
-        nodes_im = self.debug_draw_points(["nodes"])
+        if output_dir is None:
+            output_dir = Path.home() / "Desktop"
+        edges_image_path = output_dir / edges_filename
+        nodes_image_path = output_dir / nodes_filename
+        log("Creating preview images for custom midpoint...")
+        # Both images are drawn from one capture, the first is written while the second is drawn
+        frame = self.capture_debug_frame()
+        overlay = self._create_debug_overlay()
+        writer = ImageWriter()
+        writer.save(overlay.render(frame[0], ["edges"], frame[1].nodes), edges_image_path)
+        writer.save(overlay.render(frame[0], ["nodes"]), nodes_image_path)
+        errors = writer.close()
+        if not errors:
+            log(f"Done! Files created:\n  {edges_image_path}\n  {nodes_image_path}")
+        elif any(isinstance(err, PermissionError) for _, err in errors):
+            log(f"Could not save images: Access to output directory '{output_dir}' was denied")
+        else:
+            log("Could not save images: Failed to save file")
+
+    # Saves a capture of the web with the buyable nodes highlighted and a description of what was detected
+    # details are added to the description, returns False if the files couldn't be written
+    def save_diagnostic_snapshot(self, output_dir: Path, details: dict) -> bool:
+        frame = self.capture_debug_frame()
+        scan = frame[1]
+        info = {
+            **details,
+            "window_focused": self.is_game_window_focused(),
+            **self.get_recording_info(),
+            "nodes": scan.nodes.tolist(),
+            "confidences": np.round(scan.confidences, 3).tolist(),
+            "rarities": np.asarray(scan.rarities).tolist(),
+            "edge_distances": np.round(scan.edge_distances, 1).tolist(),
+        }
         try:
-            edge_im.save(edges_image_path)
-            nodes_im.save(nodes_image_path)
-            print(f"Done! Files created:\n  {edges_image_path}\n  {nodes_image_path}",flush=True)
-        except PermissionError:
-            print(f"Could not save images: Access to output directory '{desktop}' was denied")
-        except:
-            print("Could not save images: Failed to save file")
+            output_dir.mkdir(parents=True, exist_ok=True)
+            self._create_debug_overlay().render(frame[0], ["edges"], scan.nodes).save(output_dir / "web.png")
+            with open(output_dir / "info.json", "w") as file:
+                json.dump(info, file, indent=2)
+        except OSError:
+            return False
+        return True
             
 
 
@@ -566,7 +1122,7 @@ def run_batch_image_test(images: list, draw: bool):
     for p in images:
         path = Path(p)
         if not path.is_file():
-            print(f"Invalid test_image: {path.absolute()}")
+            log(f"Invalid test_image: {path.absolute()}")
             continue
         paths.append(path) 
         
@@ -574,8 +1130,8 @@ def run_batch_image_test(images: list, draw: bool):
         try:
             image = Image.open(path)
         except Exception as err:
-            print(f"Failed to open test_image: {path.absolute()}")
-            print(err)
+            log(f"Failed to open test_image: {path.absolute()}")
+            log(err)
             continue
         run_test(draw, image)
     
@@ -589,9 +1145,9 @@ def run_test(draw: bool, image = None):
         im = analyzer.debug_draw_points(["nodes", "edges"])
         outpath = f"test_out_{analyzer._game_window.size[0]}x{analyzer._game_window.size[1]}.png"
         im.save(outpath)
-        print(f"Image saved to {outpath}")
+        log(f"Image saved to {outpath}")
     else:
-        print(f"Valid nodes: {analyzer.find_buyable_nodes()}")
+        log(f"Valid nodes: {analyzer.find_buyable_nodes()}")
 
 
 if __name__ == "__main__":
@@ -1,21 +1,53 @@
 from enum import Enum
-from time import sleep, time, perf_counter
 import numpy as np
 import keyboard
-import mouse
-from web_analyzer import WebAnalyzer
+from web_analyzer import WebAnalyzer, WebScan
+from input_backend import InputBackend, MouseInput
+from interval_tuner import IntervalTuner, PHASE_FREE, PHASE_ENTITY, DEFAULT_INTERVALS
+from web_state import WebState, WebStateTracker, BUYING_STATES
+from logger import log, flush_log
+from session_recorder import SessionRecorder
+from session_metrics import SessionMetrics
+from stop_conditions import StopConditions
+from stall_watchdog import StallWatchdog, StallAction, DIAGNOSTICS_DIR
+from web_analyzer import Rarity, Category, NODE_COUNT, MEASURED_CATEGORIES
+from clock import Clock, SystemClock
 from random import randrange
+from datetime import datetime
 from colored import stylize, attr, fg
 
 # Position to move the mouse while waiting
 IDLE_MOUSE_POS = (255, 124)
 
 
+# How often the game window is checked for moving or resizing, in seconds
+WINDOW_CHECK_INTERVAL = 1.0
+
+# How often a paused buy loop checks whether it was resumed, in seconds
+PAUSE_POLL_INTERVAL = 0.2
+
+# Delay before rescanning when only uncertain detections were found, in seconds
+UNCERTAIN_RESCAN_DELAY = 0.05
+# Scans in a row with the same most confident node after which it is bought despite its low confidence
+UNCERTAIN_MAX_RESCANS = 5
+
+# The prestige node is held until its ring completes and the node disappears, at most this long, in seconds
+PRESTIGE_MAX_HOLD = 2.0
+# How often the prestige node is checked while holding it, in seconds
+PRESTIGE_POLL_INTERVAL = 0.05
+# The prestige node is held at least this long before it may be released early, in seconds
+PRESTIGE_MIN_HOLD = 0.5
+# Polls in a row that must miss the prestige node before releasing, a single missed frame doesn't end the hold
+PRESTIGE_RELEASE_POLLS = 3
+# The prestige node is clicked once more if the new web hasn't appeared this long after pressing it, in seconds
+PRESTIGE_DISMISS_DELAY = 7.0
+
+# Once this many detected nodes were ordered by category, a warning is logged if the category of most was unknown
+CATEGORY_CHECK_NODES = 100
+CATEGORY_MAX_UNKNOWN_SHARE = 0.8
+
 PAUSE_COLOR = fg('yellow_3b')
 RUNNING_COLOR = fg('spring_green_4')
-# Logs with flushing enabled to make Gooey log window work
-def log(msg):
-    print(msg, flush=True)
 
 class Autobuy:
     class Ordering(Enum):
@@ -29,6 +61,16 @@ class Autobuy:
     _time_limit : float = 0
     _auto_prestige : bool = True
     _ordering : Ordering = Ordering.CHEAP
+    # Rank of each icon category, nodes of lower ranks are bought first, None when not ordering by category
+    _category_ranks : np.ndarray = None
+    _preferred_categories : list = []
+    _excluded_categories : list = []
+    _batch_buy : bool = False
+    _auto_tune : bool = False
+    # Nodes detected with a lower confidence are scanned again before buying, 0-1
+    _min_confidence : float = 0.0
+    # Derives the ring color from the web on the screen at startup
+    _calibrate_ring_color : bool = False
     _node_tolerance : int = 50
     _prestige_tolerance : int = 50
     
@@ -43,17 +85,49 @@ class Autobuy:
     _timing_offset_2 : float = 0.0
     
     
-    # Keeps track if a valid node was found in the current buy loop
-    _found_none_prev = True
+    # Follows the progress of the current level, decides the buying interval and how often to scan
+    _web_state : WebStateTracker
+    # Statistics of the session
+    _metrics : SessionMetrics
+    # Goals that end the session
+    _stop_conditions : StopConditions
+    # Recovers when the detected nodes stop changing
+    _watchdog : StallWatchdog
+    # Latest scan of the web, the rarities of bought nodes are looked up from it
+    _scan = None
+    # When the prestige node was pressed, None when not prestiging
+    _prestige_start : float = None
+    _prestige_dismissed = False
+    # Most confident node of the latest scans where no node reached the minimum confidence, and how many scans in a row
+    _uncertain_node : int = None
+    _uncertain_scans = 0
+    # Detected nodes ordered by category so far and how many of them had an unknown category, None after checking
+    _category_nodes = 0
+    _unknown_category_nodes = 0
+    
+    # Learns the buying intervals when auto-tuning is enabled
+    _interval_tuner : IntervalTuner = None
+    # Purchases made since the last scan, (node, phase, interval) 
+    # A purchase failed if the node is still buyable on the next scan
+    _unverified_purchases : list
     
     ## Runtime attributes ##
     
-    # Used to pause the program when the user tries to move the mouse while autobuy is in progress 
-    _last_mouse_pos = (0,0)
-
+    # Simulates the mouse, also used to pause the program when the user tries to move the mouse while autobuy is in progress 
+    _input : InputBackend = None
+    # Hands out the cursor when several instances share the mouse, None when running alone
+    _cursor = None
+    # Records the session when set
+    _recorder : SessionRecorder = None
+    # Prefixed to every log message, used to tell instances apart
+    _log_prefix = ""
+    
     # Used to keep track of pausing and exiting
     _stop_program = False
     _pause_program = False
+    # Set when paused or resumed from another thread, applied by the buy loop, see _apply_pause_changes
+    _user_paused = False
+    _resumed = False
     
     # Monitor offset
     _monitor_pos = (0,0)
@@ -64,21 +138,56 @@ class Autobuy:
     # Position where to move the mouse while idle, taking monitor position into account 
     _idle_mouse_pos = IDLE_MOUSE_POS
     
-    _time_last_bought = perf_counter()-1
+    # Measures and waits time, virtual when replaying a recorded session
+    _clock : Clock
+    
+    _start_time : float = None
+    _time_last_bought = 0.0
+    _time_window_checked = 0.0
 
 
     def __init__(self) -> None:
         self.web_analyzer = WebAnalyzer()
+        self._unverified_purchases = []
+        self._clock = SystemClock()
+        self._web_state = WebStateTracker()
+        self._metrics = SessionMetrics()
+        self._stop_conditions = StopConditions()
+        self._watchdog = StallWatchdog()
   
 
     ## Setters ##
 
     def set_time_limit(self, time_limit: float) -> None:
         self._time_limit = time_limit
+
+    def set_stop_conditions(self, stop_conditions: StopConditions) -> None:
+        self._stop_conditions = stop_conditions
+
+    def set_stall_timeout(self, stall_timeout: float) -> None:
+        self._watchdog.timeout = stall_timeout
     
     def set_ordering(self, ordering: int) -> None:
         self._ordering = ordering
     
+    # Preferred categories are bought first in the given order, excluded categories only when nothing else is left
+    # The ordering applies between nodes of the same rank, nodes of unknown category rank between the two
+    # Only the measured categories can be given, the others would not be recognized reliably
+    def set_category_priorities(self, preferred: list, excluded: list) -> None:
+        unmeasured = [Category(category).name.lower() for category in [*preferred, *excluded]
+                      if category not in MEASURED_CATEGORIES]
+        if unmeasured:
+            raise ValueError(f"Categories can't be recognized yet: {', '.join(unmeasured)}")
+        self._preferred_categories = list(preferred)
+        self._excluded_categories = list(excluded)
+        if not preferred and not excluded:
+            self._category_ranks = None
+        else:
+            self._category_ranks = np.full(len(Category), len(preferred))
+            self._category_ranks[list(preferred)] = np.arange(len(preferred))
+            self._category_ranks[list(excluded)] = len(preferred) + 1
+        self.web_analyzer.set_category_detection(self._category_ranks is not None)
+
     def set_auto_prestige(self, auto_prestige: bool) -> None:
         self._auto_prestige = auto_prestige
             
@@ -87,6 +196,18 @@ class Autobuy:
         
     def set_start_paused(self, start_paused: bool) -> None:
         self._start_paused = start_paused
+
+    def set_batch_buy(self, batch_buy: bool) -> None:
+        self._batch_buy = batch_buy
+
+    def set_auto_tune(self, auto_tune: bool) -> None:
+        self._auto_tune = auto_tune
+
+    def set_min_confidence(self, min_confidence: float) -> None:
+        self._min_confidence = min_confidence
+
+    def set_calibrate_ring_color(self, calibrate_ring_color: bool) -> None:
+        self._calibrate_ring_color = calibrate_ring_color
     
 
     def set_timing_offset_1(self, timing_offset: float) -> None:
@@ -95,43 +216,180 @@ class Autobuy:
 
     def set_timing_offset_2(self, timing_offset: float) -> None:
         self._timing_offset_2 = timing_offset
+
+    def set_input_backend(self, input_backend: InputBackend) -> None:
+        self._input = input_backend
+
+    def set_cursor_scheduler(self, cursor) -> None:
+        self._cursor = cursor
+
+    def set_clock(self, clock: Clock) -> None:
+        self._clock = clock
+
+    def set_session_recorder(self, recorder: SessionRecorder) -> None:
+        self._recorder = recorder
+        self.web_analyzer.set_session_recorder(recorder)
+
+    def set_log_prefix(self, prefix: str) -> None:
+        self._log_prefix = prefix
+
+    # Returns the options that affect which nodes are bought and when, stored in session recordings
+    def get_options(self) -> dict:
+        return {
+            "ordering": self._ordering.name,
+            "auto_prestige": self._auto_prestige,
+            "batch_buy": self._batch_buy,
+            "auto_tune": self._auto_tune,
+            "min_confidence": self._min_confidence,
+            "timing_offset_1": self._timing_offset_1,
+            "timing_offset_2": self._timing_offset_2,
+            "preferred_categories": [category.name for category in self._preferred_categories],
+            "excluded_categories": [category.name for category in self._excluded_categories],
+        }
+
+    # Applies options in the format of get_options
+    def set_options(self, options: dict) -> None:
+        self._ordering = self.Ordering[options["ordering"]]
+        self._auto_prestige = options["auto_prestige"]
+        self._batch_buy = options["batch_buy"]
+        self._auto_tune = options["auto_tune"]
+        self._min_confidence = options["min_confidence"]
+        self._timing_offset_1 = options["timing_offset_1"]
+        self._timing_offset_2 = options["timing_offset_2"]
+        # Not stored in older recordings
+        self.set_category_priorities([Category[name] for name in options.get("preferred_categories", [])],
+                                     [Category[name] for name in options.get("excluded_categories", [])])
+
+    def get_nodes_bought(self) -> int:
+        return self._metrics.nodes_bought
+
+    def get_metrics(self) -> SessionMetrics:
+        return self._metrics
+
+    def is_paused(self) -> bool:
+        return self._pause_program
+
+    def is_stopped(self) -> bool:
+        return self._stop_program
+
+    # Returns the live state and counters of the session, read by the control server from other threads
+    def get_status(self) -> dict:
+        metrics = self._metrics
+        return {
+            "paused": self._pause_program,
+            "stopped": self._stop_program,
+            "state": self._web_state.state.name,
+            "elapsed": 0.0 if self._start_time is None else round(self._clock.now() - self._start_time, 1),
+            "nodes_bought": metrics.nodes_bought,
+            "nodes_by_rarity": {rarity.name: count for rarity, count in zip(Rarity, metrics.nodes_by_rarity)},
+            "bloodpoints_spent": metrics.bloodpoints_spent,
+            "levels_completed": metrics.levels_completed,
+            "prestiges": metrics.get_prestige_count(),
+        }
+
+    def _log(self, msg) -> None:
+        log(self._log_prefix + msg)
+
+    def _record(self, event: str, **details) -> None:
+        if self._recorder is not None:
+            self._recorder.record_event(event, **details)
     
 
-    # Click and hold at absolute screen position for duration
-    def click(self, pos, duration: float) -> None:
-        if self.check_for_mouse_pause():
-            return
-        mouse.move(pos[0], pos[1])
-        self._last_mouse_pos = (pos[0], pos[1])
-        sleep(0.05) # This small delay seems to be needed
-        mouse.press()
-        sleep(duration)
-        mouse.release()
-
-    # Automatically click at the prestige icon for the right duration
+    # Click and hold at absolute screen position for duration, then move the mouse out of the way
+    # ready_time is when the click became due, the earliest due instance gets the shared cursor first
+    # release_check is polled while holding, the click is released early once it returns True
+    # Returns False if the click was cancelled by the user moving the mouse
+    def click(self, pos, duration: float, ready_time: float = None, release_check = None) -> bool:
+        if self._cursor is not None:
+            self._cursor.acquire(ready_time if ready_time is not None else self._clock.now())
+        try:
+            if self.check_for_mouse_pause():
+                return False
+            self._input.move(pos[0], pos[1])
+            self._clock.sleep(0.05) # This small delay seems to be needed
+            self._input.press()
+            held = self._hold(duration, release_check)
+            self._input.release()
+            self._metrics.record_click(held)
+            self._record("click", pos=[int(pos[0]), int(pos[1])], duration=held)
+            self._reset()
+            return True
+        finally:
+            if self._cursor is not None:
+                self._cursor.release()
+
+    # Returns how long the button was held
+    def _hold(self, duration: float, release_check) -> float:
+        start = self._clock.now()
+        if release_check is None:
+            self._clock.sleep(duration)
+            return duration
+        end = start + duration
+        while self._clock.now() < end:
+            self._clock.sleep(min(PRESTIGE_POLL_INTERVAL, end - self._clock.now()))
+            if release_check():
+                break
+        return self._clock.now() - start
+
+    # Holds the prestige icon until its ring completes
+    # The new web is waited for by the buy loop, see _finish_prestige
     def prestige(self) -> None:
         pos = self.web_analyzer.get_node_position(-1)
-        self.click(pos, 2.0)
-        sleep(5.0)
-        self.click(pos, 0.1)
+        self._record("prestige")
+        self._web_state.on_prestige()
+        # The prestige node is still there after the previous attempt, it was released too early
+        retry = self._prestige_start is not None
+        # A retried prestige is measured from the first attempt
+        if not retry:
+            self._prestige_start = self._clock.now()
+        self._prestige_dismissed = False
+        # A retry is held for the full time, in case the detection keeps missing the hovered icon
+        self.click(pos, PRESTIGE_MAX_HOLD, release_check=None if retry else self._get_prestige_release_check())
+
+    # Returns a release check for holding the prestige node
+    # Releases once the node has been missed by PRESTIGE_RELEASE_POLLS polls in a row, after PRESTIGE_MIN_HOLD
+    def _get_prestige_release_check(self):
+        start = self._clock.now()
+        misses = 0
+        def release_check() -> bool:
+            nonlocal misses
+            misses = 0 if self.web_analyzer.is_prestige_buyable() else misses + 1
+            return misses >= PRESTIGE_RELEASE_POLLS and self._clock.now() - start >= PRESTIGE_MIN_HOLD
+        return release_check
+
+    # Clicks the prestige icon once more if the new web is taking long to appear
+    def _dismiss_prestige(self) -> None:
+        if self._prestige_start is None or self._prestige_dismissed:
+            return
+        if self._clock.now() - self._prestige_start < PRESTIGE_DISMISS_DELAY:
+            return
+        self._prestige_dismissed = True
+        self.click(self.web_analyzer.get_node_position(-1), 0.1)
+
+    # Called when the new web appears after prestiging
+    def _finish_prestige(self) -> None:
+        duration = self._clock.now() - self._prestige_start
+        saved = self._metrics.record_prestige(duration)
+        self._prestige_start = None
+        self._record("prestige_done", duration=duration, saved=saved)
+        if self._verbose:
+            self._log(f"   New web after {duration:.1f} s, {saved:.1f} s faster than waiting")
 
     # Moves the mouse out of way so no extra GUI elements are potentially drawn on top of the nodes
     def _reset(self) -> None:
-        mouse.move(self._idle_mouse_pos[0], self._idle_mouse_pos[1])
-        self._last_mouse_pos = self._idle_mouse_pos
+        self._input.move(self._idle_mouse_pos[0], self._idle_mouse_pos[1])
         
     # Check if user has moved the mouse and pause automatically
     def check_for_mouse_pause(self) -> bool:
-        mouse_pos = mouse.get_position()
-        moved_dist = max(abs(self._last_mouse_pos[0] - mouse_pos[0]),abs(self._last_mouse_pos[1] - mouse_pos[1]))
-        if not self._pause_program and moved_dist > 3:
-            log(stylize("Paused, F3: Resume", PAUSE_COLOR))
+        if not self._pause_program and self._input.user_moved():
+            self._log(stylize("Paused, F3: Resume", PAUSE_COLOR))
             self._pause_program = True
+            self._on_paused("mouse")
             return True
         return False
 
 
-    def _stop(self):
+    def stop(self):
         self._stop_program = True
 
     def _stop_if_paused(self):
@@ -139,18 +397,49 @@ class Autobuy:
             self._stop_program = True
 
 
-    def _toggle_pause(self):
-        self._pause_program = not self._pause_program
-        if self._pause_program:
-            log(stylize("Paused, F2: Stop, F3: Resume", PAUSE_COLOR))
+    def set_paused(self, paused: bool):
+        if paused == self._pause_program:
+            return
+        self._pause_program = paused
+        # Called from the hotkey or control server thread while the buy loop may be in the middle of a scan,
+        # only the flags are set here, the buy loop records the change and resets its state
+        if paused:
+            self._log(stylize("Paused, F2: Stop, F3: Resume", PAUSE_COLOR))
+            self._user_paused = True
         else:
-            log(stylize("Resumed, F2: Stop, F3: Pause", RUNNING_COLOR))
-            self._last_mouse_pos = mouse.get_position()
+            self._log(stylize("Resumed, F2: Stop, F3: Pause", RUNNING_COLOR))
+            self._resumed = True
+
+    # Applies pausing and resuming by the user on the thread running the buy loop
+    def _apply_pause_changes(self) -> None:
+        if self._user_paused:
+            self._user_paused = False
+            self._on_paused("user")
+        if self._resumed:
+            self._apply_resume()
+
+    # Resets the state of the buy loop after resuming
+    def _apply_resume(self) -> None:
+        self._resumed = False
+        self._record("resume", reason="user")
+        self._input.sync_position()
+        # The web may have been changed by the user while paused
+        self._unverified_purchases = []
+        self._web_state.reset()
+        self._prestige_start = None
+        self._watchdog.reset(self._clock.now())
+
+    def _on_paused(self, reason: str) -> None:
+        self._record("pause", reason=reason)
+        self._metrics.record_pause()
+
+    def _toggle_pause(self):
+        self.set_paused(not self._pause_program)
     
 
     # Returns the time since _start_time in hh, mm, ss format
     def _get_run_duration_string(self) -> str:
-        seconds = int(time() - self._start_time)
+        seconds = int(self._clock.now() - self._start_time)
         minutes, seconds = divmod(seconds, 60)
         hours, minutes = divmod(minutes, 60)
         periods = [('hours', hours), ('minutes', minutes), ('seconds', seconds)]
@@ -159,43 +448,136 @@ class Autobuy:
                                 if value)
         return time_string
     
-    def _buy_node(self, node: int) -> bool:
+    def _buy_node(self, node: int) -> None:
         if node == -1:
             self.prestige()
+            return
         clickpos = self.web_analyzer.get_node_position(node)
         if self._verbose:
-            log(f"  Buying node {node}")
+            category = f" ({Category(self._get_category(node)).name.lower()})" if self._category_ranks is not None else ""
+            self._log(f"  Buying node {node}{category}")
 
-        required_delay = max(0.43 + self._timing_offset_2, 0) if self._level_bought_nodes >= 4 else max(0.0166666667 + self._timing_offset_1, 0)
-        diff = (perf_counter() - self._time_last_bought)
+        phase = self._web_state.get_phase()
+        required_delay = self._get_buy_interval(phase)
+        diff = (self._clock.now() - self._time_last_bought)
         if diff < required_delay:
-            sleep(max(required_delay - diff, 0))
+            self._clock.sleep(max(required_delay - diff, 0))
         
-        self.click(clickpos, 0.5)
+        clicked = self.click(clickpos, 0.5, self._time_last_bought + required_delay)
         
-        self._time_last_bought = perf_counter()
-        self._reset()
+        self._time_last_bought = self._clock.now()
+        if clicked:
+            self._web_state.on_bought(node)
+            self._metrics.record_node(self._get_rarity(node))
+            self._check_stop_conditions()
+        # Only purchases that had to wait for the interval tell whether the interval was long enough
+        if clicked and diff < required_delay:
+            self._unverified_purchases.append((node, phase, required_delay))
+
+    # Rarity of a node in the latest scan
+    def _get_rarity(self, node: int) -> Rarity:
+        index = np.flatnonzero(self._scan.nodes == node)
+        if len(index) == 0 or len(self._scan.rarities) == 0:
+            return Rarity.COMMON
+        return Rarity(self._scan.rarities[index[0]])
+
+    # Icon categories of nodes in the latest scan
+    def _get_categories(self, nodes: np.ndarray) -> np.ndarray:
+        lookup = np.full(NODE_COUNT, Category.UNKNOWN, np.uint8)
+        if len(self._scan.categories) > 0:
+            lookup[self._scan.nodes] = self._scan.categories
+        return lookup[nodes]
+
+    def _get_category(self, node: int) -> int:
+        return self._get_categories(np.array([node]))[0]
+
+    # Warns once when the category of most detected nodes isn't recognized, unknown nodes are not ordered by category
+    # Only the perk stripe offsets were measured from the game, the other categories may not match it
+    def _check_categories(self, scan: WebScan) -> None:
+        if self._category_nodes is None or len(scan.categories) == 0:
+            return
+        self._category_nodes += len(scan.categories)
+        self._unknown_category_nodes += np.count_nonzero(scan.categories == Category.UNKNOWN)
+        if self._category_nodes < CATEGORY_CHECK_NODES:
+            return
+        if self._unknown_category_nodes > self._category_nodes * CATEGORY_MAX_UNKNOWN_SHARE:
+            self._log(stylize(f"The category of {self._unknown_category_nodes / self._category_nodes * 100:.0f}% of the "
+                              f"nodes was not recognized, the category order may not work", PAUSE_COLOR))
+        self._category_nodes = None
+
+    # Stops the session once a goal has been reached
+    def _check_stop_conditions(self) -> None:
+        reason = self._stop_conditions.get_reached(self._metrics)
+        if reason is None or self._stop_program:
+            return
+        self._log(stylize(f"Goal reached, {reason}", attr("bold")))
+        self._record("goal", reason=reason)
+        self._stop_program = True
+
+    def _get_buy_interval(self, phase: int) -> float:
+        if self._auto_tune:
+            return self._interval_tuner.get_interval(phase)
+        if phase == PHASE_ENTITY:
+            return max(DEFAULT_INTERVALS[PHASE_ENTITY] + self._timing_offset_2, 0)
+        return max(DEFAULT_INTERVALS[PHASE_FREE] + self._timing_offset_1, 0)
+
+    # Feeds the outcome of the purchases made since the previous scan to the interval tuner
+    def _verify_purchases(self, nodes: np.ndarray) -> None:
+        if self._auto_tune:
+            for node, phase, interval in self._unverified_purchases:
+                self._interval_tuner.record(phase, interval, node not in nodes)
+        self._unverified_purchases = []
+
+    # Returns the nodes in the order they should be bought in
+    def _order_nodes(self, nodes: np.ndarray) -> np.ndarray:
+        if self._ordering == self.Ordering.EXPENSIVE:
+            nodes = nodes[::-1]
+        elif self._ordering == self.Ordering.SHUFFLE:
+            nodes = np.random.permutation(nodes)
+        if self._category_ranks is not None and len(nodes) > 1:
+            # Preferred categories first and excluded ones last, keeping the order of nodes with the same rank
+            nodes = nodes[np.argsort(self._category_ranks[self._get_categories(nodes)], kind="stable")]
+        return nodes
+
+    # Buys several nodes planned from a single scan while the Entity is not blocking nodes yet
+    # Nodes stay buyable until the Entity phase, so each planned node is only verified with a cheap single node check
+    def _buy_batch(self, nodes: np.ndarray) -> None:
+        planned = self._order_nodes(nodes)[:self._web_state.get_free_nodes_left()]
+        for node in planned:
+            if self._stop_program or self._pause_program:
+                return
+            if not self.web_analyzer.is_node_buyable(node, self._min_confidence):
+                continue
+            self._buy_node(node)
+
+    # Resets the runtime state at the start of the buy loop
+    def _start_session(self) -> None:
+        # Pausing and resuming before the session started don't need to be recorded
+        self._user_paused = False
+        self._resumed = False
+        self._start_time = self._clock.now()
+        self._time_last_bought = self._start_time - 1
+        self._time_window_checked = self._start_time
+        self._web_state.reset()
+        self._watchdog.reset(self._start_time)
+
+    # Starts the session of a buy loop, setup needs to be called first
+    def start_session(self) -> None:
+        self._input.sync_position()
+        self._start_session()
 
     # Main buy loop
     def _buy_loop(self) -> None:
-        self._last_mouse_pos = mouse.get_position()
-        self._start_time = time()
-        
-        # Tracks the amount of nodes successfully bought in a row, needed to add longer delay between loops after 5 nodes
-        self._level_bought_nodes = 0
+        self.start_session()
         
         while self._stop_program == False:    
+            self._apply_pause_changes()
             # Pause loop
             if self._pause_program:
-                sleep(0.2)
+                self._clock.sleep(PAUSE_POLL_INTERVAL)
                 continue
-            # First check if we should pause from mouse movement
-            if self.check_for_mouse_pause():
+            if not self._before_scan():
                 continue
-            # Time limit tracking
-            elapsed_time = time() - self._start_time
-            if self._time_limit > 0.0 and elapsed_time > self._time_limit:
-                self._stop_program = True
             
             # If shuffle enabled, randomize the node order during each buy loop
             #if self._ordering == self.Ordering.SHUFFLE:
@@ -205,73 +587,267 @@ class Autobuy:
             self._try_buy()
             
 
+    # Checks done before each scan, returns False if the scan should be skipped
+    def _before_scan(self) -> bool:
+        self._apply_pause_changes()
+        # First check if we should pause from mouse movement
+        if self.check_for_mouse_pause():
+            return False
+        if self._clock.now() - self._time_window_checked > WINDOW_CHECK_INTERVAL:
+            self._check_window()
+        # Time limit tracking
+        elapsed_time = self._clock.now() - self._start_time
+        if self._time_limit > 0.0 and elapsed_time > self._time_limit:
+            self._stop_program = True
+        return True
+
+    # For drivers that capture and analyze the web themselves, e.g. the replay
+    # Runs the checks of the buy loop and gets the mouse out of the way, returns False if the web shouldn't be scanned now
+    def prepare_scan(self) -> bool:
+        if not self._before_scan():
+            return False
+        self._move_mouse_away()
+        return True
+
+
+    # Follows the game window if it's moved or resized
+    # resolve looks the window up again by its title instead of only checking the known window
+    def _check_window(self, resolve: bool = False) -> None:
+        self._time_window_checked = self._clock.now()
+        try:
+            if resolve:
+                changed = self.web_analyzer.resolve_game_window()
+            else:
+                changed = self.web_analyzer.refresh_window_geometry()
+        except WebAnalyzer.GameResolutionError as err:
+            self._log(stylize(f"Paused, unsupported game window size {'x'.join(err.resolution)}", PAUSE_COLOR))
+            self._pause_program = True
+            self._on_paused("resolution")
+            return
+        if changed:
+            self._on_window_changed()
+
+    # Applies a game window change recorded in a session, see WebAnalyzer.get_recording_info, used by the replay
+    def follow_window(self, info: dict) -> None:
+        self.web_analyzer.load_recording_info(info)
+        self._on_window_changed()
+
+    def _on_window_changed(self) -> None:
+        self._record("window", info=self.web_analyzer.get_recording_info())
+        idle_pos = self.web_analyzer.get_mouse_idle_pos()
+        self._idle_mouse_pos = (idle_pos[0], idle_pos[1])
+        self._unverified_purchases = []
+        self._web_state.reset()
+
+    # Takes the next recovery step when the detected nodes have stopped changing, see StallWatchdog
+    def _check_stall(self, nodes: np.ndarray) -> None:
+        now = self._clock.now()
+        action = self._watchdog.update(nodes, now)
+        if action is None:
+            return
+        stalled = self._watchdog.get_stalled_time(now)
+        self._record("stall", action=action.name, stalled=stalled)
+        if action == StallAction.REFOCUS:
+            self._log(f"No progress for {stalled:.0f} s, focusing the game window")
+            if not self.web_analyzer.focus_game_window():
+                self._log("   Could not focus the game window")
+        elif action == StallAction.RESOLVE_WINDOW:
+            self._log(f"No progress for {stalled:.0f} s, looking up the game window again")
+            self._check_window(resolve=True)
+        else:
+            self._log(stylize(f"Paused, no progress for {stalled:.0f} s, F3: Resume", PAUSE_COLOR))
+            self._pause_program = True
+            self._on_paused("stall")
+            self._save_stall_snapshot(stalled)
+
+    # Saves a capture of the web and the state of the session for finding out why buying stalled
+    def _save_stall_snapshot(self, stalled: float) -> None:
+        client = self._log_prefix.strip("[] ")
+        output_dir = DIAGNOSTICS_DIR / (f"stall_{datetime.now():%Y%m%d_%H%M%S}" + (f"_{client}" if client else ""))
+        details = {
+            "stalled": round(stalled, 1),
+            "state": self._web_state.state.name,
+            "elapsed": round(self._clock.now() - self._start_time, 1),
+            "nodes_bought": self._metrics.nodes_bought,
+        }
+        if self.web_analyzer.save_diagnostic_snapshot(output_dir, details):
+            self._log(f"   Diagnostic snapshot saved to {output_dir}")
+        else:
+            self._log(f"   Could not save the diagnostic snapshot to {output_dir}")
+
+    # Follows the level progress from the detected nodes and reports state changes
+    def _update_state(self, nodes: np.ndarray) -> None:
+        previous = self._web_state.state
+        if not self._web_state.update(nodes, self._clock.now()):
+            return
+        state = self._web_state.state
+        self._record("state", state=state.name)
+        if state == WebState.PRESTIGE_AVAILABLE:
+            self._log(stylize("Prestige detected", attr("bold")))
+        elif self._verbose:
+            self._log(f"   {state.name.replace('_', ' ').capitalize()}")
+        if previous == WebState.PRESTIGE_ANIMATION and state == WebState.LEVEL_START and self._prestige_start is not None:
+            self._finish_prestige()
+            self._check_stop_conditions()
+        elif previous in (WebState.FREE_BUY, WebState.ENTITY) and state == WebState.LEVEL_COMPLETE:
+            self._metrics.record_level()
+            self._check_stop_conditions()
+
+    def _move_mouse_away(self) -> None:
+        # A shared cursor is always left out of the way after clicking, and may be in use by another instance
+        if self._cursor is None:
+            self._reset() 
 
     def _try_buy(self):
         # Move mouse out of the way
-        self._reset() 
-        nodes = self.web_analyzer.find_buyable_nodes()
-        if len(nodes) == 0:
-            self._level_bought_nodes = 0
-            # Prevent repeating
-            if self._verbose and not self._found_none_prev:
-                log("   Nothing detected")
-            self._found_none_prev = True
-            # Add a small delay between loops to allow for the level up animation to play
-            sleep(0.5)
+        self._move_mouse_away()
+        scan = self.web_analyzer.scan_web()
+        self.handle_scan(scan, self.web_analyzer.last_capture_time, self.web_analyzer.last_analysis_time)
+
+    # Counts the scans in a row where no node reached the minimum confidence and the same node was the most confident
+    # Once that node has stayed the most confident for UNCERTAIN_MAX_RESCANS scans the detections are consistent, not a
+    # transition, and all detected nodes are returned, so a web that always scores low is still bought. No nodes before
+    def _get_uncertain_nodes(self, scan: WebScan) -> np.ndarray:
+        best = scan.nodes[scan.confidences.argmax()]
+        if best != self._uncertain_node:
+            self._uncertain_node = best
+            self._uncertain_scans = 0
+        self._uncertain_scans += 1
+        if self._uncertain_scans < UNCERTAIN_MAX_RESCANS:
+            return np.zeros(0, int)
+        if self._verbose and self._uncertain_scans == UNCERTAIN_MAX_RESCANS:
+            self._log(f"   Same detection for {UNCERTAIN_MAX_RESCANS} scans, buying despite a confidence of "
+                      f"{scan.confidences.max() * 100:.0f}%")
+        return scan.nodes
+
+    # Acts on a scan of the web: follows the level progress and buys the next node or waits before the next scan
+    # The capture and analysis times are only recorded in the metrics
+    def handle_scan(self, scan: WebScan, capture_time: float, analysis_time: float) -> None:
+        self._scan = scan
+        self._check_categories(scan)
+        self._metrics.record_scan(capture_time, analysis_time, len(scan.nodes) == 0)
+        self._verify_purchases(scan.nodes)
+        nodes = scan.get_confident_nodes(self._min_confidence)
+        if len(nodes) == 0 and len(scan.nodes) > 0:
+            nodes = self._get_uncertain_nodes(scan)
+        else:
+            self._uncertain_node = None
+        self._check_stall(nodes)
+        if self._pause_program:
+            return
+        if len(nodes) == 0 and len(scan.nodes) > 0:
+            # Something was detected, but it may be a transition or a highlight, look again shortly
+            if self._verbose:
+                self._log(f"   Uncertain detection, best confidence {scan.confidences.max() * 100:.0f}%")
+            self._clock.sleep(UNCERTAIN_RESCAN_DELAY)
+            return
+        self._update_state(nodes)
+        if self._stop_program:
+            return
+        state = self._web_state.state
+        if len(nodes) == 0 or state not in BUYING_STATES:
+            # Waiting for the level up or prestige animation, or confirming a new or an empty web
+            if state == WebState.PRESTIGE_ANIMATION:
+                self._dismiss_prestige()
+            self._clock.sleep(self._web_state.get_scan_delay())
             return
         
-        self._found_none_prev = False
-        
-        index = 0 if self._ordering != self.Ordering.EXPENSIVE else -1
-        if self._ordering == self.Ordering.SHUFFLE:
-            index = randrange(0,len(nodes))
-        node = nodes[index]
+        if self._category_ranks is not None:
+            node = self._order_nodes(nodes)[0]
+        else:
+            index = 0 if self._ordering != self.Ordering.EXPENSIVE else -1
+            if self._ordering == self.Ordering.SHUFFLE:
+                index = randrange(0,len(nodes))
+            node = nodes[index]
         
         # Normal node
-        if node != -1:
+        if state != WebState.PRESTIGE_AVAILABLE:
+            if self._batch_buy and self._web_state.get_free_nodes_left() > 0:
+                self._buy_batch(nodes)
+                return
             self._buy_node(node)
-            self._level_bought_nodes += 1
             return
         # Prestige node
-        self._level_bought_nodes = 0
-        log(stylize("Prestige detected", attr("bold")))
-        if node == -1 and not self._auto_prestige:
-            log(stylize("Paused on prestige", PAUSE_COLOR))
+        if not self._auto_prestige:
+            self._log(stylize("Paused on prestige", PAUSE_COLOR))
             self._pause_program = True
+            self._on_paused("prestige")
             return
         self._buy_node(node)
 
     
-    # Start buying the bloodweb nodes
-    def run(self) -> None:
+    # Initializes the analyzer and the runtime state, returns False on failure
+    def setup(self) -> bool:
+        if self._input is None:
+            self._input = MouseInput()
         try:
             self.web_analyzer.initialize()
         except (WebAnalyzer.GameResolutionError, WebAnalyzer.WindowNotFoundError):
-            print("Failed to initialize", flush=True)
-            return
-        
-        print("\n---- Running Autobuy ----")
+            log("Failed to initialize")
+            return False
 
         idle_pos = self.web_analyzer.get_mouse_idle_pos()
         self._idle_mouse_pos = (idle_pos[0], idle_pos[1])
 
+        if self._calibrate_ring_color:
+            # The mouse could be hovering a node and highlight it
+            self._reset()
+            self.web_analyzer.calibrate_ring_color()
+        
+        if self._auto_tune:
+            self._interval_tuner = IntervalTuner((DEFAULT_INTERVALS[PHASE_FREE] + self._timing_offset_1,
+                                                  DEFAULT_INTERVALS[PHASE_ENTITY] + self._timing_offset_2))
+            profile = self.web_analyzer.profile
+            if profile is not None and "timings" in profile:
+                self._interval_tuner.from_dict(profile["timings"])
+                self._log("Loaded learned buying intervals")
+        
+        if self._recorder is not None:
+            self._recorder.start({**self.web_analyzer.get_recording_info(), "options": self.get_options()})
         if self._start_paused:
-            log(stylize("F3: Begin, F2: Stop", PAUSE_COLOR))
             self._pause_program = True
+        return True
+
+    # Runs the buy loop until stopped, setup needs to be called first
+    def run_loop(self) -> None:
+        try:
+            self._buy_loop()
+        finally:
+            self.finish_session()
+
+    # Reports and stores the results once the buy loop has ended
+    def finish_session(self) -> None:
+        self._apply_pause_changes()
+        # Main loop ended, print out the time stats
+        self._log(f"Stopping, ran for {self._get_run_duration_string()}")
+        if self._recorder is not None:
+            self._record("stop")
+            self._recorder.close()
+        self._log("Session summary:\n" + self._metrics.get_report())
+        if self._auto_tune:
+            self._log("Learned buying intervals:\n" + self._interval_tuner.get_report())
+            if self.web_analyzer.profile is not None:
+                self.web_analyzer.profile["timings"] = self._interval_tuner.to_dict()
+                self.web_analyzer.save_profile()
+        flush_log()
+
+    # Start buying the bloodweb nodes
+    def run(self) -> None:
+        if not self.setup():
+            return
+        
+        log("\n---- Running Autobuy ----")
+
+        if self._start_paused:
+            log(stylize("F3: Begin, F2: Stop", PAUSE_COLOR))
         else:
             log(stylize("F2: Stop, F3: Pause/Resume", RUNNING_COLOR))
             
         keyboard.add_hotkey('f3', lambda: self._toggle_pause())
-        keyboard.add_hotkey('f2', lambda: self._stop())
+        keyboard.add_hotkey('f2', lambda: self.stop())
         keyboard.add_hotkey('esc', lambda: self._stop_if_paused())
-        
-        
-        # Wrap in try/finally to make sure kb_listener thread is always stopped
-        try:
-            self._buy_loop()
-        finally:
-             # Main loop ended, print out the time stats
-            log(f"Stopping, ran for {self._get_run_duration_string()}")
+
+        self.run_loop()
 
 # preallocate empty array and assign slice by chrisaycock
 def shift(arr, num, fill_value=np.nan):
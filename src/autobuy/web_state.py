@@ -0,0 +1,145 @@
+from enum import Enum
+import numpy as np
+from interval_tuner import PHASE_FREE, PHASE_ENTITY
+
+# Amount of nodes that can be bought in a level before the Entity starts blocking nodes
+FREE_NODE_COUNT = 4
+
+# The web needs to stay empty this long before the level counts as complete, in seconds
+# Shorter gaps are missed detections, e.g. a node highlighted by the cursor
+LEVEL_COMPLETE_CONFIRM_TIME = 0.15
+# Delay between the scans confirming an empty web, in seconds
+EMPTY_RESCAN_DELAY = 0.05
+# A node needs to stay gone this long without being bought before the Entity phase starts, in seconds
+# Shorter gaps are missed detections, the free purchases continue
+ENTITY_CONFIRM_TIME = 0.15
+
+
+class WebState(Enum):
+    # New web seen once, waiting for a second scan with the same nodes before buying
+    LEVEL_START = 0
+    # Nodes are bought before the Entity starts blocking them
+    FREE_BUY = 1
+    # The Entity is blocking nodes
+    ENTITY = 2
+    # No buyable nodes, the level up animation is playing
+    LEVEL_COMPLETE = 3
+    # Only the prestige node is buyable
+    PRESTIGE_AVAILABLE = 4
+    # Prestige bought, waiting for the new web
+    PRESTIGE_ANIMATION = 5
+
+
+# Delay before the next scan when a scan did not lead to a purchase, in seconds
+SCAN_DELAYS = {
+    WebState.LEVEL_START : 0.05,
+    WebState.FREE_BUY : 0.0,
+    WebState.ENTITY : 0.0,
+    WebState.LEVEL_COMPLETE : 0.1,
+    WebState.PRESTIGE_AVAILABLE : 0.0,
+    WebState.PRESTIGE_ANIMATION : 0.25,
+}
+
+# States in which the detected nodes are bought
+BUYING_STATES = (WebState.FREE_BUY, WebState.ENTITY, WebState.PRESTIGE_AVAILABLE)
+
+
+# Follows the progress of the Bloodweb level from the scan results
+# Purchases only count once a scan shows the node is no longer buyable, and the Entity phase starts
+# either after the free purchases or once a node has stayed gone without being bought for ENTITY_CONFIRM_TIME
+class WebStateTracker:
+    def __init__(self) -> None:
+        self.reset()
+
+    # The web on the screen is unknown, e.g. at the start or after pausing
+    def reset(self) -> None:
+        # The first nodes seen start a level
+        self.state = WebState.LEVEL_COMPLETE
+        self._nodes = np.empty(0, int)
+        # Clicked nodes not verified by a scan yet
+        self._pending = []
+        self._level_bought_nodes = 0
+        self._empty_since = None
+        # Nodes gone without being bought during the free purchases, and since when
+        self._vanished = {}
+
+    def get_phase(self) -> int:
+        return PHASE_ENTITY if self.state == WebState.ENTITY else PHASE_FREE
+
+    def get_scan_delay(self) -> float:
+        if self._empty_since is not None and self.state != WebState.LEVEL_COMPLETE:
+            return EMPTY_RESCAN_DELAY
+        return SCAN_DELAYS[self.state]
+
+    # Nodes that can still be bought before the Entity phase, purchases waiting for verification included
+    def get_free_nodes_left(self) -> int:
+        if self.state != WebState.FREE_BUY:
+            return 0
+        return max(FREE_NODE_COUNT - self._level_bought_nodes - len(self._pending), 0)
+
+    def on_bought(self, node: int) -> None:
+        self._pending.append(node)
+
+    def on_prestige(self) -> None:
+        self._set_state(WebState.PRESTIGE_ANIMATION)
+
+    # Updates the state from the confidently detected nodes of a scan, returns True if the state changed
+    def update(self, nodes: np.ndarray, now: float) -> bool:
+        previous = self.state
+        if len(nodes) == 0:
+            self._update_empty(now)
+        elif len(nodes) == 1 and nodes[0] == -1:
+            # Also when the prestige node is still there after holding it, the prestige is tried again
+            self._empty_since = None
+            self._set_state(WebState.PRESTIGE_AVAILABLE)
+        else:
+            self._empty_since = None
+            self._update_nodes(nodes, now)
+        return self.state != previous
+
+    def _update_empty(self, now: float) -> None:
+        if self.state in (WebState.LEVEL_COMPLETE, WebState.PRESTIGE_ANIMATION):
+            return
+        if self._empty_since is None:
+            self._empty_since = now
+        if now - self._empty_since >= LEVEL_COMPLETE_CONFIRM_TIME or self.state == WebState.LEVEL_START:
+            self._set_state(WebState.LEVEL_COMPLETE)
+
+    def _update_nodes(self, nodes: np.ndarray, now: float) -> None:
+        state = self.state
+        if state in (WebState.LEVEL_COMPLETE, WebState.PRESTIGE_ANIMATION, WebState.PRESTIGE_AVAILABLE):
+            self._set_state(WebState.LEVEL_START)
+        elif state == WebState.LEVEL_START:
+            # The nodes appear one by one during the level up animation, the web is ready once it stops changing
+            if np.array_equal(np.sort(nodes), np.sort(self._nodes)):
+                self._set_state(WebState.FREE_BUY)
+        else:
+            verified = [node for node in self._pending if node not in nodes]
+            self._level_bought_nodes += len(verified)
+            # Buying a node never removes other nodes, only the Entity does
+            consumed = np.setdiff1d(self._nodes, nodes)
+            consumed = consumed[~np.isin(consumed, self._pending)]
+            if state == WebState.FREE_BUY and (self._level_bought_nodes >= FREE_NODE_COUNT or
+                                               self._is_vanish_confirmed(consumed, nodes, now)):
+                self._set_state(WebState.ENTITY)
+        self._pending = []
+        self._nodes = np.asarray(nodes)
+
+    # Follows the nodes gone without being bought, returns True once one of them has stayed gone long enough
+    def _is_vanish_confirmed(self, consumed: np.ndarray, nodes: np.ndarray, now: float) -> bool:
+        for node in consumed:
+            self._vanished.setdefault(int(node), now)
+        # Nodes seen again were missed detections
+        for node in [node for node in self._vanished if node in nodes]:
+            del self._vanished[node]
+        return any(now - since >= ENTITY_CONFIRM_TIME for since in self._vanished.values())
+
+    def _set_state(self, state: WebState) -> None:
+        if state in (WebState.LEVEL_START, WebState.LEVEL_COMPLETE):
+            self._level_bought_nodes = 0
+            self._pending = []
+        if state == WebState.LEVEL_COMPLETE:
+            self._nodes = np.empty(0, int)
+        self._empty_since = None
+        self._vanished = {}
+        self.state = state
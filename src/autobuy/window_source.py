@@ -0,0 +1,158 @@
+import numpy as np
+from time import sleep, perf_counter
+
+
+class GameWindow:
+    handle : int
+    position : np.ndarray[int]
+    size : np.ndarray[int]
+
+    def __init__(self, handle, position, size) -> None:
+        self.handle = handle
+        self.position = position
+        self.size = size
+
+
+GAME_WINDOW_TITLE = "DeadByDaylight"
+
+# How long window discovery keeps retrying before giving up, in seconds
+DISCOVERY_TIMEOUT = 2.0
+# First retry delay, doubled after every failed attempt
+DISCOVERY_INITIAL_DELAY = 0.01
+# How long to wait for a window brought to the foreground to become active
+FOREGROUND_TIMEOUT = 0.5
+
+
+# Interface for looking up windows
+# Separates the platform specific window API from the analyzer
+class WindowSource:
+    # Returns a list of (handle, title, (left, top, right, bottom)) for all top level windows
+    def list_windows(self) -> list:
+        raise NotImplementedError
+
+    # Returns (left, top, right, bottom) of the window or None if it no longer exists
+    def get_window_rect(self, handle) -> tuple:
+        for window_handle, _, rect in self.list_windows():
+            if window_handle == handle:
+                return rect
+        return None
+
+    def find_window(self, title: str) -> GameWindow:
+        for handle, window_title, rect in self.list_windows():
+            if window_title == title:
+                return window_from_rect(handle, rect)
+        return None
+
+    # Tries to bring the window to the foreground
+    def focus_window(self, handle) -> None:
+        pass
+
+    def is_foreground(self, handle) -> bool:
+        return True
+
+
+class Win32WindowSource(WindowSource):
+    def __init__(self) -> None:
+        # Imported here so the rest of the program doesn't depend on pywin32
+        import win32gui
+        self._win32gui = win32gui
+
+    def list_windows(self) -> list:
+        windows = []
+        def callback(hwnd, *_):
+            windows.append((hwnd, self._win32gui.GetWindowText(hwnd).strip(), self._win32gui.GetWindowRect(hwnd)))
+        self._win32gui.EnumWindows(callback, None)
+        return windows
+
+    def get_window_rect(self, handle) -> tuple:
+        try:
+            return self._win32gui.GetWindowRect(handle)
+        except Exception:
+            return None
+
+    # Only the rect of the matching window is queried
+    def find_window(self, title: str) -> GameWindow:
+        handles = []
+        def callback(hwnd, *_):
+            if self._win32gui.GetWindowText(hwnd).strip() == title:
+                handles.append(hwnd)
+        self._win32gui.EnumWindows(callback, None)
+        if not handles:
+            return None
+        return window_from_rect(handles[0], self._win32gui.GetWindowRect(handles[0]))
+
+    def focus_window(self, handle) -> None:
+        try:
+            self._win32gui.SetForegroundWindow(handle)
+        except Exception:
+            #SetForegroundWindow seems to fail randomly
+            pass
+
+    def is_foreground(self, handle) -> bool:
+        return self._win32gui.GetForegroundWindow() == handle
+
+
+# Serves a fixed list of windows
+# Used for test images, and allows testing window discovery without a desktop
+class StaticWindowSource(WindowSource):
+    def __init__(self, windows: list) -> None:
+        self.windows = windows
+
+    def list_windows(self) -> list:
+        return list(self.windows)
+
+
+def window_from_rect(handle, rect: tuple) -> GameWindow:
+    return GameWindow(handle,
+                      np.array([rect[0], rect[1]], int),
+                      np.array([rect[2] - rect[0], rect[3] - rect[1]], int))
+
+
+# Creates a window covering the monitor with the given index, in the format of mss monitors
+def window_from_monitor(monitors: list, index: int) -> GameWindow:
+    index = min(index, len(monitors) - 1)
+    monitor = monitors[index]
+    return GameWindow(None,
+                      np.array([monitor["left"], monitor["top"]], int),
+                      np.array([monitor["width"], monitor["height"]], int))
+
+
+# Returns the index of the monitor containing the center of the window, in the format of mss monitors
+# 0 if the center is outside of all single monitors
+def get_monitor_index(monitors: list, window: GameWindow) -> int:
+    center = window.position + window.size // 2
+    for index, monitor in enumerate(monitors[1:], 1):
+        if monitor["left"] <= center[0] < monitor["left"] + monitor["width"] and \
+           monitor["top"] <= center[1] < monitor["top"] + monitor["height"]:
+            return index
+    return 0
+
+
+# Looks up the game window, returns as soon as it's found
+# Retries with an exponentially increasing delay until the timeout, returns None if not found
+def discover_window(source: WindowSource, title: str = GAME_WINDOW_TITLE,
+                    timeout: float = DISCOVERY_TIMEOUT, initial_delay: float = DISCOVERY_INITIAL_DELAY,
+                    sleep_fn = sleep, clock = perf_counter) -> GameWindow:
+    deadline = clock() + timeout
+    delay = initial_delay
+    while True:
+        window = source.find_window(title)
+        if window is not None:
+            return window
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return None
+        sleep_fn(min(delay, remaining))
+        delay *= 2
+
+
+# Brings the window to the foreground and waits until it's active, at most for the timeout
+def focus_window(source: WindowSource, handle, timeout: float = FOREGROUND_TIMEOUT,
+                 sleep_fn = sleep, clock = perf_counter) -> bool:
+    source.focus_window(handle)
+    deadline = clock() + timeout
+    while not source.is_foreground(handle):
+        if clock() > deadline:
+            return False
+        sleep_fn(0.01)
+    return True
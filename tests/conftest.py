@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+import numpy as np
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+# The modules import each other by name, like when running the program from src/autobuy
+sys.path.insert(0, str(REPO_DIR / "src" / "autobuy"))
+
+from web_analyzer import WebAnalyzer, COLOR_PRESTIGE_SMALL, COLOR_PRESTIGE_LARGE
+from frame_source import FileFrameSource
+from window_source import StaticWindowSource, GAME_WINDOW_TITLE
+from logger import muted_log
+
+# Size of the generated game window, its sample points are measured from the game
+WINDOW_SIZE = (2560, 1440)
+BACKGROUND_BGR = 20
+
+
+# Scans generated frames of the Bloodweb through a frame source, like scanning the game window
+class WebFrames:
+    def __init__(self) -> None:
+        self.frame = np.full((WINDOW_SIZE[1], WINDOW_SIZE[0], 3), BACKGROUND_BGR, np.uint8)
+        self.analyzer = WebAnalyzer()
+        # The frame is drawn in place, the source serves it for every scan
+        self.analyzer.set_frame_source(FileFrameSource([self.frame], loop=True))
+        self.analyzer.set_window_source(StaticWindowSource([(None, GAME_WINDOW_TITLE, (0, 0) + WINDOW_SIZE)]))
+        with muted_log():
+            self.analyzer.initialize()
+
+    # Returns the confidently detected nodes of a frame where the given nodes are buyable
+    def scan(self, nodes: list) -> np.ndarray:
+        self.frame[:] = BACKGROUND_BGR
+        for x, y in self.analyzer._web_points[nodes]:
+            self.frame[y - 3:y + 3, x - 1:x + 2] = self.analyzer._color_node_available
+        return self.analyzer.scan_web().get_confident_nodes(0.0)
+
+    # Returns the detected nodes of a frame where only the prestige node is buyable
+    def scan_prestige(self) -> np.ndarray:
+        self.frame[:] = BACKGROUND_BGR
+        for points, colors in ((self.analyzer._small_prestige_points, COLOR_PRESTIGE_SMALL),
+                               (self.analyzer._large_prestige_points, COLOR_PRESTIGE_LARGE)):
+            self.frame[points[:,1], points[:,0]] = colors
+        return self.analyzer.scan_web().get_confident_nodes(0.0)
+
+
+@pytest.fixture
+def web(monkeypatch) -> WebFrames:
+    # The data files are looked up from the working directory
+    monkeypatch.chdir(REPO_DIR)
+    return WebFrames()
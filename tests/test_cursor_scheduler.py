@@ -0,0 +1,87 @@
+import threading
+import time
+from cursor_scheduler import CursorScheduler
+
+TIMEOUT = 5.0
+
+
+# Acquires the cursor in a thread, the order in which the threads got it is appended to order
+def start_waiting(scheduler: CursorScheduler, name: str, ready_time: float, order: list) -> threading.Thread:
+    def run():
+        scheduler.acquire(ready_time)
+        order.append(name)
+        scheduler.release()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until_waiting(scheduler: CursorScheduler, count: int) -> None:
+    end = time.perf_counter() + TIMEOUT
+    while True:
+        with scheduler._condition:
+            if len(scheduler._waiting) == count:
+                return
+        assert time.perf_counter() < end
+        time.sleep(0.001)
+
+
+def test_free_cursor_is_acquired_right_away():
+    scheduler = CursorScheduler()
+    scheduler.acquire(1.0)
+    scheduler.release()
+    scheduler.acquire(0.0)
+    scheduler.release()
+
+
+def test_earliest_ready_time_goes_first():
+    scheduler = CursorScheduler()
+    order = []
+    scheduler.acquire(0.0)
+    threads = [start_waiting(scheduler, name, ready_time, order) for name, ready_time in (("late", 3.0),
+                                                                                          ("early", 1.0),
+                                                                                          ("middle", 2.0))]
+    wait_until_waiting(scheduler, 3)
+    # Nobody gets the cursor while it is in use
+    assert order == []
+    scheduler.release()
+    for thread in threads:
+        thread.join(TIMEOUT)
+    assert order == ["early", "middle", "late"]
+
+
+def test_same_ready_time_goes_in_arrival_order():
+    scheduler = CursorScheduler()
+    order = []
+    scheduler.acquire(0.0)
+    threads = []
+    for name in ("first", "second", "third"):
+        threads.append(start_waiting(scheduler, name, 1.0, order))
+        wait_until_waiting(scheduler, len(threads))
+    scheduler.release()
+    for thread in threads:
+        thread.join(TIMEOUT)
+    assert order == ["first", "second", "third"]
+
+
+def test_exclusive_use():
+    scheduler = CursorScheduler()
+    users = []
+    overlaps = []
+
+    def run(index):
+        for i in range(50):
+            scheduler.acquire(i + index / 10)
+            users.append(index)
+            if len(users) > 1:
+                overlaps.append(list(users))
+            users.remove(index)
+            scheduler.release()
+
+    threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(TIMEOUT)
+        assert not thread.is_alive()
+    assert overlaps == []
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from interval_tuner import IntervalTuner, PHASE_FREE, PHASE_ENTITY, MIN_INTERVALS, MAX_INTERVALS
+
+STREAK = IntervalTuner._success_streak_required
+DECREASE = IntervalTuner._decrease_step
+INCREASE = IntervalTuner._increase_step
+
+
+# Buys with the current interval, purchases faster than the threshold of the game fail
+# Of the other purchases, failure_rate fail at random like game hitches and misread nodes do
+def buy(tuner: IntervalTuner, phase: int, threshold: float, count: int, failure_rate: float = 0.0,
+        rng: np.random.Generator = None) -> None:
+    for _ in range(count):
+        interval = tuner.get_interval(phase)
+        success = interval >= threshold
+        if success and failure_rate > 0 and rng.random() < failure_rate:
+            success = False
+        tuner.record(phase, interval, success)
+
+
+def test_success_streak_shortens_interval():
+    tuner = IntervalTuner((0.1, 0.5))
+    for _ in range(STREAK - 1):
+        tuner.record(PHASE_ENTITY, 0.5, True)
+    assert tuner.get_interval(PHASE_ENTITY) == 0.5
+    tuner.record(PHASE_ENTITY, 0.5, True)
+    assert tuner.get_interval(PHASE_ENTITY) == pytest.approx(0.5 - DECREASE)
+    # The phases are tuned separately
+    assert tuner.get_interval(PHASE_FREE) == 0.1
+
+
+def test_intervals_stay_within_limits():
+    tuner = IntervalTuner((-1.0, 10.0))
+    assert tuner.get_interval(PHASE_FREE) == MIN_INTERVALS[PHASE_FREE]
+    assert tuner.get_interval(PHASE_ENTITY) == MAX_INTERVALS[PHASE_ENTITY]
+    buy(tuner, PHASE_FREE, 0.0, STREAK * 10)
+    assert tuner.get_interval(PHASE_FREE) == MIN_INTERVALS[PHASE_FREE]
+    buy(tuner, PHASE_ENTITY, 100.0, 10)
+    assert tuner.get_interval(PHASE_ENTITY) == MAX_INTERVALS[PHASE_ENTITY]
+
+
+def test_single_failure_only_lengthens_interval():
+    tuner = IntervalTuner((0.0, 0.3))
+    tuner.record(PHASE_ENTITY, 0.3, False)
+    assert tuner.get_interval(PHASE_ENTITY) == pytest.approx(0.3 + INCREASE)
+    assert tuner.to_dict()["unsafe"][PHASE_ENTITY] is None
+    # Nothing keeps the interval from going back down
+    buy(tuner, PHASE_ENTITY, 0.0, STREAK * 10)
+    assert tuner.get_interval(PHASE_ENTITY) < 0.3
+
+
+def test_repeated_failures_keep_interval_above_them():
+    tuner = IntervalTuner((0.0, 0.3))
+    tuner.record(PHASE_ENTITY, 0.3, False)
+    tuner.record(PHASE_ENTITY, 0.3, False)
+    assert tuner.to_dict()["unsafe"][PHASE_ENTITY] == 0.3
+    buy(tuner, PHASE_ENTITY, 0.0, STREAK)
+    assert tuner.get_interval(PHASE_ENTITY) > 0.3
+
+
+def test_unsafe_bound_is_probed_again():
+    tuner = IntervalTuner((0.0, 0.3))
+    tuner.record(PHASE_ENTITY, 0.3, False)
+    tuner.record(PHASE_ENTITY, 0.3, False)
+    # The failures were a temporary slowdown, purchases succeed at any interval now
+    buy(tuner, PHASE_ENTITY, 0.0, STREAK * 20)
+    assert tuner.get_interval(PHASE_ENTITY) < 0.3
+    unsafe = tuner.to_dict()["unsafe"][PHASE_ENTITY]
+    assert unsafe is None or unsafe < 0.3
+
+
+@pytest.mark.parametrize("threshold", [0.15, 0.2, 0.35])
+def test_converges_to_threshold(threshold):
+    tuner = IntervalTuner((0.0, 0.6))
+    buy(tuner, PHASE_ENTITY, threshold, 2000)
+    intervals = []
+    for _ in range(500):
+        buy(tuner, PHASE_ENTITY, threshold, 1)
+        intervals.append(tuner.get_interval(PHASE_ENTITY))
+    # Settles just above the threshold, probing below it only now and then
+    assert threshold - DECREASE <= np.mean(intervals) <= threshold + INCREASE + DECREASE
+    assert min(intervals) >= threshold - 2 * DECREASE
+
+
+def test_random_failures_do_not_ratchet_interval():
+    tuner = IntervalTuner((0.0, 0.6))
+    rng = np.random.default_rng(0)
+    buy(tuner, PHASE_ENTITY, 0.2, 5000, 0.01, rng)
+    assert tuner.get_interval(PHASE_ENTITY) < 0.2 + 3 * INCREASE
+
+
+def test_report_counts_purchases():
+    tuner = IntervalTuner((0.0, 0.3))
+    tuner.record(PHASE_ENTITY, 0.3, True)
+    tuner.record(PHASE_ENTITY, 0.3, False)
+    assert "1 missed of 2 purchases" in tuner.get_report()
+
+
+def test_dict_round_trip_clamps_intervals():
+    tuner = IntervalTuner((0.0, 0.3))
+    tuner.record(PHASE_ENTITY, 0.3, False)
+    tuner.record(PHASE_ENTITY, 0.3, False)
+    loaded = IntervalTuner()
+    loaded.from_dict(tuner.to_dict())
+    assert loaded.to_dict() == tuner.to_dict()
+
+    loaded.from_dict({"intervals": [-1.0, 100.0]})
+    assert loaded.get_interval(PHASE_FREE) == MIN_INTERVALS[PHASE_FREE]
+    assert loaded.get_interval(PHASE_ENTITY) == MAX_INTERVALS[PHASE_ENTITY]
@@ -0,0 +1,43 @@
+import numpy as np
+from time import sleep
+from clock import VirtualClock
+from logger import muted_log
+from session_recorder import SessionRecorder, read_recording, RECORD_INFO, RECORD_FRAME, RECORD_EVENT, RECORD_GRAB
+
+
+def record(path, max_size: int, frame_count: int) -> list:
+    clock = VirtualClock()
+    recorder = SessionRecorder(path, clock=clock.now, max_size=max_size)
+    rng = np.random.default_rng(0)
+    with muted_log():
+        recorder.start({"window_size": [2560, 1440]})
+        for index in range(frame_count):
+            recorder.record_frame(rng.integers(0, 256, (40, 30, 3), np.uint8))
+            recorder.record_grab((10, 20, 11, 24), np.full((4, 1, 3), index, np.uint8))
+            recorder.record_event("click", pos=[index, 0])
+            clock.sleep(0.1)
+            # Frames beyond the queue limit would be dropped, let the writer catch up
+            while recorder._queued_frames > 0:
+                sleep(0.001)
+        recorder.close()
+    return list(read_recording(path))
+
+
+def test_grabs_are_read_back_with_their_bbox(tmp_path):
+    records = record(tmp_path / "session.babrec", 10 ** 9, 3)
+    assert records[0][0] == RECORD_INFO
+    grabs = [data for kind, _, data in records if kind == RECORD_GRAB]
+    assert [bbox for bbox, _ in grabs] == [(10, 20, 11, 24)] * 3
+    assert [int(image[0, 0, 0]) for _, image in grabs] == [0, 1, 2]
+    assert grabs[0][1].shape == (4, 1, 3)
+
+
+def test_size_limit_stops_frames_but_keeps_events(tmp_path):
+    path = tmp_path / "session.babrec"
+    # A random frame doesn't compress, so only about two fit
+    records = record(path, 8000, 10)
+    kinds = [kind for kind, _, _ in records]
+    assert 0 < kinds.count(RECORD_FRAME) < 10
+    assert kinds.count(RECORD_EVENT) == 10
+    # Grabs stop along with the frames
+    assert kinds.count(RECORD_GRAB) < 10
@@ -0,0 +1,97 @@
+import numpy as np
+from clock import VirtualClock
+from stall_watchdog import StallWatchdog, StallAction, RECOVERY_STEP_TIME
+
+TIMEOUT = 30.0
+
+
+# Scans the same web every second until the watchdog acts, returns the action and when it was taken
+def wait_for_action(watchdog: StallWatchdog, clock: VirtualClock, nodes: np.ndarray, limit: float = 100.0):
+    end = clock.now() + limit
+    while clock.now() < end:
+        clock.sleep(1.0)
+        action = watchdog.update(nodes, clock.now())
+        if action is not None:
+            return action, clock.now()
+    return None, clock.now()
+
+
+def test_escalates_in_order(web):
+    clock = VirtualClock()
+    watchdog = StallWatchdog(TIMEOUT)
+    watchdog.reset(clock.now())
+    # A popup covers the web, the same nodes are detected on every scan
+    nodes = web.scan([4, 7])
+    assert watchdog.update(nodes, clock.now()) is None
+
+    action, refocused = wait_for_action(watchdog, clock, nodes)
+    assert action == StallAction.REFOCUS
+    assert refocused == TIMEOUT
+    assert watchdog.get_stalled_time(clock.now()) == TIMEOUT
+    action, resolved = wait_for_action(watchdog, clock, nodes)
+    assert action == StallAction.RESOLVE_WINDOW
+    assert resolved - refocused == RECOVERY_STEP_TIME
+    action, paused = wait_for_action(watchdog, clock, nodes)
+    assert action == StallAction.PAUSE
+    assert paused - resolved == RECOVERY_STEP_TIME
+    # Nothing is left to try
+    assert wait_for_action(watchdog, clock, nodes)[0] is None
+
+
+def test_progress_restarts_escalation(web):
+    clock = VirtualClock()
+    watchdog = StallWatchdog(TIMEOUT)
+    nodes = web.scan([4, 7])
+    watchdog.update(nodes, clock.now())
+    assert wait_for_action(watchdog, clock, nodes)[0] == StallAction.REFOCUS
+
+    # Refocusing worked, a node was bought
+    nodes = web.scan([7])
+    assert watchdog.update(nodes, clock.now()) is None
+    assert watchdog.get_stalled_time(clock.now()) == 0
+    action, time = wait_for_action(watchdog, clock, nodes)
+    assert action == StallAction.REFOCUS
+    assert watchdog.get_stalled_time(time) == TIMEOUT
+
+
+def test_node_order_is_not_progress():
+    clock = VirtualClock()
+    watchdog = StallWatchdog(TIMEOUT)
+    watchdog.update(np.array([1, 2, 3]), clock.now())
+    clock.sleep(TIMEOUT)
+    assert watchdog.update(np.array([3, 1, 2]), clock.now()) == StallAction.REFOCUS
+
+
+def test_short_timeout_shortens_recovery_steps():
+    clock = VirtualClock()
+    watchdog = StallWatchdog(2.0)
+    nodes = np.array([1])
+    watchdog.update(nodes, clock.now())
+    actions = []
+    for _ in range(10):
+        clock.sleep(1.0)
+        actions.append(watchdog.update(nodes, clock.now()))
+    assert actions[:6] == [None, StallAction.REFOCUS, None, StallAction.RESOLVE_WINDOW, None, StallAction.PAUSE]
+    assert actions[6:] == [None] * 4
+
+
+def test_disabled_never_acts():
+    clock = VirtualClock()
+    watchdog = StallWatchdog()
+    assert not watchdog.is_enabled()
+    assert wait_for_action(watchdog, clock, np.array([1]), 1000.0)[0] is None
+
+
+def test_reset_waits_for_full_timeout_again():
+    clock = VirtualClock()
+    watchdog = StallWatchdog(TIMEOUT)
+    nodes = np.array([1])
+    watchdog.update(nodes, clock.now())
+    wait_for_action(watchdog, clock, nodes)
+    wait_for_action(watchdog, clock, nodes)
+    # Resumed after pausing
+    watchdog.reset(clock.now())
+    watchdog.update(nodes, clock.now())
+    action, time = wait_for_action(watchdog, clock, nodes)
+    assert action == StallAction.REFOCUS
+    assert watchdog.get_stalled_time(time) == TIMEOUT
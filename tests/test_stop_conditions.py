@@ -0,0 +1,68 @@
+import pytest
+from session_metrics import SessionMetrics, NODE_COSTS
+from stop_conditions import StopConditions
+from web_analyzer import Rarity
+
+
+def test_disabled_by_default():
+    conditions = StopConditions()
+    assert not conditions.is_enabled()
+    metrics = SessionMetrics()
+    for _ in range(100):
+        metrics.record_node(Rarity.ULTRA_RARE)
+        metrics.record_level()
+    metrics.record_prestige(3.0)
+    assert conditions.get_reached(metrics) is None
+
+
+def test_node_goal_reached_at_purchase():
+    conditions = StopConditions(nodes=3)
+    assert conditions.is_enabled()
+    metrics = SessionMetrics()
+    for _ in range(2):
+        metrics.record_node(Rarity.COMMON)
+        assert conditions.get_reached(metrics) is None
+    metrics.record_node(Rarity.COMMON)
+    assert conditions.get_reached(metrics) == "bought 3 nodes"
+
+
+def test_bloodpoint_goal_uses_node_costs():
+    goal = NODE_COSTS[Rarity.COMMON] + NODE_COSTS[Rarity.EVENT]
+    conditions = StopConditions(bloodpoints=goal)
+    metrics = SessionMetrics()
+    metrics.record_node(Rarity.COMMON)
+    assert conditions.get_reached(metrics) is None
+    metrics.record_node(Rarity.EVENT)
+    assert metrics.bloodpoints_spent == goal
+    assert conditions.get_reached(metrics) == f"spent an estimated {goal:,} bloodpoints"
+
+
+def test_level_goal_counts_prestige_levels():
+    conditions = StopConditions(levels=2)
+    metrics = SessionMetrics()
+    metrics.record_level()
+    assert conditions.get_reached(metrics) is None
+    metrics.record_prestige(4.0)
+    assert conditions.get_reached(metrics) == "completed 2 levels"
+
+
+def test_prestige_goal():
+    conditions = StopConditions(prestiges=1)
+    metrics = SessionMetrics()
+    for _ in range(5):
+        metrics.record_level()
+    assert conditions.get_reached(metrics) is None
+    metrics.record_prestige(4.0)
+    assert conditions.get_reached(metrics) == "prestiges done: 1"
+
+
+@pytest.mark.parametrize("goals, expected", [
+    (dict(nodes=1, bloodpoints=1, levels=1, prestiges=1), "bought 1 nodes"),
+    (dict(nodes=5, bloodpoints=1, levels=1, prestiges=1), "spent an estimated 3,000 bloodpoints"),
+    (dict(nodes=5, bloodpoints=10**6, levels=1, prestiges=1), "completed 1 levels"),
+])
+def test_first_goal_reached_is_reported(goals, expected):
+    metrics = SessionMetrics()
+    metrics.record_node(Rarity.COMMON)
+    metrics.record_prestige(4.0)
+    assert StopConditions(**goals).get_reached(metrics) == expected
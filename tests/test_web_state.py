@@ -0,0 +1,129 @@
+from clock import VirtualClock
+from interval_tuner import PHASE_FREE, PHASE_ENTITY
+from web_state import WebStateTracker, WebState, FREE_NODE_COUNT, LEVEL_COMPLETE_CONFIRM_TIME, EMPTY_RESCAN_DELAY, \
+    ENTITY_CONFIRM_TIME, SCAN_DELAYS
+
+
+# Updates the tracker from the nodes of a scan made the given delay after the previous one
+def update(tracker: WebStateTracker, clock: VirtualClock, nodes, delay: float = 0.05) -> bool:
+    clock.sleep(delay)
+    return tracker.update(nodes, clock.now())
+
+
+def start_level(web, tracker: WebStateTracker, clock: VirtualClock, nodes: list) -> None:
+    update(tracker, clock, web.scan(nodes))
+    update(tracker, clock, web.scan(nodes))
+    assert tracker.state == WebState.FREE_BUY
+
+
+def test_starts_level_once_web_stops_changing(web):
+    tracker, clock = WebStateTracker(), VirtualClock()
+    assert tracker.state == WebState.LEVEL_COMPLETE
+
+    assert update(tracker, clock, web.scan([1, 2]))
+    assert tracker.state == WebState.LEVEL_START
+    # Nodes still appearing during the level up animation
+    assert not update(tracker, clock, web.scan([1, 2, 3]))
+    assert tracker.state == WebState.LEVEL_START
+    assert update(tracker, clock, web.scan([3, 1, 2]))
+    assert tracker.state == WebState.FREE_BUY
+    assert tracker.get_phase() == PHASE_FREE
+
+
+def test_entity_phase_after_free_purchases(web):
+    tracker, clock = WebStateTracker(), VirtualClock()
+    nodes = list(range(10))
+    start_level(web, tracker, clock, nodes)
+
+    for bought in range(FREE_NODE_COUNT):
+        assert tracker.get_free_nodes_left() == FREE_NODE_COUNT - bought
+        tracker.on_bought(nodes.pop(0))
+        # Pending purchases count before they are verified
+        assert tracker.get_free_nodes_left() == FREE_NODE_COUNT - bought - 1
+        update(tracker, clock, web.scan(nodes))
+    assert tracker.state == WebState.ENTITY
+    assert tracker.get_phase() == PHASE_ENTITY
+    assert tracker.get_free_nodes_left() == 0
+
+
+def test_entity_phase_when_node_stays_gone_without_purchase(web):
+    tracker, clock = WebStateTracker(), VirtualClock()
+    start_level(web, tracker, clock, [1, 2, 3, 4])
+
+    tracker.on_bought(1)
+    assert not update(tracker, clock, web.scan([2, 3, 4]))
+    assert tracker.state == WebState.FREE_BUY
+    # Node 2 was taken by the Entity
+    assert not update(tracker, clock, web.scan([3, 4]))
+    assert not update(tracker, clock, web.scan([3, 4]), ENTITY_CONFIRM_TIME / 2)
+    assert tracker.state == WebState.FREE_BUY
+    assert update(tracker, clock, web.scan([3, 4]), ENTITY_CONFIRM_TIME / 2)
+    assert tracker.state == WebState.ENTITY
+
+
+def test_missed_detection_keeps_free_phase(web):
+    tracker, clock = WebStateTracker(), VirtualClock()
+    start_level(web, tracker, clock, [1, 2, 3, 4])
+
+    # Node 2 is missed in one frame, e.g. highlighted by the cursor
+    assert not update(tracker, clock, web.scan([1, 3, 4]))
+    assert not update(tracker, clock, web.scan([1, 2, 3, 4]), ENTITY_CONFIRM_TIME)
+    assert not update(tracker, clock, web.scan([1, 2, 3, 4]), ENTITY_CONFIRM_TIME)
+    assert tracker.state == WebState.FREE_BUY
+    assert tracker.get_free_nodes_left() == FREE_NODE_COUNT
+
+
+def test_level_complete_needs_empty_web_for_confirm_time(web):
+    tracker, clock = WebStateTracker(), VirtualClock()
+    start_level(web, tracker, clock, [1, 2])
+
+    # A single empty scan, e.g. a node highlighted by the cursor
+    assert not update(tracker, clock, web.scan([]))
+    assert tracker.get_scan_delay() == EMPTY_RESCAN_DELAY
+    assert not update(tracker, clock, web.scan([1, 2]))
+    assert tracker.state == WebState.FREE_BUY
+
+    assert not update(tracker, clock, web.scan([]))
+    assert not update(tracker, clock, web.scan([]), LEVEL_COMPLETE_CONFIRM_TIME / 2)
+    assert update(tracker, clock, web.scan([]), LEVEL_COMPLETE_CONFIRM_TIME / 2)
+    assert tracker.state == WebState.LEVEL_COMPLETE
+    assert tracker.get_scan_delay() == SCAN_DELAYS[WebState.LEVEL_COMPLETE]
+
+
+def test_empty_web_ends_level_start_right_away(web):
+    tracker, clock = WebStateTracker(), VirtualClock()
+    update(tracker, clock, web.scan([1, 2]))
+    assert update(tracker, clock, web.scan([]), 0.0)
+    assert tracker.state == WebState.LEVEL_COMPLETE
+
+
+def test_prestige_cycle(web):
+    tracker, clock = WebStateTracker(), VirtualClock()
+    assert update(tracker, clock, web.scan_prestige())
+    assert tracker.state == WebState.PRESTIGE_AVAILABLE
+
+    tracker.on_prestige()
+    assert tracker.state == WebState.PRESTIGE_ANIMATION
+    # The web is empty during the animation
+    assert not update(tracker, clock, web.scan([]), 1.0)
+    assert tracker.state == WebState.PRESTIGE_ANIMATION
+    assert update(tracker, clock, web.scan([5, 6]))
+    assert tracker.state == WebState.LEVEL_START
+
+
+def test_prestige_node_still_there_is_tried_again(web):
+    tracker, clock = WebStateTracker(), VirtualClock()
+    update(tracker, clock, web.scan_prestige())
+    tracker.on_prestige()
+    assert update(tracker, clock, web.scan_prestige())
+    assert tracker.state == WebState.PRESTIGE_AVAILABLE
+
+
+def test_reset_forgets_level(web):
+    tracker, clock = WebStateTracker(), VirtualClock()
+    start_level(web, tracker, clock, [1, 2, 3])
+    tracker.on_bought(1)
+    tracker.reset()
+    assert tracker.state == WebState.LEVEL_COMPLETE
+    update(tracker, clock, web.scan([2, 3]))
+    assert tracker.state == WebState.LEVEL_START
@@ -0,0 +1,112 @@
+import pytest
+from clock import VirtualClock
+from window_source import StaticWindowSource, discover_window, focus_window, window_from_rect, get_monitor_index, \
+    GAME_WINDOW_TITLE, DISCOVERY_TIMEOUT, DISCOVERY_INITIAL_DELAY, FOREGROUND_TIMEOUT
+
+GAME_RECT = (100, 50, 2660, 1490)
+OTHER_WINDOW = (1, "Steam", (0, 0, 800, 600))
+
+
+# Lists the game window only from the given lookup on, like a game that is still starting
+class StartingWindowSource(StaticWindowSource):
+    def __init__(self, found_after: int) -> None:
+        super().__init__([OTHER_WINDOW])
+        self.found_after = found_after
+        self.lookups = 0
+
+    def list_windows(self) -> list:
+        self.lookups += 1
+        if self.lookups > self.found_after:
+            return [OTHER_WINDOW, (2, GAME_WINDOW_TITLE, GAME_RECT)]
+        return super().list_windows()
+
+
+# Virtual clock that remembers every sleep
+class SleepRecorder(VirtualClock):
+    def __init__(self) -> None:
+        super().__init__()
+        self.sleeps = []
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        super().sleep(seconds)
+
+
+def discover(source, clock: SleepRecorder, **kwargs):
+    return discover_window(source, sleep_fn=clock.sleep, clock=clock.now, **kwargs)
+
+
+def test_returns_without_waiting_when_window_exists():
+    clock = SleepRecorder()
+    window = discover(StartingWindowSource(0), clock)
+    assert window.handle == 2
+    assert list(window.position) == [100, 50]
+    assert list(window.size) == [2560, 1440]
+    assert clock.sleeps == []
+    assert clock.now() == 0
+
+
+def test_returns_on_first_lookup_that_finds_window():
+    clock = SleepRecorder()
+    source = StartingWindowSource(3)
+    assert discover(source, clock) is not None
+    assert source.lookups == 4
+    # The delay doubles after every failed lookup
+    assert clock.sleeps == pytest.approx([DISCOVERY_INITIAL_DELAY * 2 ** i for i in range(3)])
+    assert clock.now() == pytest.approx(DISCOVERY_INITIAL_DELAY * 7)
+
+
+def test_gives_up_at_timeout():
+    clock = SleepRecorder()
+    source = StaticWindowSource([OTHER_WINDOW])
+    assert discover(source, clock) is None
+    # The last delay is cut short so the timeout isn't overshot
+    assert clock.now() == pytest.approx(DISCOVERY_TIMEOUT)
+    assert clock.sleeps[-1] < clock.sleeps[-2] * 2
+    assert all(later == pytest.approx(earlier * 2) for earlier, later in zip(clock.sleeps[:-2], clock.sleeps[1:-1]))
+
+
+def test_custom_timeout_bounds_wait():
+    clock = SleepRecorder()
+    assert discover(StaticWindowSource([]), clock, timeout=0.1, initial_delay=0.03) is None
+    assert clock.sleeps == pytest.approx([0.03, 0.06, 0.01])
+    assert clock.now() == pytest.approx(0.1)
+
+
+# Becomes the foreground window after the given amount of checks
+class FocusingWindowSource(StaticWindowSource):
+    def __init__(self, focused_after: int) -> None:
+        super().__init__([(2, GAME_WINDOW_TITLE, GAME_RECT)])
+        self.focused_after = focused_after
+        self.checks = 0
+        self.focused = False
+
+    def focus_window(self, handle) -> None:
+        self.focused = True
+
+    def is_foreground(self, handle) -> bool:
+        self.checks += 1
+        return self.focused and self.checks > self.focused_after
+
+
+def test_focus_waits_until_foreground():
+    clock = SleepRecorder()
+    source = FocusingWindowSource(2)
+    assert focus_window(source, 2, sleep_fn=clock.sleep, clock=clock.now)
+    assert len(clock.sleeps) == 2
+
+
+def test_focus_gives_up_after_timeout():
+    clock = SleepRecorder()
+    assert not focus_window(FocusingWindowSource(10 ** 6), 2, sleep_fn=clock.sleep, clock=clock.now)
+    assert FOREGROUND_TIMEOUT < clock.now() <= FOREGROUND_TIMEOUT + 0.011
+
+
+def test_monitor_of_window_center():
+    left = {"left": 0, "top": 0, "width": 2560, "height": 1440}
+    right = {"left": 2560, "top": 0, "width": 1920, "height": 1080}
+    monitors = [{"left": 0, "top": 0, "width": 4480, "height": 1440}, left, right]
+    assert get_monitor_index(monitors, window_from_rect(2, GAME_RECT)) == 1
+    # Mostly on the right monitor
+    assert get_monitor_index(monitors, window_from_rect(2, (2000, 0, 4000, 1000))) == 2
+    assert get_monitor_index(monitors, window_from_rect(2, (5000, 0, 6000, 1000))) == 0